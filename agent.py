@@ -4,7 +4,6 @@ from typing import Annotated, Sequence, Optional
 from langchain_core.messages import BaseMessage
 from langgraph.graph.message import add_messages
 from langchain_core.messages import SystemMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import START, END, StateGraph
 from langgraph.prebuilt import ToolNode, tools_condition
@@ -25,13 +24,16 @@ class ModelConfig:
     api_key: str
     base_url: Optional[str] = None
 
-model_configurations = {
-    "Google Gemini": ModelConfig(
-         model_name="models/gemini-2.0-flash",
-         api_key=__import__("streamlit").secrets["GEMINI_API_KEY"],
-         base_url=None,
-    )
-}
+def get_model_configurations() -> dict:
+    # Secrets are read when an agent is created rather than at import time.
+    import streamlit as st
+    return {
+        "Google Gemini": ModelConfig(
+             model_name="models/gemini-2.0-flash",
+             api_key=st.secrets["GEMINI_API_KEY"],
+             base_url=None,
+        )
+    }
 
 sys_msg = SystemMessage(
     content="""You're an AI assistant specializing in data analysis with Snowflake SQL. When providing responses, strive to be friendly and conversational (like a tutor or friend). You have access to the following tools:
@@ -40,12 +42,15 @@ sys_msg = SystemMessage(
     """
 )
 
-# Tools are imported from tools.py (see that file)
-from tools import retriever_tool, search
-tools = [retriever_tool, search]
+def get_tools() -> list:
+    # Tools are imported from tools.py (see that file) on first agent creation.
+    from tools import retriever_tool, search
+    return [retriever_tool, search]
 
 def create_agent(callback_handler) -> StateGraph:
-    config = model_configurations["Google Gemini"]
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    config = get_model_configurations()["Google Gemini"]
+    tools = get_tools()
     if not config.api_key:
         raise ValueError("API key for Google Gemini is not set. Please check your secrets configuration.")
     llm = ChatGoogleGenerativeAI(
@@ -0,0 +1,167 @@
+# batch.py
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.backends import BACKENDS, connect
+
+def load_questions(path: str) -> list:
+    """
+    Read questions from a text file (one per line, blank lines and # comments
+    skipped) or a JSONL file of {"question": ..., "chart": bool} objects.
+    """
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                questions.append({"question": item["question"], "chart": bool(item.get("chart", False))})
+            else:
+                questions.append({"question": line, "chart": False})
+    return questions
+
+class ResultWriter:
+    """
+    Streams result records to a .jsonl or .parquet file as they complete.
+    Parquet records are buffered into row groups of `batch_size`.
+    """
+
+    COLUMNS = ("index", "question", "sql", "answer", "result", "error", "tokens", "seconds")
+
+    def __init__(self, path: str, batch_size: int = 50):
+        self.path = path
+        self.batch_size = batch_size
+        self.parquet = path.endswith(".parquet")
+        self._buffer = []
+        self._writer = None
+        self._lock = threading.Lock()
+        self._file = None if self.parquet else open(path, "w", encoding="utf-8")
+
+    def write(self, record: dict) -> None:
+        with self._lock:
+            if not self.parquet:
+                self._file.write(json.dumps(record, default=str) + "\n")
+                self._file.flush()
+                return
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def _flush(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if not self._buffer:
+            return
+        table = pa.Table.from_pylist(
+            [{col: record.get(col) for col in self.COLUMNS} for record in self._buffer],
+            schema=pa.schema([
+                ("index", pa.int64()), ("question", pa.string()), ("sql", pa.string()),
+                ("answer", pa.string()), ("result", pa.string()), ("error", pa.string()),
+                ("tokens", pa.int64()), ("seconds", pa.float64()),
+            ]),
+        )
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+        self._buffer = []
+
+    def close(self) -> None:
+        with self._lock:
+            if self.parquet:
+                self._flush()
+                if self._writer is not None:
+                    self._writer.close()
+            else:
+                self._file.close()
+
+def answer_question(backend, db, index: int, item: dict, budget: float, backend_name: str = "postgresql") -> dict:
+    """
+    Run one question through the chat pipeline and return its result record.
+    The pipeline steps are called directly rather than through the UI helpers,
+    which show errors in Streamlit and return fallback text or an empty frame:
+    here a model or query failure ends up in the record's "error".
+    """
+    from utils import metering, resilience
+    from utils.fetch import format_result
+
+    record = {"index": index, "question": item["question"], "sql": None, "answer": None,
+              "result": None, "error": None}
+    start = time.perf_counter()
+    deadline = resilience.Deadline(budget)
+    turn = metering.start_turn("batch")
+    try:
+        record["sql"] = backend.generate_sql(item["question"], db, [], None, deadline)
+        df, record["sql"] = backend.execute_sql_with_repair(record["sql"], db, None, deadline)
+        if item["chart"]:
+            record["result"] = format_result(df)
+        else:
+            record["answer"] = resilience.invoke(f"{backend_name}_response", backend.get_response_chain(), {
+                "question": item["question"],
+                "chat_history": [],
+                "db": db,
+                "query": record["sql"],
+                "response": format_result(df),
+            }, deadline=deadline)
+    except Exception as e:
+        # SQLRepairError carries the last query tried.
+        record["sql"] = getattr(e, "query", None) or record["sql"]
+        record["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        metering.finish_turn(turn)
+    record["tokens"] = turn.total().total_tokens
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+def run_batch(args) -> int:
+    from utils import resilience
+
+    questions = load_questions(args.questions)
+    backend, db = connect(args.backend, args.uri, args.concurrency)
+    writer = ResultWriter(args.output)
+    budget = args.budget or resilience.turn_budget()
+    failures = 0
+    start = time.perf_counter()
+    try:
+        # Every worker shares the backend's compiled chains, the schema cache
+        # and the engine pool, so only the first question pays to build them.
+        with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="batch") as pool:
+            futures = [pool.submit(answer_question, backend, db, i, item, budget, args.backend) for i, item in enumerate(questions)]
+            for done, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                failures += record["error"] is not None
+                writer.write(record)
+                print(f"[{done}/{len(questions)}] {record['seconds']:.1f}s {record['question'][:60]}", file=sys.stderr)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(questions)} questions in {elapsed:.1f}s ({len(questions) / elapsed if elapsed else 0:.2f}/s), "
+        f"{failures} failed, concurrency {args.concurrency} -> {args.output}",
+        file=sys.stderr,
+    )
+    return 1 if failures else 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Answer a file of questions without the Streamlit UI.")
+    parser.add_argument("questions", help="Questions file: .txt (one per line) or .jsonl ({\"question\": ..., \"chart\": true}).")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="postgresql", help="Chat backend to use.")
+    parser.add_argument("--uri", default="", help="SQLAlchemy URI, or \"local\" for the embedded database built from data/*.csv; defaults to the Snowflake secrets for --backend snowflake.")
+    parser.add_argument("--output", default="answers.jsonl", help="Output file, .jsonl or .parquet.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Questions answered at the same time.")
+    parser.add_argument("--budget", type=float, default=None, help="Seconds of LLM time per question (default LLM_TURN_BUDGET).")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.backend == "postgresql" and not args.uri:
+        build_parser().error("--uri is required for the postgresql backend")
+    sys.exit(run_batch(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# benchmark.py
+import argparse
+import subprocess
+import sys
+import time
+
+# Modules on the main.py cold-start path, in the order the app first needs them.
+IMPORT_TARGETS = [
+    "streamlit",
+    "utils.snowddl",
+    "utils.snowchat_ui",
+    "local_chat",
+    "snowflake_chat",
+    "pandas",
+    "matplotlib.pyplot",
+]
+
+def profile_import(module: str) -> list:
+    """
+    Import `module` in a fresh interpreter with `-X importtime` and return
+    (cumulative_us, self_us, name) tuples for every module it pulled in.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"import {module} failed")
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append((int(cumulative_us), int(self_us), name.strip()))
+    return entries
+
+def run_imports(args):
+    modules = args.modules or IMPORT_TARGETS
+    print(f"{'module':<24}{'cold import (ms)':>18}{'modules loaded':>16}")
+    heaviest = {}
+    for module in modules:
+        try:
+            entries = profile_import(module)
+        except RuntimeError as e:
+            print(f"{module:<24}{'error':>18}  {e}")
+            continue
+        total_us = next((c for c, _, name in entries if name == module), max(c for c, _, _ in entries))
+        print(f"{module:<24}{total_us / 1000:>18.1f}{len(entries):>16}")
+        for cumulative_us, self_us, name in entries:
+            heaviest[name] = max(heaviest.get(name, 0), self_us)
+    if heaviest:
+        print(f"\nTop {args.top} imports by self time:")
+        for name, self_us in sorted(heaviest.items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+            print(f"  {name:<48}{self_us / 1000:>10.1f} ms")
+
+def time_fetch(fn, repeat: int):
+    """Run `fn` `repeat` times and return (best_seconds, rows)."""
+    best, rows = float("inf"), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+        rows = result.num_rows if hasattr(result, "num_rows") else len(result)
+    return best, rows
+
+def run_fetch(args):
+    from sqlalchemy import create_engine
+    from utils import fetch
+
+    engine = create_engine(args.uri)
+    native = fetch.native_fetcher(engine)
+    paths = [("read_sql", lambda: fetch.fetch_generic(args.query, engine))]
+    if native is not None:
+        paths.append((f"{engine.dialect.name} native", lambda: native(args.query, engine)))
+        if args.arrow:
+            paths.append((f"{engine.dialect.name} arrow", lambda: native(args.query, engine, arrow=True)))
+    print(f"{'path':<24}{'rows':>12}{'best (s)':>12}{'rows/s':>16}")
+    for name, fn in paths:
+        try:
+            seconds, rows = time_fetch(fn, args.repeat)
+        except Exception as e:
+            print(f"{name:<24}{'error':>12}  {e}")
+            continue
+        print(f"{name:<24}{rows:>12}{seconds:>12.3f}{rows / seconds if seconds else 0:>16,.0f}")
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Performance benchmarks for SQL-Snowflake-chat.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    imports = subparsers.add_parser("imports", help="Profile cold import time of the app modules.")
+    imports.add_argument("modules", nargs="*", help="Modules to profile (defaults to the main.py cold-start path).")
+    imports.add_argument("--top", type=int, default=15, help="Number of heaviest imports to list.")
+    imports.set_defaults(func=run_imports)
+
+    fetch = subparsers.add_parser("fetch", help="Compare rows/s of the generic and native result fetch paths.")
+    fetch.add_argument("--uri", required=True, help="SQLAlchemy URI, e.g. postgresql+psycopg2://user@localhost:5432/store_sales")
+    fetch.add_argument("--query", default="SELECT * FROM transactions", help="Query to fetch.")
+    fetch.add_argument("--repeat", type=int, default=3, help="Runs per path; the best time is reported.")
+    fetch.add_argument("--arrow", action="store_true", help="Also time the native path returning a pyarrow Table.")
+    fetch.set_defaults(func=run_fetch)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
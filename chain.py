@@ -1,5 +1,6 @@
 # chain.py
 from dataclasses import dataclass, field
+from functools import lru_cache
 from operator import itemgetter
 from typing import Any, Callable, Dict, Optional
 import streamlit as st
@@ -10,15 +11,17 @@ from langchain.vectorstores import SupabaseVectorStore
 from langchain_core.messages import get_buffer_string
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnableParallel, RunnablePassthrough
-from langchain_google_genai import ChatGoogleGenerativeAI
-from supabase.client import Client, create_client
 from template import CONDENSE_QUESTION_PROMPT, QA_PROMPT
 
 DEFAULT_DOCUMENT_PROMPT = PromptTemplate.from_template(template="{page_content}")
 
-supabase_url = st.secrets["SUPABASE_URL"]
-supabase_key = st.secrets["SUPABASE_SERVICE_KEY"]
-client: Client = create_client(supabase_url, supabase_key)
+@lru_cache(maxsize=1)
+def get_client():
+    # The Supabase client is created on first use instead of at import time.
+    from supabase.client import create_client
+    supabase_url = st.secrets["SUPABASE_URL"]
+    supabase_key = st.secrets["SUPABASE_SERVICE_KEY"]
+    return create_client(supabase_url, supabase_key)
 
 @dataclass
 class ModelConfig:
@@ -34,6 +37,7 @@ class ModelWrapper:
         self.llm = self._setup_llm()
 
     def _setup_llm(self):
+        from langchain_google_genai import ChatGoogleGenerativeAI
         return ChatGoogleGenerativeAI(
             model="models/gemini-2.0-flash",
             google_api_key=self.secrets["GEMINI_API_KEY"],
@@ -68,7 +72,7 @@ def load_chain(model_name="google_gemini", callback_handler=None):
     embeddings = FakeEmbeddings(size=768)
     vectorstore = SupabaseVectorStore(
         embedding=embeddings,
-        client=client,
+        client=get_client(),
         table_name="documents",
         query_name="v_match_documents",
     )
@@ -0,0 +1,178 @@
+# loadtest.py
+import argparse
+import json
+import os
+import random
+import threading
+import time
+
+from utils.charts import CHART_TYPES
+
+TEXT_QUESTIONS = [
+    "How many products are there in each category?",
+    "Which customers spent the most?",
+    "What is the total revenue by product category?",
+]
+# One question per chart type, so every render_chart branch is exercised.
+CHART_QUESTIONS = [f"Show the number of products per category as a {chart_type} chart" for chart_type in CHART_TYPES]
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+class Recorder:
+    """Thread-safe collection of stage latencies and errors for one concurrency level."""
+
+    def __init__(self):
+        self.stages = {}
+        self.errors = {}
+        self.turns = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages.setdefault(stage, []).append(seconds)
+
+    def error(self, exc: BaseException) -> None:
+        with self._lock:
+            name = type(exc).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                stage: {"count": len(values), "p50": percentile(values, 0.50), "p95": percentile(values, 0.95), "p99": percentile(values, 0.99)}
+                for stage, values in self.stages.items()
+            }
+
+def run_turn(backend, dialect: str, db, workspace, history: list, question: str, recorder: Recorder) -> None:
+    """
+    One chat turn as main.py runs it, timed per stage: SQL generation,
+    execution, then either the written answer or the chart spec serialized
+    for the browser and the server-side PNG rendering used when no spec fits.
+    """
+    from utils import metering, resilience
+    from utils.charts import build_figure, chart_spec, detect_chart_type, figure_png
+    from utils.fetch import format_result
+
+    deadline = resilience.Deadline(resilience.turn_budget())
+    turn = metering.start_turn(f"loadtest-{threading.get_ident()}")
+    turn_start = time.perf_counter()
+    try:
+        start = time.perf_counter()
+        sql = backend.generate_sql(question, db, history, workspace, deadline)
+        recorder.add("sql", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        df, sql = backend.execute_sql_with_repair(sql, db, workspace, deadline)
+        workspace.add(df, sql, question)
+        recorder.add("execute", time.perf_counter() - start)
+
+        chart_type = detect_chart_type(question)
+        start = time.perf_counter()
+        if chart_type:
+            json.dumps(chart_spec(df, chart_type))
+            recorder.add(f"chart:{chart_type}", time.perf_counter() - start)
+            if df.shape[1] >= 2:
+                start = time.perf_counter()
+                figure_png(build_figure(df, chart_type))
+                recorder.add(f"render:{chart_type}", time.perf_counter() - start)
+        else:
+            answer = resilience.invoke(f"{dialect}_response", backend.get_response_chain(), {
+                "question": question,
+                "chat_history": history[-5:],
+                "db": db,
+                "query": sql,
+                "response": format_result(df),
+            }, deadline=deadline)
+            recorder.add("answer", time.perf_counter() - start)
+            history.append({"role": "assistant", "content": answer})
+        recorder.add("turn", time.perf_counter() - turn_start)
+        with recorder._lock:
+            recorder.turns += 1
+    except Exception as e:
+        recorder.error(e)
+    finally:
+        metering.finish_turn(turn)
+
+def run_session(backend, dialect: str, db, turns: int, think: float, seed: int, recorder: Recorder) -> None:
+    from utils.workspace import ResultWorkspace
+
+    rng = random.Random(seed)
+    workspace = ResultWorkspace()
+    history = []
+    for _ in range(turns):
+        question = rng.choice(TEXT_QUESTIONS + CHART_QUESTIONS)
+        history.append({"role": "user", "content": question})
+        run_turn(backend, dialect, db, workspace, history, question, recorder)
+        # Analysts read the answer before asking the next question.
+        time.sleep(rng.expovariate(1 / think) if think > 0 else 0)
+
+def run_level(backend, dialect: str, db, sessions: int, args) -> dict:
+    recorder = Recorder()
+    threads = [
+        threading.Thread(target=run_session, args=(backend, dialect, db, args.turns, args.think, args.seed + i, recorder), name=f"session-{i}")
+        for i in range(sessions)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "sessions": sessions,
+        "turns": recorder.turns,
+        "errors": recorder.errors,
+        "seconds": elapsed,
+        "throughput": recorder.turns / elapsed if elapsed else 0.0,
+        "stages": recorder.summary(),
+    }
+
+def print_level(result: dict) -> None:
+    errors = sum(result["errors"].values())
+    print(f"\n{result['sessions']} sessions: {result['turns']} turns in {result['seconds']:.1f}s "
+          f"({result['throughput']:.2f} turns/s), {errors} errors {result['errors'] or ''}")
+    print(f"  {'stage':<18}{'count':>7}{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}")
+    for stage, stats in sorted(result["stages"].items()):
+        print(f"  {stage:<18}{stats['count']:>7}{stats['p50'] * 1000:>11.0f}{stats['p95'] * 1000:>11.0f}{stats['p99'] * 1000:>11.0f}")
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Simulate concurrent chat sessions against a fake LLM and report per-stage latency.")
+    parser.add_argument("--sessions", default="1,5,10,25,50", help="Comma-separated concurrency levels (simultaneous sessions).")
+    parser.add_argument("--turns", type=int, default=5, help="Questions asked per session.")
+    parser.add_argument("--think", type=float, default=0.5, help="Mean seconds a session waits between questions.")
+    parser.add_argument("--latency", type=float, default=0.8, help="Median fake LLM latency in seconds.")
+    parser.add_argument("--tail-rate", type=float, default=0.02, help="Share of fake LLM calls that are slow.")
+    parser.add_argument("--tail-latency", type=float, default=5.0, help="Extra seconds of a slow fake LLM call.")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="Share of fake LLM calls that fail.")
+    parser.add_argument("--backend", choices=["postgresql", "snowflake"], default="postgresql", help="Chat backend to drive.")
+    parser.add_argument("--uri", default="local", help="SQLAlchemy URI, or \"local\" for the embedded database.")
+    parser.add_argument("--pool-size", type=int, default=5, help="Database connection pool size.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for question choice and think times.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # The fake model reads its latency distribution from the environment (see utils.llm_registry).
+    os.environ.update({
+        "SQLCHAT_FAKE_LLM": "1",
+        "SQLCHAT_FAKE_LLM_LATENCY": str(args.latency),
+        "SQLCHAT_FAKE_LLM_TAIL_RATE": str(args.tail_rate),
+        "SQLCHAT_FAKE_LLM_TAIL_LATENCY": str(args.tail_latency),
+        "SQLCHAT_FAKE_LLM_FAULT_RATE": str(args.fault_rate),
+    })
+    from utils.backends import connect
+
+    backend, db = connect(args.backend, args.uri, args.pool_size)
+    results = []
+    for sessions in (int(level) for level in args.sessions.split(",")):
+        results.append(run_level(backend, args.backend, db, sessions, args))
+        print_level(results[-1])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
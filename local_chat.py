@@ -3,18 +3,20 @@ from dotenv import load_dotenv
 import os
 import asyncio
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
 
 from langchain_core.messages import AIMessage, HumanMessage
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 from langchain_community.utilities import SQLDatabase
-from langchain_core.output_parsers import StrOutputParser
-from langchain_google_genai import ChatGoogleGenerativeAI
 
 from sqlalchemy import inspect
 
+from utils import approx, llm_registry, metering, resilience
+from utils.cache import schema_cache
+from utils.freshness import ANY_TABLE, cached_query, dependencies
+from utils.rollups import available_rollups, describe_rollups, rewrite_query
+from utils.sql_repair import SQLRepairError, execute_with_repair, extract_sql, known_identifiers
+from utils.value_index import snap_literals, value_hints
+
 # Ensure an event loop exists
 try:
     asyncio.get_running_loop()
@@ -25,15 +27,13 @@ def init_database(user: str, host: str, port: str, database: str) -> SQLDatabase
     db_uri = f"postgresql+psycopg2://{user}@{host}:{port}/{database}"
     return SQLDatabase.from_uri(db_uri)
 
+def resume_warehouse(db: SQLDatabase) -> None:
+    # PostgreSQL has no warehouse to resume; a trivial query checks the connection.
+    db.run("SELECT 1")
+
 def finalize_sql(query: str) -> str:
-    query = query.strip()
-    if query.startswith("```"):
-        query = query.strip("`").strip()
-        if query.lower().startswith("sql"):
-            query = query[3:].strip()
-    if not query.endswith(";"):
-        query += ";"
-    return query
+    # Keeps only the statement itself: fences, prose and trailing text are dropped.
+    return extract_sql(query)
 
 def strip_code_fences(text: str) -> str:
     text = text.strip()
@@ -46,7 +46,18 @@ def strip_code_fences(text: str) -> str:
         return "\n".join(lines).strip()
     return text
 
+def get_model_config() -> dict:
+    fake = llm_registry.fake_model_config()
+    if fake is not None:
+        return fake
+    return {
+        "model": "models/gemini-2.0-flash",
+        "google_api_key": os.getenv("GEMINI_API_KEY"),
+        "temperature": 0,
+    }
+
 def adjust_label_fontsize(ax, base_font_size=12, rotation_angle=45, tick_threshold=10):
+    from matplotlib.artist import setp
     xticks = ax.get_xticklabels()
     yticks = ax.get_yticklabels()
     n_xticks = len(xticks)
@@ -54,13 +65,22 @@ def adjust_label_fontsize(ax, base_font_size=12, rotation_angle=45, tick_thresho
     new_font_size = max(6, base_font_size - (max(n_xticks, n_yticks) - 5))
     ax.tick_params(axis='both', labelsize=new_font_size)
     if n_xticks > tick_threshold:
-        plt.setp(ax.get_xticklabels(), rotation=rotation_angle, ha='right')
+        setp(ax.get_xticklabels(), rotation=rotation_angle, ha='right')
     ax.xaxis.label.set_size(new_font_size)
     ax.yaxis.label.set_size(new_font_size)
     ax.title.set_size(new_font_size + 2)
-    plt.tight_layout()
+    # Lay out the axes' own figure; charts are not registered with pyplot (see utils.charts).
+    ax.figure.tight_layout()
 
 def get_database_info(db: SQLDatabase, sample_limit: int = 1) -> str:
+    # Introspection and sample rows cost a round trip per table, so the text is
+    # cached per database and shared by every turn and session (see utils.cache).
+    key = ("postgresql", str(db._engine.url), sample_limit)
+    return schema_cache.get_or_compute(
+        key, lambda: load_database_info(db, sample_limit), tables=dependencies(db._engine, [ANY_TABLE])
+    )
+
+def load_database_info(db: SQLDatabase, sample_limit: int = 1) -> str:
     db_info = "Database Schema and Sample Data:\n"
     try:
         engine = db._engine
@@ -86,8 +106,7 @@ def get_database_info(db: SQLDatabase, sample_limit: int = 1) -> str:
             db_info += f"Sample Data: (Could not retrieve sample data: {e})\n"
     return db_info
 
-def get_sql_chain(db):
-    template = """
+SQL_TEMPLATE = """
 You are a data analyst interacting with a PostgreSQL database.
 Below is the dynamic database information (schema and sample data):
 {db_info}
@@ -99,22 +118,8 @@ Question: {question}
 Write only the SQL query and nothing else.
 SQL Query:
     """
-    prompt = ChatPromptTemplate.from_template(template)
-    llm = ChatGoogleGenerativeAI(
-        model="models/gemini-2.0-flash",
-        google_api_key=os.getenv("GEMINI_API_KEY"),
-        temperature=0
-    )
-    return (
-        RunnablePassthrough.assign(db_info=lambda _: get_database_info(db))
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
 
-def get_response(user_query: str, db: SQLDatabase, chat_history: list):
-    sql_chain = get_sql_chain(db)
-    template = """
+RESPONSE_TEMPLATE = """
 You are a data analyst interacting with a PostgreSQL database.
 Below is the dynamic database information (schema and sample data):
 {db_info}
@@ -126,50 +131,166 @@ SQL Response: {response}
 
 Provide your answer in markdown format.
     """
-    prompt_chain = ChatPromptTemplate.from_template(template)
-    llm = ChatGoogleGenerativeAI(
-        model="models/gemini-2.0-flash",
-        google_api_key=os.getenv("GEMINI_API_KEY"),
-        temperature=0
+
+# Chains are compiled once per model configuration by utils.llm_registry and
+# read the database from their input, e.g. {"question": ..., "chat_history": ..., "db": db}.
+# An optional "workspace" (utils.workspace.ResultWorkspace) lists earlier
+# results the model may query instead of the database.
+def get_sql_chain():
+    return llm_registry.get_runnable(
+        "postgresql_sql",
+        get_model_config(),
+        lambda llm: (
+            RunnablePassthrough.assign(
+                db_info=lambda vars: (
+                    get_database_info(vars["db"])
+                    + value_hints(vars["db"]._engine, vars["question"])
+                    + describe_rollups(available_rollups(vars["db"]._engine))
+                    + (vars["workspace"].describe() if vars.get("workspace") else "")
+                )
+            )
+            | metering.metered("postgresql_sql", SQL_TEMPLATE, llm)
+        ),
+    )
+
+# Answers a question from an already executed query: expects "query" and
+# "response" in its input alongside the question, history and db.
+def get_response_chain():
+    return llm_registry.get_runnable(
+        "postgresql_response",
+        get_model_config(),
+        lambda llm: (
+            RunnablePassthrough.assign(db_info=lambda vars: get_database_info(vars["db"]))
+            | metering.metered("postgresql_response", RESPONSE_TEMPLATE, llm)
+        ),
     )
-    chain = (
-        RunnablePassthrough.assign(query=sql_chain)
-        .assign(
-            db_info=lambda _: get_database_info(db),
-            response=lambda vars: db.run(finalize_sql(vars["query"]))
-        )
-        | prompt_chain
-        | llm
-        | StrOutputParser()
+
+REPAIR_TEMPLATE = """
+You are a data analyst interacting with a PostgreSQL database.
+Below is the dynamic database information (schema and sample data):
+{db_info}
+
+This SQL query failed:
+<SQL>{query}</SQL>
+Database error: {error}
+
+Correct the query. Write only the SQL query and nothing else.
+SQL Query:
+    """
+
+# Single repair attempt for a query the database rejected: expects "query" and
+# "error" in its input alongside the db.
+def get_repair_chain():
+    return llm_registry.get_runnable(
+        "postgresql_repair",
+        get_model_config(),
+        lambda llm: (
+            RunnablePassthrough.assign(db_info=lambda vars: get_database_info(vars["db"]))
+            | metering.metered("postgresql_repair", REPAIR_TEMPLATE, llm)
+        ),
     )
-    return chain.invoke({
-        "question": user_query,
-        "chat_history": chat_history[-5:],
-    })
-
-def get_visualization_data(user_query: str, db: SQLDatabase, chat_history: list):
-    sql_chain = get_sql_chain(db)
-    sql_query_text = sql_chain.invoke({
+
+def generate_sql(user_query: str, db: SQLDatabase, chat_history: list, workspace=None, deadline=None) -> str:
+    sql_query_text = resilience.invoke("postgresql_sql", get_sql_chain(), {
          "question": user_query,
-         "chat_history": chat_history[-5:]
-    })
-    cleaned_query = finalize_sql(sql_query_text)
-    engine = db._engine
+         "chat_history": chat_history[-5:],
+         "db": db,
+         "workspace": workspace,
+    }, deadline=deadline)
+    return prepare_sql(finalize_sql(sql_query_text), db)
+
+def prepare_sql(query: str, db) -> str:
+    # Misspelled or miscased filter values are snapped to stored ones, then
+    # aggregates that a built rollup table can answer are redirected to it.
+    query = snap_literals(db._engine, query)
+    query, _ = rewrite_query(query, available_rollups(db._engine))
+    # In approximate mode (see utils.approx) large tables are read from a sample.
+    return approx.maybe_sample(query, db._engine)
+
+def execute_sql(query: str, db: SQLDatabase, workspace=None):
+    """Run `query` on the session workspace when it only reads earlier results, else on the database."""
+    if workspace is not None and workspace.can_answer(query):
+        return workspace.query(query)
+    from utils.fetch import fetch_dataframe
+    return cached_query(db._engine, query, lambda: fetch_dataframe(query, db._engine))
+
+def execute_sql_with_repair(query: str, db: SQLDatabase, workspace=None, deadline=None):
+    """
+    Run `query` like execute_sql; a query the database rejects is retried after
+    local fixes and then at most one model repair. Returns (df, query that ran).
+    """
+    if workspace is not None and workspace.can_answer(query):
+        return workspace.query(query), query
+
+    def repair_with_llm(failed_query: str, error: str) -> str:
+        return resilience.invoke("postgresql_repair", get_repair_chain(), {
+            "db": db,
+            "query": failed_query,
+            "error": error,
+        }, deadline=deadline)
+
+    def prepare_repaired(repaired_query: str) -> str:
+        # The model's query replaces the one that failed, sample and all.
+        approx.withdraw(query)
+        return prepare_sql(repaired_query, db)
+
+    return execute_with_repair(
+        query,
+        lambda q: execute_sql(q, db),
+        "postgresql",
+        lambda: known_identifiers(db._engine),
+        repair_with_llm,
+        prepare_repaired,
+    )
+
+def get_response(user_query: str, db: SQLDatabase, chat_history: list, workspace=None, deadline=None):
+    natural_language_response, _ = get_response_with_sql(user_query, db, chat_history, workspace, deadline)
+    return natural_language_response
+
+# `deadline` is a utils.resilience.Deadline shared by the LLM calls of one turn.
+# When the model is unavailable (deadline, circuit open, retries exhausted) the
+# functions below degrade to a fallback message instead of raising.
+def get_visualization_data(user_query: str, db: SQLDatabase, chat_history: list, workspace=None, deadline=None):
+    import pandas as pd
+    try:
+        cleaned_query = generate_sql(user_query, db, chat_history, workspace, deadline)
+    except resilience.LLMUnavailable as e:
+        st.error(resilience.fallback_message(e))
+        return pd.DataFrame(), ""
     try:
-        df = pd.read_sql(cleaned_query, engine)
+        df, cleaned_query = execute_sql_with_repair(cleaned_query, db, workspace, deadline)
     except Exception as e:
         st.error(f"Error fetching data: {e}")
         df = pd.DataFrame()
+        cleaned_query = getattr(e, "query", cleaned_query)
+    else:
+        if workspace is not None:
+            workspace.add(df, cleaned_query, user_query)
     return df, cleaned_query
 
-def get_response_with_sql(user_query: str, db: SQLDatabase, chat_history: list):
-    sql_chain = get_sql_chain(db)
-    sql_query_text = sql_chain.invoke({
-         "question": user_query,
-         "chat_history": chat_history[-5:]
-    })
-    cleaned_query = finalize_sql(sql_query_text)
-    natural_language_response = get_response(user_query, db, chat_history)
+def get_response_with_sql(user_query: str, db: SQLDatabase, chat_history: list, workspace=None, deadline=None):
+    from utils.fetch import format_result
+    try:
+        cleaned_query = generate_sql(user_query, db, chat_history, workspace, deadline)
+    except resilience.LLMUnavailable as e:
+        return resilience.fallback_message(e), ""
+    try:
+        df, cleaned_query = execute_sql_with_repair(cleaned_query, db, workspace, deadline)
+    except SQLRepairError as e:
+        return f"The query could not be run, even after trying to correct it: {e}", e.query
+    if workspace is not None:
+        workspace.add(df, cleaned_query, user_query)
+    try:
+        natural_language_response = resilience.invoke("postgresql_response", get_response_chain(), {
+            "question": user_query,
+            "chat_history": chat_history[-5:],
+            "db": db,
+            "query": cleaned_query,
+            "response": format_result(df),
+        }, deadline=deadline)
+    except resilience.LLMUnavailable as e:
+        # The query already ran, so show its raw result rather than nothing.
+        natural_language_response = f"{resilience.fallback_message(e)}\n\nRaw result:\n\n```\n{df.head(50).to_string(index=False)}\n```"
     return natural_language_response, cleaned_query
 
 # --- Simple chat UI for Local PostgreSQL ---
@@ -191,6 +312,7 @@ def run_chat():
                 if df.empty:
                     response = "No data returned or error occurred."
                 else:
+                    import matplotlib.pyplot as plt
                     fig, ax = plt.subplots(figsize=(5,5), dpi=100)
                     if "line" in user_input.lower():
                         if df.shape[1] >= 2:
@@ -1,34 +1,122 @@
-import re
-import io
+import importlib
 import warnings
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-from langchain.schema import HumanMessage, AIMessage
 from utils.snowddl import Snowddl
-from utils.snowchat_ui import StreamlitUICallbackHandler, message_func
+from utils.snowchat_ui import message_func
 
-# Import processing functions for Local PostgreSQL branch
-from local_chat import (
-    init_database as pg_init_database,
-    get_response_with_sql as pg_get_response_with_sql,
-    get_visualization_data as pg_get_visualization_data,
-    strip_code_fences as pg_strip_code_fences,
-    adjust_label_fontsize as pg_adjust_label_fontsize,
-)
+warnings.filterwarnings("ignore")
 
-# Import processing functions for Cloud Snowflake branch
-from snowflake_chat import (
-    init_snowflake_connection,
-    get_response_with_sql as sf_get_response_with_sql,
-    get_visualization_data as sf_get_visualization_data,
-    strip_code_fences as sf_strip_code_fences,
-    adjust_label_fontsize as sf_adjust_label_fontsize,
-    run_chat as sf_run_chat,
-)
+# Backend modules (and the LangChain / pandas / matplotlib stacks they pull in)
+# are imported only when their branch is first used.
+BACKEND_MODULES = {
+    "Cloud Snowflake": "snowflake_chat",
+    "Local PostgreSQL": "local_chat",
+}
 
-warnings.filterwarnings("ignore")
-snow_ddl = Snowddl()
+def load_backend(db_option):
+    """Import and return the chat backend module for the selected branch."""
+    return importlib.import_module(BACKEND_MODULES[db_option])
+
+@st.cache_resource(show_spinner=False)
+def get_snow_ddl():
+    return Snowddl()
+
+@st.cache_resource(show_spinner=False)
+def get_snowflake_db():
+    # SQLDatabase.from_uri reflects the schema, so build it once per process
+    # instead of on every Streamlit rerun.
+    return load_backend("Cloud Snowflake").init_snowflake_connection()
+
+def show_warmup_progress(task):
+    st.progress(task.progress, text=task.headline)
+    with st.expander("Warm-up details", expanded=False):
+        for label, status, seconds in task.summary():
+            st.caption(f"{label}: {status}" + (f" ({seconds:.2f}s)" if seconds else ""))
+
+def render_warmup():
+    """Show the background warm-up of the connected database in the sidebar."""
+    from utils import warmup
+    db = st.session_state.get("db")
+    task = warmup.get_task(str(db._engine.url)) if db is not None else None
+    if task is None:
+        return
+    with st.sidebar:
+        if task.done or not hasattr(st, "fragment"):
+            show_warmup_progress(task)
+            return
+
+        @st.fragment(run_every=1.0)
+        def live_warmup_progress():
+            show_warmup_progress(task)
+            if task.done:
+                st.rerun()
+
+        live_warmup_progress()
+
+def render_token_usage():
+    """Show this session's token usage, the last turn by stage and prompt section, and a metrics export."""
+    from utils import metering
+    session_id = st.session_state["session_id"]
+    last_turn = metering.meter.last_turns.get(session_id)
+    if last_turn is None:
+        return
+    limits = metering.budgets()
+    session_tokens = metering.meter.session_total(session_id)
+    with st.sidebar.expander("Token usage", expanded=False):
+        st.caption(
+            f"Session: {session_tokens:,} tokens" + (f" of {limits['session']:,}" if limits["session"] else "")
+            + f" · Today: {metering.meter.day_total(metering.today()):,}"
+            + (f" of {limits['day']:,}" if limits["day"] else "")
+        )
+        st.caption(f"Last turn: {last_turn['total']['total_tokens']:,} tokens")
+        for stage, usage in last_turn["stages"].items():
+            sections = ", ".join(f"{name} {tokens:,}" for name, tokens in sorted(usage["sections"].items(), key=lambda kv: -kv[1]))
+            st.caption(f"{stage}: {usage['prompt_tokens']:,} in / {usage['completion_tokens']:,} out ({sections})")
+        import json
+        st.download_button("Export metrics (JSON)", json.dumps(metering.meter.export(), indent=2),
+                           file_name="token_metrics.json", mime="application/json")
+
+def render_profiles():
+    """Sidebar opt-in for profiling this session's turns, with the hottest functions of the last profiled turn."""
+    from utils import profiler
+    with st.sidebar.expander("Turn profiles", expanded=False):
+        st.checkbox("Profile my turns", key="profile_turns",
+                    help="Capture a profile of each turn (SQLCHAT_PROFILE_MODE: sampling or cprofile).")
+        profiles = profiler.session_profiles(st.session_state["session_id"])
+        if not profiles:
+            st.caption("No profiled turns yet.")
+            return
+        latest = profiles[0]
+        st.caption(f"Trace {latest.trace_id}: {latest.seconds:.2f}s ({latest.mode}), hottest functions by self time")
+        if latest.mode == "cprofile":
+            st.caption("cProfile only covers the script thread; model calls on llm-call threads are missing. "
+                       "Use SQLCHAT_PROFILE_MODE=sampling to include them.")
+        st.dataframe(latest.top(), hide_index=True)
+        file_name, data = latest.export()
+        st.download_button("Export raw profile", data, file_name=file_name, mime="application/octet-stream")
+
+def render_approximate_mode():
+    """Sidebar opt-in for answering aggregates over large tables from a sample (see utils.approx)."""
+    st.sidebar.toggle(
+        "Approximate answers", key="approximate",
+        help="Read a sample of large tables for totals, counts and charts: much faster and cheaper, "
+             "with the sampling rate and error margin shown under the answer.",
+    )
+    if st.session_state.get("approximate"):
+        st.sidebar.select_slider("Sample size (%)", options=[1, 2, 5, 10, 25], value=5, key="sample_percent")
+
+def approximate_sampling():
+    """This session's utils.approx.Sampling, or None for exact answers."""
+    if not st.session_state.get("approximate"):
+        return None
+    from utils.approx import Sampling
+    defaults = Sampling.from_env()
+    return Sampling(st.session_state.get("sample_percent", 5) / 100, defaults.target_rows, defaults.min_rows)
+
+@st.cache_data(show_spinner=False)
+def read_ui_file(path):
+    with open(path) as f:
+        return f.read()
 
 # --- Helper Function to Parse Customer Details ---
 def parse_customer_details(response_text):
@@ -65,6 +153,9 @@ if "messages" not in st.session_state:
     st.session_state["messages"] = [{"role": "assistant", "content": "Hello! I'm your SQL assistant. Ask me anything about your database.", "type": "text"}]
 if "db" not in st.session_state:
     st.session_state["db"] = None
+if "session_id" not in st.session_state:
+    import uuid
+    st.session_state["session_id"] = uuid.uuid4().hex
 
 # --- Header and Page Configuration ---
 gradient_text_html = """
@@ -114,30 +205,26 @@ db_option = st.sidebar.radio(
 
 # ----- Cloud Snowflake Branch -----
 if db_option == "Cloud Snowflake":
-    st.sidebar.markdown(open("ui/sidebar.md").read())
-    selected_table = st.sidebar.selectbox("Select a table:", options=list(snow_ddl.ddl_dict.keys()))
+    st.sidebar.markdown(read_ui_file("ui/sidebar.md"))
+    snow_ddl = get_snow_ddl()
+    selected_table = st.sidebar.selectbox("Select a table:", options=snow_ddl.table_names)
     st.sidebar.markdown(f"### DDL for {selected_table} table")
     st.sidebar.text('for user reference only (no need for sql-chat)')
-    st.sidebar.code(snow_ddl.ddl_dict[selected_table], language="sql")
+    st.sidebar.code(snow_ddl.get_ddl(selected_table), language="sql")
     if st.sidebar.button("Reset Chat"):
         for key in list(st.session_state.keys()):
-            if key not in ["model", "db", "messages"]:
+            if key not in ["model", "db", "messages", "session_id"]:
                 st.session_state.pop(key)
         st.session_state["messages"] = [{"role": "assistant", "content": "Hello! I'm your SQL assistant. Ask me anything about your database.", "type": "text"}]
     st.sidebar.markdown("**Note:** Snowflake data retrieval is enabled.", unsafe_allow_html=True)
-    st.write(open("ui/styles.md").read(), unsafe_allow_html=True)
+    st.write(read_ui_file("ui/styles.md"), unsafe_allow_html=True)
     try:
-        account = st.secrets["ACCOUNT"]
-        user = st.secrets["USER_NAME"]
-        password = st.secrets["PASSWORD"]
-        role = st.secrets["ROLE"]
-        database = st.secrets["DATABASE"]
-        schema = st.secrets["SCHEMA"]
-        warehouse = st.secrets["WAREHOUSE"]
-        uri = f"snowflake://{user}:{password}@{account}/{database}/{schema}?warehouse={warehouse}&role={role}"
-        from langchain_community.utilities import SQLDatabase
-        snowflake_db = SQLDatabase.from_uri(uri)
-        st.session_state["db"] = snowflake_db
+        st.session_state["db"] = get_snowflake_db()
+        from utils.warmup import start_connection_warmup
+        start_connection_warmup(
+            load_backend(db_option), st.session_state["db"], "Snowflake",
+            resume_warehouse=bool(st.secrets.get("WARM_WAREHOUSE", False)),
+        )
         if st.session_state["model"] != "Gemini Flash 2.0":
             st.error("please use the Google Gemini model, the selected model has reached the credit limit")
         else:
@@ -157,17 +244,28 @@ else:
     pg_database = st.sidebar.text_input("Database", value="store_sales", key="pg_database")
     if st.sidebar.button("Connect to PostgreSQL"):
         try:
-            db = pg_init_database(pg_user, pg_host, pg_port, pg_database)
+            db = load_backend(db_option).init_database(pg_user, pg_host, pg_port, pg_database)
             st.session_state["db"] = db
+            from utils.warmup import start_connection_warmup
+            start_connection_warmup(load_backend(db_option), db, "PostgreSQL", retry_failed=True)
             st.success("Connected to PostgreSQL!")
         except Exception as e:
             st.error(f"Connection error: {e}")
 
+render_warmup()
+render_token_usage()
+render_approximate_mode()
+render_profiles()
+
 # ---------------------------
 # Display Chat History (Unified for Both Branches)
 # ---------------------------
-for msg in st.session_state["messages"]:
-    message_func(msg["content"], is_user=(msg["role"]=="user"), model=st.session_state["model"])
+for i, msg in enumerate(st.session_state["messages"]):
+    if msg.get("type") == "table":
+        from utils.presentation import render_table
+        render_table(msg["table"], key=f"table-page-{i}")
+    else:
+        message_func(msg["content"], is_user=(msg["role"]=="user"), model=st.session_state["model"])
 
 # ---------------------------
 # Unified Chat Input Widget (Always Visible)
@@ -176,82 +274,61 @@ user_input = st.chat_input("Type a message...")
 if user_input:
     st.session_state["messages"].append({"role": "user", "content": user_input})
     
-    def render_chart(df, chart_type, adjust_fn):
-        fig, ax = plt.subplots(figsize=(5,5), dpi=100)
-        # Set background color for figure and axes
-        fig.patch.set_facecolor("#101414")
-        ax.set_facecolor("#101414")
-        # Set tick label colors to white
-        ax.tick_params(axis="x", colors="white")
-        ax.tick_params(axis="y", colors="white")
-        if chart_type == "line" and df.shape[1] >= 2:
-            ax.plot(df.iloc[:,0], df.iloc[:,1], marker='o', color="skyblue")  # skyblue line
-            ax.set_xlabel(df.columns[0], color="white")
-            ax.set_ylabel(df.columns[1], color="white")
-            ax.set_title("Line Chart", color="white")
-        elif chart_type == "bar" and df.shape[1] >= 2:
-            ax.bar(df.iloc[:,0], df.iloc[:,1], color="skyblue")  # skyblue bars
-            ax.set_xlabel(df.columns[0], color="white")
-            ax.set_ylabel(df.columns[1], color="white")
-            ax.set_title("Bar Chart", color="white")
-        elif chart_type == "pie" and df.shape[1] >= 2:
-            wedges, texts, autotexts = ax.pie(df.iloc[:,1], labels=df.iloc[:,0], autopct='%1.1f%%', textprops=dict(color="white"))
-            ax.set_title("Pie Chart", color="white")
-        elif chart_type == "histogram":
-            ax.hist(df.iloc[:,1], bins=10, color="skyblue", edgecolor="black")  # skyblue histogram bars
-            ax.set_title("Histogram", color="white")
-        elif chart_type == "scatter" and df.shape[1] >= 2:
-            ax.scatter(df.iloc[:,0], df.iloc[:,1], color="white")
-            ax.set_xlabel(df.columns[0], color="white")
-            ax.set_ylabel(df.columns[1], color="white")
-            ax.set_title("Scatter Plot", color="white")
-        elif chart_type == "area" and df.shape[1] >= 2:
-            ax.fill_between(range(len(df.iloc[:,1])), df.iloc[:,1], color="white", alpha=0.5)
-            ax.set_title("Area Chart", color="white")
-        elif chart_type == "bubble" and df.shape[1] >= 2:
-            sizes = (df.iloc[:,1] - df.iloc[:,1].min() + 10) * 10
-            ax.scatter(df.iloc[:,0], df.iloc[:,1], s=sizes, alpha=0.5, color="white")
-            ax.set_xlabel(df.columns[0], color="white")
-            ax.set_ylabel(df.columns[1], color="white")
-            ax.set_title("Bubble Chart", color="white")
-        adjust_fn(ax)
-        st.pyplot(fig)
-    
     # Determine chart type based on keywords in user_input
-    chart_types = ["pie", "histogram", "scatter", "area", "bubble", "line", "bar"]
-    selected_chart = None
-    for ct in chart_types:
-        if ct in user_input.lower():
-            selected_chart = ct
-            break
+    from utils.charts import detect_chart_type, render_chart
+    selected_chart = detect_chart_type(user_input)
 
     if st.session_state["db"] is None:
         st.error("Not connected to a database.")
     else:
-        if selected_chart:
-            if db_option == "Local PostgreSQL":
-                df, sql_used = pg_get_visualization_data(user_input, st.session_state.db, st.session_state["messages"])
-            else:
-                df, sql_used = sf_get_visualization_data(user_input, st.session_state.db, st.session_state["messages"])
-            if df.empty:
-                response = "No data returned or error occurred."
-            else:
-                render_chart(df, selected_chart, pg_adjust_label_fontsize if db_option == "Local PostgreSQL" else sf_adjust_label_fontsize)
-                st.markdown("**SQL Query used:** `" + sql_used + "`")
-                response = ""
-        else:
-            if db_option == "Local PostgreSQL":
-                resp, sql_used = pg_get_response_with_sql(user_input, st.session_state.db, st.session_state["messages"])
-                resp = pg_strip_code_fences(resp)
-            else:
-                resp, sql_used = sf_get_response_with_sql(user_input, st.session_state.db, st.session_state["messages"])
-                resp = sf_strip_code_fences(resp)
-            rows = parse_customer_details(resp)
-            if rows:
-                st.dataframe(pd.DataFrame(rows))
-                response = pd.DataFrame(rows).to_html(index=False)
+        backend = load_backend(db_option)
+        if "workspace" not in st.session_state:
+            from utils.workspace import ResultWorkspace
+            st.session_state["workspace"] = ResultWorkspace()
+        workspace = st.session_state["workspace"]
+        from utils import approx, metering, profiler, resilience
+        deadline = resilience.Deadline(resilience.turn_budget())
+        turn = metering.start_turn(st.session_state["session_id"])
+        # The metering turn ID doubles as the trace ID the profile is stored under.
+        capture = profiler.start_turn(turn.turn_id, st.session_state["session_id"], st.session_state.get("profile_turns", False))
+        approx.start_turn(approximate_sampling())
+        # Per-turn state (metering, approximate mode, profiling) is closed even when the turn fails.
+        try:
+            message_type = "text"
+            table = None
+            if selected_chart:
+                df, sql_used = backend.get_visualization_data(user_input, st.session_state.db, st.session_state["messages"], workspace, deadline)
+                if df.empty:
+                    response = "No data returned or error occurred."
+                else:
+                    render_chart(df, selected_chart, backend.adjust_label_fontsize)
+                    st.markdown("**SQL Query used:** `" + sql_used + "`")
+                    response = ""
             else:
-                st.markdown(resp)
+                resp, sql_used = backend.get_response_with_sql(user_input, st.session_state.db, st.session_state["messages"], workspace, deadline)
+                resp = backend.strip_code_fences(resp)
+                rows = parse_customer_details(resp)
                 response = resp
-            st.markdown("**SQL Query used:** `" + sql_used + "`")
-        st.session_state["messages"].append({"role": "assistant", "content": response})
+                if rows:
+                    # Built once in compact columnar form; the history re-renders it page by page,
+                    # while "content" keeps the answer text the next prompts see as chat history.
+                    from utils.presentation import present, render_table
+                    table = present(rows)
+                    message_type = "table"
+                    render_table(table, key=f"table-page-{len(st.session_state['messages'])}")
+                else:
+                    st.markdown(resp)
+                st.markdown("**SQL Query used:** `" + sql_used + "`")
+        finally:
+            approximations = approx.finish_turn()
+            alerts = metering.finish_turn(turn)
+            profiler.finish_turn(capture)
+        for alert in alerts:
+            st.warning(f"Token budget: {alert}")
+        message = {"role": "assistant", "content": response, "type": message_type}
+        if table is not None:
+            message["table"] = table
+        st.session_state["messages"].append(message)
+        for approximation in approximations:
+            st.info(approximation.note())
+            st.session_state["messages"].append({"role": "assistant", "content": approximation.note(), "type": "text"})
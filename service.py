@@ -0,0 +1,232 @@
+# service.py
+import asyncio
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.exc import SQLAlchemyError
+
+from utils import metering, resilience
+from utils.backends import connect
+from utils.sql_repair import SQLRepairError
+from utils.sql_utils import is_read_only
+
+# Configuration, read once at start-up:
+#   SQLCHAT_BACKEND          postgresql (default) or snowflake
+#   SQLCHAT_DB_URI           SQLAlchemy URI, "local" (default) for the embedded
+#                            database, or empty for the Snowflake secrets
+#   SQLCHAT_MAX_CONCURRENCY  pipeline calls running at once (default 16)
+# Run with `uvicorn service:app`, or `SQLCHAT_FAKE_LLM=1 uvicorn service:app`
+# to serve the embedded database with the fake model.
+
+class Scheduler:
+    """
+    Runs the blocking pipeline functions (LLM calls, database queries) on a
+    bounded thread pool shared by every request. Requests beyond
+    `max_concurrency` wait their turn on the event loop instead of piling
+    connections onto the database and calls onto the model.
+    """
+
+    def __init__(self, max_concurrency: int = 16):
+        self.max_concurrency = max_concurrency
+        self.waiting = 0
+        self.running = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="service")
+
+    async def run(self, fn, *args):
+        self.waiting += 1
+        async with self._semaphore:
+            self.waiting -= 1
+            self.running += 1
+            try:
+                # Copy the request's context so per-turn context variables follow the call.
+                ctx = contextvars.copy_context()
+                return await asyncio.get_running_loop().run_in_executor(self._executor, lambda: ctx.run(fn, *args))
+            finally:
+                self.running -= 1
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    backend_name = os.getenv("SQLCHAT_BACKEND", "postgresql")
+    concurrency = int(os.getenv("SQLCHAT_MAX_CONCURRENCY", "16"))
+    # One database handle, engine pool, set of compiled chains and schema cache for the whole process.
+    app.state.backend, app.state.db = connect(backend_name, os.getenv("SQLCHAT_DB_URI", "local"), concurrency)
+    app.state.backend_name = backend_name
+    app.state.scheduler = Scheduler(concurrency)
+    from utils.warmup import start_connection_warmup
+    app.state.warmup = start_connection_warmup(app.state.backend, app.state.db, backend_name)
+    yield
+    app.state.scheduler.shutdown()
+    app.state.db._engine.dispose()
+
+app = FastAPI(title="SQL-Snowflake-chat", lifespan=lifespan)
+
+class QuestionRequest(BaseModel):
+    question: str
+    chat_history: List[str] = []
+    budget: Optional[float] = None
+
+class ExecuteRequest(BaseModel):
+    sql: str
+    max_rows: int = 1000
+    # Let the model fix a query the database rejects (costs tokens); off by default.
+    repair: bool = False
+    budget: Optional[float] = None
+
+def _deadline(body) -> resilience.Deadline:
+    return resilience.Deadline(body.budget or resilience.turn_budget())
+
+def _start_turn(request: Request):
+    # Clients identify their session with X-Session-Id to get their own token budget.
+    return metering.start_turn(request.headers.get("x-session-id", "service"))
+
+def _records(df, max_rows: int) -> dict:
+    # to_json handles NaN, dates and numpy scalars that the JSON encoder rejects.
+    split = json.loads(df.head(max_rows).to_json(orient="split", index=False, date_format="iso"))
+    return {"columns": split["columns"], "rows": split["data"], "row_count": len(df), "truncated": len(df) > max_rows}
+
+@app.get("/health")
+async def health(request: Request):
+    state = request.app.state
+    return {
+        "backend": state.backend_name,
+        "warmup": state.warmup.headline,
+        "llm_circuit": resilience.get_breaker().state,
+        "running": state.scheduler.running,
+        "waiting": state.scheduler.waiting,
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Token usage per day, stage and session (see utils.metering)."""
+    return metering.meter.export()
+
+@app.post("/sql")
+async def generate_sql(body: QuestionRequest, request: Request):
+    state = request.app.state
+    turn = _start_turn(request)
+    try:
+        sql = await state.scheduler.run(
+            state.backend.generate_sql, body.question, state.db, body.chat_history, None, _deadline(body)
+        )
+    except resilience.LLMUnavailable as e:
+        raise HTTPException(status_code=503, detail=resilience.fallback_message(e))
+    finally:
+        metering.finish_turn(turn)
+    return {"sql": sql}
+
+@app.post("/execute")
+async def execute(body: ExecuteRequest, request: Request):
+    """Run one read-only SELECT (or WITH) statement; other SQL is rejected with 400."""
+    if not is_read_only(body.sql):
+        raise HTTPException(status_code=400, detail={"error": "Only a single read-only SELECT or WITH statement can be run.", "sql": body.sql})
+    state = request.app.state
+    turn = _start_turn(request)
+    try:
+        if body.repair:
+            df, sql = await state.scheduler.run(state.backend.execute_sql_with_repair, body.sql, state.db, None, _deadline(body))
+        else:
+            df, sql = await state.scheduler.run(state.backend.execute_sql, body.sql, state.db), body.sql
+    except SQLRepairError as e:
+        raise HTTPException(status_code=400, detail={"error": str(e), "sql": e.query})
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=400, detail={"error": str(getattr(e, "orig", None) or e), "sql": body.sql})
+    finally:
+        metering.finish_turn(turn)
+    return {"sql": sql, **_records(df, body.max_rows)}
+
+@app.post("/answer")
+async def answer(body: QuestionRequest, request: Request):
+    state = request.app.state
+    turn = _start_turn(request)
+    # get_response_with_sql already degrades to a fallback message when the model is unavailable.
+    try:
+        text, sql = await state.scheduler.run(
+            state.backend.get_response_with_sql, body.question, state.db, body.chat_history, None, _deadline(body)
+        )
+    finally:
+        alerts = metering.finish_turn(turn)
+    return {"answer": text, "sql": sql, "tokens": turn.total().total_tokens, "alerts": alerts}
+
+async def _answer_events(state, body: QuestionRequest):
+    deadline = _deadline(body)
+    try:
+        sql = await state.scheduler.run(state.backend.generate_sql, body.question, state.db, body.chat_history, None, deadline)
+        df, sql = await state.scheduler.run(state.backend.execute_sql_with_repair, sql, state.db, None, deadline)
+    except resilience.LLMUnavailable as e:
+        yield {"error": resilience.fallback_message(e)}
+        return
+    except SQLRepairError as e:
+        yield {"error": str(e), "sql": e.query}
+        return
+    yield {"sql": sql}
+
+    from utils.fetch import format_result
+    breaker = resilience.get_breaker()
+    if not breaker.allow():
+        yield {"error": resilience.fallback_message(resilience.CircuitOpenError("circuit open"))}
+        return
+    outcome_recorded = False
+    try:
+        chunks = state.backend.get_response_chain().astream({
+            "question": body.question,
+            "chat_history": body.chat_history[-5:],
+            "db": state.db,
+            "query": sql,
+            "response": format_result(df),
+        }).__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(deadline.remaining(), 0.001))
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                breaker.record_failure()
+                outcome_recorded = True
+                yield {"error": resilience.fallback_message(resilience.DeadlineExceeded("stream"))}
+                return
+            except Exception as e:
+                # Like ResilientCaller: only provider faults count against the circuit.
+                if resilience.is_transient(e):
+                    breaker.record_failure()
+                    outcome_recorded = True
+                yield {"error": resilience.fallback_message(e)}
+                return
+            yield {"token": chunk}
+        breaker.record_success()
+        outcome_recorded = True
+        yield {"done": True}
+    finally:
+        # A client that disconnects mid-stream must not keep a half-open circuit's trial slot.
+        if not outcome_recorded:
+            breaker.release()
+
+@app.post("/answer/stream")
+async def answer_stream(body: QuestionRequest, request: Request):
+    """
+    Stream the answer as newline-delimited JSON events: {"sql": ...} once the
+    query has run, then {"token": ...} chunks, then {"done": true}. An
+    {"error": ...} event ends the stream early.
+    """
+    async def lines():
+        turn = _start_turn(request)
+        try:
+            async for event in _answer_events(request.app.state, body):
+                yield json.dumps(event) + "\n"
+        finally:
+            metering.finish_turn(turn)
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("service:app", host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", "8000")))
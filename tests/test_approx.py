@@ -0,0 +1,43 @@
+from utils import approx
+from utils.approx import Sampling, rewrite
+
+SAMPLING = Sampling(fraction=0.05, min_rows=1000)
+ROWS = {"SALES": 10_000_000}
+
+def test_samples_largest_table_and_scales_sum_and_count():
+    sql, approximation = rewrite(
+        "SELECT CATEGORY, SUM(AMOUNT), COUNT(*) FROM SALES s GROUP BY CATEGORY", "snowflake", ROWS, SAMPLING
+    )
+    assert sql == "SELECT CATEGORY, (SUM(AMOUNT) / 0.05), (COUNT(*) / 0.05) FROM SALES s SAMPLE SYSTEM (5) GROUP BY CATEGORY"
+    assert approximation.percent == 5.0
+    assert approximation.scaled == ["SUM", "COUNT"]
+
+def test_postgresql_uses_tablesample():
+    sql, _ = rewrite("SELECT SUM(AMOUNT) FROM SALES", "postgresql", ROWS, SAMPLING)
+    assert sql == "SELECT (SUM(AMOUNT) / 0.05) FROM SALES TABLESAMPLE SYSTEM (5)"
+
+def test_distinct_counts_and_averages_are_not_scaled():
+    _, approximation = rewrite("SELECT COUNT(DISTINCT c), AVG(x) FROM SALES", "postgresql", ROWS, SAMPLING)
+    assert approximation.scaled == []
+    assert sorted(approximation.unscaled) == ["AVG", "COUNT(DISTINCT ...)"]
+
+def test_exact_when_sampling_would_change_the_answer():
+    for sql in (
+        "SELECT SUM(AMOUNT) FROM SALES LEFT JOIN P ON 1 = 1",
+        "SELECT AMOUNT FROM SALES",
+    ):
+        assert rewrite(sql, "postgresql", ROWS, SAMPLING) == (sql, None)
+    assert rewrite("SELECT SUM(AMOUNT) FROM SALES", "postgresql", {"SALES": 10}, SAMPLING)[1] is None
+    assert rewrite("SELECT SUM(AMOUNT) FROM SALES", "sqlite", ROWS, SAMPLING)[1] is None
+
+def test_withdrawn_queries_leave_no_note(monkeypatch):
+    from types import SimpleNamespace
+    engine = SimpleNamespace(dialect=SimpleNamespace(name="postgresql"))
+    monkeypatch.setattr(approx, "table_rows", lambda _: ROWS)
+    approx.start_turn(SAMPLING)
+    sampled = approx.maybe_sample("SELECT SUM(AMOUNT) FROM SALES", engine)
+    approx.maybe_sample("SELECT SUM(AMOUNT) FROM SALES WHERE ID > 1", engine)
+    approx.withdraw(sampled)
+    assert [a.query for a in approx.finish_turn()] == [
+        "SELECT (SUM(AMOUNT) / 0.05) FROM SALES TABLESAMPLE SYSTEM (5) WHERE ID > 1"
+    ]
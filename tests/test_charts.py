@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+from utils.charts import CHART_TYPES, TITLES, chart_spec, detect_chart_type
+
+DF = pd.DataFrame({"product.category": ["Books", "Toys", None], "revenue": [10.5, 20.0, 3.0]})
+
+# Mark type and encoding channels drawn for each chart type.
+EXPECTED = {
+    "pie": ("arc", {"theta", "color"}),
+    "histogram": ("bar", {"x", "y"}),
+    "scatter": ("point", {"x", "y"}),
+    "area": ("area", {"x", "y"}),
+    "bubble": ("circle", {"x", "y", "size"}),
+    "line": ("line", {"x", "y"}),
+    "bar": ("bar", {"x", "y"}),
+}
+
+def test_every_chart_type_has_an_expectation():
+    assert set(EXPECTED) == set(CHART_TYPES)
+
+@pytest.mark.parametrize("chart_type", CHART_TYPES)
+def test_chart_spec(chart_type):
+    spec = chart_spec(DF, chart_type)
+    mark, channels = EXPECTED[chart_type]
+    assert spec["mark"]["type"] == mark
+    assert set(spec["encoding"]) == channels
+    assert spec["title"] == TITLES[chart_type]
+    # Rows with an empty plotted column are dropped; fields are renamed to plain names.
+    if chart_type == "histogram":
+        assert spec["data"]["values"] == [{"c0": 10.5}, {"c0": 20.0}, {"c0": 3.0}]
+        assert spec["encoding"]["x"]["bin"] == {"maxbins": 10}
+    else:
+        assert spec["data"]["values"] == [{"c0": "Books", "c1": 10.5}, {"c0": "Toys", "c1": 20.0}]
+        label = spec["encoding"]["color" if chart_type == "pie" else "x"]
+        assert label == {"field": "c0", "type": "nominal", "title": "product.category", "sort": None}
+
+def test_dates_are_temporal():
+    df = pd.DataFrame({"day": pd.to_datetime(["2024-01-01", "2024-01-02"]), "orders": [3, 4]})
+    spec = chart_spec(df, "line")
+    assert spec["encoding"]["x"]["type"] == "temporal"
+    assert spec["data"]["values"][0]["c0"].startswith("2024-01-01")
+
+def test_missing_columns_give_no_spec():
+    assert chart_spec(pd.DataFrame(), "bar") is None
+    assert chart_spec(DF[["revenue"]], "bar") is None
+    assert chart_spec(DF[["revenue"]], "histogram")["encoding"]["x"]["field"] == "c0"
+
+def test_detect_chart_type():
+    assert detect_chart_type("Show a bubble chart of revenue") == "bubble"
+    assert detect_chart_type("Plot revenue as a Bar chart") == "bar"
+    assert detect_chart_type("What was the revenue?") is None
@@ -0,0 +1,50 @@
+import datetime
+import io
+import os
+
+import pandas as pd
+import pytest
+
+from utils.fetch import _read_csv_pandas
+
+# One row per kind of value, as COPY ... CSV writes it and as psycopg2 returns it.
+COLUMNS = [
+    ("id", 23), ("day", 1082), ("at", 1114), ("price", 1700), ("tags", 3802),
+    ("name", 25), ("flag", 16), ("name", 25),
+]
+COPY_OUTPUT = (
+    "id,day,at,price,tags,name,flag,name\n"
+    '1,2024-01-02,2024-01-02 10:30:00,12.50,"{""a"": [1, 2]}",Books,t,x\n'
+    '2,\\N,\\N,\\N,\\N,"",\\N,y\n'
+)
+DRIVER_ROWS = [
+    (1, datetime.date(2024, 1, 2), datetime.datetime(2024, 1, 2, 10, 30), 12.5, {"a": [1, 2]}, "Books", True, "x"),
+    (2, None, None, None, None, "", None, "y"),
+]
+
+def test_copy_output_decodes_like_read_sql():
+    df = _read_csv_pandas(io.BytesIO(COPY_OUTPUT.encode()), COLUMNS)
+    # read_sql builds its frame with DataFrame.from_records(..., coerce_float=True).
+    expected = pd.DataFrame.from_records(DRIVER_ROWS, columns=[name for name, _ in COLUMNS], coerce_float=True)
+    expected["at"] = pd.to_datetime(expected["at"])
+    pd.testing.assert_frame_equal(df, expected)
+    assert list(df.columns) == ["id", "day", "at", "price", "tags", "name", "flag", "name"]
+    assert df.iloc[0, 1] == datetime.date(2024, 1, 2)
+    assert df["tags"][0] == {"a": [1, 2]}
+
+def test_native_fetch_matches_read_sql():
+    uri = os.getenv("SQLCHAT_TEST_POSTGRES_URI")
+    if not uri:
+        pytest.skip("set SQLCHAT_TEST_POSTGRES_URI to compare against a PostgreSQL server")
+    pytest.importorskip("psycopg2")
+    from sqlalchemy import create_engine
+    from utils.fetch import fetch_postgresql
+    query = (
+        "SELECT id, day, at, at_tz, price, tags, name, flag, tm, label AS name FROM (VALUES"
+        " (1, DATE '2024-01-02', TIMESTAMP '2024-01-02 10:30', TIMESTAMPTZ '2024-01-02 10:30+02',"
+        "  12.50::numeric, '{\"a\": [1, 2]}'::jsonb, 'Books'::text, true, TIME '10:30', 'x'),"
+        " (2, NULL, NULL, NULL, NULL, NULL, '', NULL, NULL, 'y')"
+        ") AS t(id, day, at, at_tz, price, tags, name, flag, tm, label)"
+    )
+    engine = create_engine(uri)
+    pd.testing.assert_frame_equal(fetch_postgresql(query, engine), pd.read_sql(query, engine))
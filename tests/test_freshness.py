@@ -0,0 +1,83 @@
+import time
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+from utils import freshness
+from utils.cache import TTLCache, frame_bytes, result_cache
+
+def test_invalidate_tables_drops_only_dependents():
+    cache = TTLCache()
+    cache.set("orders", 1, tables=["ORDERS"])
+    cache.set("joined", 2, tables=["ORDERS", "PRODUCTS"])
+    cache.set("products", 3, tables=["PRODUCTS"])
+    assert cache.invalidate_tables(["ORDERS"]) == 2
+    assert cache.get("products") == 3 and "orders" not in cache and "joined" not in cache
+    assert cache._dependents == {"PRODUCTS": {"products"}}
+
+def test_expired_and_evicted_entries_leave_no_dependencies():
+    cache = TTLCache(ttl=0.01, max_entries=1)
+    cache.set("a", 1, tables=["A"])
+    cache.set("b", 2, tables=["B"])
+    assert cache._dependents == {"B": {"b"}}
+    time.sleep(0.02)
+    assert cache.get("b") is None
+    assert cache._dependents == {}
+
+def test_byte_cap_evicts_oldest_and_skips_oversized_values():
+    df = pd.DataFrame({"s": ["x" * 1000] * 100})
+    size = frame_bytes(df)
+    cache = TTLCache(max_bytes=2 * size, sizeof=frame_bytes)
+    for key in "abc":
+        cache.set(key, df)
+    assert list(cache._entries) == ["b", "c"] and cache.bytes == 2 * size
+    cache.set("big", pd.concat([df] * 3))
+    assert "big" not in cache and cache.bytes == 2 * size
+
+@pytest.fixture
+def watched(monkeypatch):
+    """A watched in-memory database whose markers the test sets."""
+    engine = create_engine("sqlite://")
+    markers = {"ORDERS": (1,), "PRODUCTS": (1,)}
+    monkeypatch.setattr(freshness, "read_markers", lambda _: dict(markers))
+    watcher = freshness.FreshnessWatcher(engine, interval=3600)
+    watcher.poll()
+    monkeypatch.setitem(freshness._watchers, str(engine.url), watcher)
+    yield engine, watcher, markers
+    result_cache.invalidate()
+
+def test_watcher_drops_results_of_changed_tables(watched):
+    engine, watcher, markers = watched
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return value
+
+    freshness.cached_query(engine, "SELECT * FROM ORDERS", lambda: compute("orders"))
+    freshness.cached_query(engine, "SELECT * FROM PRODUCTS", lambda: compute("products"))
+    freshness.cached_query(engine, "SELECT * FROM ORDERS", lambda: compute("orders"))
+    assert calls == ["orders", "products"]
+
+    markers["ORDERS"] = (2,)
+    assert watcher.poll() == {"ORDERS"}
+    freshness.cached_query(engine, "SELECT * FROM ORDERS", lambda: compute("orders"))
+    freshness.cached_query(engine, "SELECT * FROM PRODUCTS", lambda: compute("products"))
+    assert calls == ["orders", "products", "orders"]
+
+def test_literals_differing_in_whitespace_are_cached_apart(watched):
+    engine, _, _ = watched
+    first = freshness.cached_query(engine, "SELECT * FROM ORDERS WHERE NAME = 'a  b'", lambda: "two spaces")
+    second = freshness.cached_query(engine, "SELECT * FROM ORDERS WHERE NAME = 'a b'", lambda: "one space")
+    assert (first, second) == ("two spaces", "one space")
+
+def test_change_callbacks_run_once(watched):
+    engine, watcher, markers = watched
+    runs = []
+    freshness.on_change(["PRODUCTS"], "kv", lambda: runs.append(1))
+    markers["PRODUCTS"] = (2,)
+    watcher.poll()
+    markers["PRODUCTS"] = (3,)
+    watcher.poll()
+    assert runs == [1]
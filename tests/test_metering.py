@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from utils import metering, resilience
+
+class FlakyModel:
+    """Fails its first request with a transient error, then answers."""
+
+    def __init__(self):
+        self.requests = 0
+
+    def __call__(self, prompt, timeout=None):
+        self.requests += 1
+        if self.requests == 1:
+            raise ConnectionError("reset by peer")
+        return "SELECT 1"
+
+    def invoke(self, prompt, config=None, timeout=None):
+        return self(prompt, timeout)
+
+def test_every_request_sent_is_metered():
+    model = FlakyModel()
+    chain = metering.metered("test_sql", "Write only the SQL query for: {question}", model)
+    turn = metering.start_turn("test")
+    try:
+        assert resilience.invoke("test_sql", chain, {"question": "how many orders?"}) == "SELECT 1"
+    finally:
+        metering.finish_turn(turn)
+    usage = turn.stages["test_sql"]
+    assert model.requests == 2
+    assert usage.counts["calls"] == 2
+    assert usage.counts["completion_tokens"] > 0
+
+def test_streaming_is_metered_once():
+    chain = metering.metered("test_response", "Answer: {question}", lambda prompt: "Here is the answer.")
+    turn = metering.start_turn("test")
+    try:
+        assert "".join(chain.stream({"question": "how many orders?"})) == "Here is the answer."
+    finally:
+        metering.finish_turn(turn)
+    assert turn.stages["test_response"].counts["calls"] == 1
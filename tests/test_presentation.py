@@ -0,0 +1,39 @@
+import sys
+
+import pandas as pd
+import pytest
+
+from utils.presentation import PagedResult, present
+
+@pytest.fixture(params=["pandas", "pyarrow"])
+def backend(request, monkeypatch):
+    if request.param == "pyarrow":
+        pytest.importorskip("pyarrow")
+    else:
+        # A None entry makes `import pyarrow` raise ImportError.
+        monkeypatch.setitem(sys.modules, "pyarrow", None)
+    return request.param
+
+def test_pages_slice_the_result(backend):
+    df = pd.DataFrame({"ID": range(7), "NAME": [f"n{i}" for i in range(7)]})
+    result = PagedResult(df, page_size=3)
+    assert (result.num_rows, result.num_pages) == (7, 3)
+    assert result.page(1)["ID"].tolist() == [0, 1, 2]
+    assert result.page(3)["ID"].tolist() == [6]
+    assert result.page(3).index.tolist() == [0]
+    pd.testing.assert_frame_equal(result.page(2), df.iloc[3:6].reset_index(drop=True))
+
+def test_out_of_range_pages_are_clamped(backend):
+    result = PagedResult(pd.DataFrame({"ID": range(5)}), page_size=2)
+    assert result.page(0)["ID"].tolist() == [0, 1]
+    assert result.page(99)["ID"].tolist() == [4]
+
+def test_empty_result_has_one_empty_page(backend):
+    result = present([])
+    assert result.num_pages == 1
+    assert result.page(1).empty
+
+def test_text_form_shows_the_first_page(backend):
+    result = present([{"ID": i} for i in range(3)], page_size=2)
+    assert repr(result) == "PagedResult(3 rows)"
+    assert str(result) == "ID\n0\n1\n... (3 rows in total)\n"
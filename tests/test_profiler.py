@@ -0,0 +1,60 @@
+import marshal
+import threading
+import time
+
+import pytest
+
+from utils import profiler
+from utils.profiler import TurnProfile
+
+def sampled_profile():
+    profile = TurnProfile("t1", "s1", "sampling")
+    profile.seconds = 1.0
+    profile.ticks = 10
+    profile.stacks.update({("main", "run", "fetch"): 6, ("main", "run"): 3, ("main",): 1})
+    return profile
+
+def test_top_of_sampled_stacks():
+    rows = sampled_profile().top(limit=2)
+    assert [row["function"] for row in rows] == ["fetch", "run"]
+    assert (rows[0]["self_s"], rows[0]["cumulative_s"]) == pytest.approx((0.6, 0.6))
+    assert (rows[1]["self_s"], rows[1]["cumulative_s"]) == pytest.approx((0.3, 0.9))
+    assert rows[0]["calls"] is None
+
+def test_top_of_cprofile_stats():
+    profile = TurnProfile("t1", "s1", "cprofile")
+    profile.stats = {
+        ("/app/local_chat.py", 10, "generate_sql"): (1, 1, 0.2, 1.5, {}),
+        ("~", 0, "<built-in method time.sleep>"): (3, 3, 1.0, 1.0, {}),
+    }
+    rows = profile.top()
+    assert rows[0] == {"function": "<built-in method time.sleep>", "self_s": 1.0, "cumulative_s": 1.0, "calls": 3}
+    assert rows[1]["function"] == "generate_sql (local_chat.py:10)"
+
+def test_export_formats():
+    file_name, data = sampled_profile().export()
+    assert file_name == "turn-t1.collapsed.txt"
+    assert data.decode().splitlines() == ["main;run;fetch 6", "main;run 3", "main 1"]
+    profile = TurnProfile("t2", "s1", "cprofile")
+    profile.stats = {("~", 0, "f"): (1, 1, 0.1, 0.1, {})}
+    file_name, data = profile.export()
+    assert file_name == "turn-t2.prof"
+    assert marshal.loads(data) == profile.stats
+
+def busy_in_worker(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+def test_sampling_covers_traced_worker_threads(monkeypatch):
+    monkeypatch.setenv(profiler.MODE_ENV, "sampling")
+    monkeypatch.setenv(profiler.INTERVAL_ENV, "0.001")
+    capture = profiler.start_turn("t3", "s1", enabled=True)
+    stop = threading.Event()
+    worker = threading.Thread(target=profiler.traced(busy_in_worker), args=(stop,))
+    worker.start()
+    time.sleep(0.1)
+    stop.set()
+    worker.join()
+    profile = profiler.finish_turn(capture)
+    assert any(label.startswith("busy_in_worker ") for stack in profile.stacks for label in stack)
+    assert profiler.traced(busy_in_worker) is busy_in_worker
@@ -0,0 +1,48 @@
+import time
+
+import pytest
+
+from utils.fake_llm import FakeChatModel
+from utils.resilience import CircuitBreaker, LLMUnavailable, ResilientCaller
+
+def half_open_caller():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    caller = ResilientCaller("test", breaker, hedge_percentile=None, max_retries=0)
+
+    def unreachable():
+        raise ConnectionError("provider down")
+
+    with pytest.raises(LLMUnavailable):
+        caller.call(unreachable)
+    assert breaker.state == "half-open"
+    return caller, breaker
+
+def test_non_transient_error_does_not_close_the_circuit():
+    caller, breaker = half_open_caller()
+    with pytest.raises(ValueError):
+        caller.call(lambda: int("not a number"))
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+
+def test_success_closes_the_circuit():
+    caller, breaker = half_open_caller()
+    assert caller.call(lambda: 42) == 42
+    assert breaker.state == "closed"
+
+def test_no_backoff_after_the_last_attempt():
+    caller = ResilientCaller("test", CircuitBreaker(), hedge_percentile=None, max_retries=0, backoff=30.0)
+
+    def unreachable():
+        raise ConnectionError("provider down")
+
+    start = time.monotonic()
+    with pytest.raises(LLMUnavailable):
+        caller.call(unreachable)
+    assert time.monotonic() - start < 1.0
+
+def test_fake_model_honours_the_client_timeout():
+    model = FakeChatModel(latency_median=5.0, latency_sigma=0.0)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        model.invoke("question", timeout=0.05)
+    assert time.monotonic() - start < 1.0
@@ -0,0 +1,75 @@
+import pytest
+
+from utils import rollups
+from utils.rollups import ROLLUPS, build_rollup, refresh_rollup, rewrite_query
+
+BY_DAY = next(rollup for rollup in ROLLUPS if rollup.name == "AGG_ORDERS_BY_DAY")
+
+def test_sum_reads_the_rollup():
+    sql, used = rewrite_query("SELECT ORDER_DATE, SUM(TOTAL_AMOUNT) FROM ORDER_DETAILS GROUP BY ORDER_DATE", ROLLUPS)
+    assert used == "AGG_ORDERS_BY_DAY"
+    assert sql == "SELECT ORDER_DATE, SUM(REVENUE) FROM AGG_ORDERS_BY_DAY GROUP BY ORDER_DATE;"
+
+def test_count_stays_zero_on_empty_input():
+    sql, used = rewrite_query("SELECT ORDER_DATE, COUNT(*) FROM ORDER_DETAILS GROUP BY ORDER_DATE", ROLLUPS)
+    assert used == "AGG_ORDERS_BY_DAY"
+    assert "COALESCE(SUM(ROW_COUNT), 0)" in sql
+
+def test_avg_is_a_decimal_ratio_of_sums():
+    sql, used = rewrite_query("SELECT AVG(TOTAL_AMOUNT) FROM ORDER_DETAILS", ROLLUPS)
+    assert used == "AGG_ORDERS_BY_DAY"
+    assert "(SUM(REVENUE) * 1.0 / NULLIF(SUM(REVENUE_COUNT), 0))" in sql
+
+def test_filter_on_a_column_outside_the_rollup_is_left_alone():
+    sql = "SELECT ORDER_DATE, SUM(TOTAL_AMOUNT) FROM ORDER_DETAILS WHERE ORDER_ID = 3 GROUP BY ORDER_DATE"
+    assert rewrite_query(sql, ROLLUPS) == (sql, None)
+
+@pytest.fixture
+def orders():
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.pool import StaticPool
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE ORDER_DETAILS (ORDER_ID INTEGER, ORDER_DATE DATE, TOTAL_AMOUNT FLOAT)"))
+        conn.execute(text("INSERT INTO ORDER_DETAILS VALUES (1, '2024-01-01', 10), (2, '2024-01-02', 20)"))
+    build_rollup(engine, BY_DAY)
+    return engine
+
+def rolled_up(engine):
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        return conn.execute(text(f"SELECT ORDER_DATE, ROW_COUNT, REVENUE FROM {BY_DAY.name} ORDER BY ORDER_DATE")).fetchall()
+
+def insert(engine, values):
+    from sqlalchemy import text
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO ORDER_DETAILS VALUES {values}"))
+
+def test_incremental_refresh_recomputes_groups_from_the_watermark(orders, monkeypatch):
+    monkeypatch.setattr(rollups, "_appended_only", lambda *args: True)
+    insert(orders, "(3, '2024-01-02', 5), (4, '2024-01-03', 1)")
+    refresh_rollup(orders, BY_DAY)
+    assert rolled_up(orders) == [("2024-01-01", 1, 10.0), ("2024-01-02", 2, 25.0), ("2024-01-03", 1, 1.0)]
+
+def test_backdated_and_undated_rows_force_a_rebuild(orders, monkeypatch):
+    monkeypatch.setattr(rollups, "_appended_only", lambda *args: True)
+    insert(orders, "(3, '2023-12-31', 7), (4, NULL, 1)")
+    refresh_rollup(orders, BY_DAY)
+    assert rolled_up(orders) == [(None, 1, 1.0), ("2023-12-31", 1, 7.0), ("2024-01-01", 1, 10.0), ("2024-01-02", 1, 20.0)]
+
+def test_other_changes_rebuild(orders):
+    from sqlalchemy import text
+    with orders.begin() as conn:
+        conn.execute(text("UPDATE ORDER_DETAILS SET TOTAL_AMOUNT = 11 WHERE ORDER_ID = 1"))
+    # SQLite has no change markers, so it can never prove an append-only change.
+    refresh_rollup(orders, BY_DAY)
+    assert rolled_up(orders)[0] == ("2024-01-01", 1, 11.0)
+
+def test_only_insert_counters_may_move_for_an_incremental_refresh(monkeypatch):
+    from types import SimpleNamespace
+    engine = SimpleNamespace(dialect=SimpleNamespace(name="postgresql"))
+    # PostgreSQL markers: inserts, updates, deletes, relfilenode.
+    monkeypatch.setattr(rollups, "_recorded_states", lambda _: {BY_DAY.name: '{"ORDER_DETAILS": [5, 0, 0, 100]}'})
+    assert rollups._appended_only(engine, BY_DAY, '{"ORDER_DETAILS": [9, 0, 0, 100]}')
+    assert not rollups._appended_only(engine, BY_DAY, '{"ORDER_DETAILS": [9, 1, 0, 100]}')
+    assert not rollups._appended_only(engine, BY_DAY, '{"ORDER_DETAILS": [0, 0, 0, 101]}')
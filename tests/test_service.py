@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+pytest.importorskip("langchain_core")
+pytest.importorskip("streamlit")
+
+from fastapi.testclient import TestClient
+
+from utils.fake_llm import DEFAULT_SQL
+
+@pytest.fixture(scope="module")
+def client():
+    # The fake model and the embedded SQLite database built from data/*.csv.
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("SQLCHAT_FAKE_LLM", "1")
+        mp.setenv("SQLCHAT_BACKEND", "postgresql")
+        mp.setenv("SQLCHAT_DB_URI", "local")
+        from service import app
+        with TestClient(app) as client:
+            yield client
+
+def test_sql(client):
+    response = client.post("/sql", json={"question": "How many products are in each category?"})
+    assert response.status_code == 200
+    assert response.json()["sql"].rstrip(";") == DEFAULT_SQL.rstrip(";")
+
+def test_execute(client):
+    response = client.post("/execute", json={"sql": "SELECT PRODUCT_ID, CATEGORY FROM PRODUCTS ORDER BY PRODUCT_ID", "max_rows": 2})
+    assert response.status_code == 200
+    body = response.json()
+    assert [c.upper() for c in body["columns"]] == ["PRODUCT_ID", "CATEGORY"]
+    assert len(body["rows"]) == 2
+    assert body["truncated"] and body["row_count"] > 2
+
+def test_execute_bad_sql_is_a_client_error(client):
+    response = client.post("/execute", json={"sql": "SELECT * FROM NO_SUCH_TABLE"})
+    assert response.status_code == 400
+    assert "NO_SUCH_TABLE" in response.json()["detail"]["error"].upper()
+
+def test_execute_rejects_writes(client):
+    for sql in ("DELETE FROM PRODUCTS", "SELECT 1; DROP TABLE PRODUCTS"):
+        response = client.post("/execute", json={"sql": sql})
+        assert response.status_code == 400, sql
+    assert client.post("/execute", json={"sql": "SELECT COUNT(*) FROM PRODUCTS"}).json()["rows"][0][0] > 0
+
+def test_answer(client):
+    response = client.post("/answer", json={"question": "How many products are in each category?"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["answer"] == "Here is the summary of the query result."
+    assert "PRODUCTS" in body["sql"].upper()
+
+def test_answer_stream(client):
+    response = client.post("/answer/stream", json={"question": "How many products are in each category?"})
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines() if line]
+    assert "PRODUCTS" in events[0]["sql"].upper()
+    assert events[-1] == {"done": True}
+    assert "".join(e["token"] for e in events if "token" in e) == "Here is the summary of the query result."
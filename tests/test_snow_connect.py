@@ -0,0 +1,80 @@
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("streamlit")
+
+from utils.snow_connect import SessionPool
+
+PARAMS = {"account": "acct", "user": "me", "role": "ANALYST"}
+
+class OperationalError(Exception):
+    """Named like the connector's lost-connection error."""
+
+class FakeSession:
+    def __init__(self, params):
+        self.params = params
+        self.closed = False
+        self.queries = []
+        self.fail_with = None
+
+    def sql(self, query):
+        self.queries.append(query)
+        if self.fail_with is not None:
+            raise self.fail_with
+        return self
+
+    def collect(self):
+        return []
+
+    def close(self):
+        self.closed = True
+
+def make_pool(**kwargs):
+    return SessionPool(session_factory=FakeSession, heartbeat_interval=0, **kwargs)
+
+def test_released_session_is_reused():
+    pool = make_pool()
+    with pool.session(PARAMS) as first:
+        pass
+    with pool.session(PARAMS) as second:
+        pass
+    assert second is first
+
+def test_acquire_times_out_when_the_role_is_full():
+    pool = make_pool(max_size=1)
+    held = pool.acquire(PARAMS)
+    with pytest.raises(TimeoutError):
+        pool.acquire(PARAMS, timeout=0.05)
+    pool.release(held)
+    assert pool.acquire(PARAMS, timeout=0.05) is held
+
+def test_sql_errors_keep_the_session_and_connection_errors_discard_it():
+    pool = make_pool()
+    with pytest.raises(ValueError):
+        with pool.session(PARAMS) as session:
+            raise ValueError("SQL compilation error")
+    assert not session.closed
+    with pytest.raises(OperationalError):
+        with pool.session(PARAMS) as same:
+            raise OperationalError("connection reset")
+    assert same is session and session.closed
+    with pool.session(PARAMS) as fresh:
+        assert fresh is not session
+
+def test_heartbeat_pings_idle_sessions_and_drops_dead_ones():
+    pool = make_pool(max_size=2)
+    healthy, dead = pool.acquire(PARAMS), pool.acquire(PARAMS)
+    dead.fail_with = OperationalError("session gone")
+    pool.release(healthy)
+    pool.release(dead)
+    pool.ping_idle()
+    assert healthy.queries == ["SELECT 1"] and not healthy.closed
+    assert dead.closed
+    assert pool.acquire(PARAMS) is healthy
+
+def test_heartbeat_closes_sessions_idle_too_long():
+    pool = make_pool(max_idle=0.0)
+    with pool.session(PARAMS) as session:
+        pass
+    pool.ping_idle()
+    assert session.closed and session.queries == []
@@ -0,0 +1,79 @@
+import pytest
+
+from utils.sql_repair import SQLRepairError, execute_with_repair, extract_sql, fix_dialect, is_query_error
+
+def test_extract_sql_strips_fences_and_prose():
+    text = "Here is the query:\n```sql\nSELECT a FROM t\n```\nThis returns all rows."
+    assert extract_sql(text) == "SELECT a FROM t;"
+
+def test_extract_sql_keeps_clauses_after_blank_line():
+    assert extract_sql("SELECT a\nFROM t\n\nWHERE b = 1") == "SELECT a\nFROM t\n\nWHERE b = 1;"
+
+def test_extract_sql_keeps_cte_after_blank_line():
+    sql = "WITH x AS (SELECT a FROM t)\n\nSELECT a FROM x"
+    assert extract_sql(sql) == sql + ";"
+
+def test_extract_sql_drops_trailing_note():
+    assert extract_sql("SELECT a FROM t;\n\nNote: this counts every row in the table.") == "SELECT a FROM t;"
+
+def test_fix_dialect_top_becomes_limit():
+    assert fix_dialect("SELECT TOP 5 * FROM t", "postgresql") == "SELECT * FROM t LIMIT 5;"
+
+def test_fix_dialect_ignores_limit_of_subquery():
+    sql = "SELECT TOP 5 * FROM (SELECT a FROM t LIMIT 10) s"
+    assert fix_dialect(sql, "postgresql") == "SELECT * FROM (SELECT a FROM t LIMIT 10) s LIMIT 5;"
+
+def test_fix_dialect_limits_the_subquery_holding_top():
+    sql = "SELECT * FROM (SELECT TOP 3 a FROM t ORDER BY a) s"
+    assert fix_dialect(sql, "postgresql") == "SELECT * FROM (SELECT a FROM t ORDER BY a LIMIT 3) s"
+
+def sqlite_engine():
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.pool import StaticPool
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE t (a INTEGER)"))
+    return engine
+
+def error_of(engine, sql):
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        try:
+            conn.execute(text(sql))
+        except Exception as e:
+            return e
+
+def test_query_errors_are_told_from_connection_errors():
+    from sqlalchemy.exc import OperationalError
+    engine = sqlite_engine()
+    assert is_query_error(error_of(engine, "SELECT b FROM t"))
+    assert is_query_error(error_of(engine, "SELEC a FROM t"))
+    assert not is_query_error(OperationalError("SELECT 1", None, Exception("server closed the connection unexpectedly")))
+    assert not is_query_error(TimeoutError())
+
+def test_connection_errors_are_not_repaired():
+    def run(query):
+        raise ConnectionError("connection reset")
+
+    def repair_with_llm(query, error):
+        raise AssertionError("the model must not be asked")
+
+    with pytest.raises(ConnectionError):
+        execute_with_repair("SELECT a FROM t", run, "postgresql", repair_with_llm=repair_with_llm)
+
+def test_model_repair_is_prepared_like_a_generated_query():
+    from sqlalchemy import text
+    engine = sqlite_engine()
+
+    def run(query):
+        with engine.connect() as conn:
+            return conn.execute(text(query)).fetchall()
+
+    result, query = execute_with_repair(
+        "SELECT b FROM t", run, "postgresql",
+        repair_with_llm=lambda query, error: "SELECT a FROM t",
+        prepare=lambda query: query.replace("FROM t", "FROM t WHERE a > 0"),
+    )
+    assert (result, query) == ([], "SELECT a FROM t WHERE a > 0;")
+    with pytest.raises(SQLRepairError):
+        execute_with_repair("SELECT b FROM t", run, "postgresql", repair_with_llm=lambda query, error: "SELECT c FROM t")
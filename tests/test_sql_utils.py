@@ -0,0 +1,16 @@
+from utils.sql_utils import is_read_only
+
+def test_single_selects_are_read_only():
+    assert is_read_only("SELECT 1;")
+    assert is_read_only("with a as (select 1) select * from a")
+    assert is_read_only("SELECT 'drop table t; delete' FROM t -- ; update")
+
+def test_writes_and_multiple_statements_are_not():
+    for sql in (
+        "SELECT * FROM t; DROP TABLE t",
+        "DELETE FROM t",
+        "WITH x AS (DELETE FROM t RETURNING *) SELECT * FROM x",
+        "SELECT * INTO t2 FROM t",
+        "SELECT * FROM t FOR UPDATE",
+    ):
+        assert not is_read_only(sql), sql
@@ -0,0 +1,24 @@
+from utils.value_index import ValueIndex
+
+INDEX = ValueIndex({
+    ("PRODUCTS", "CATEGORY"): ["Books", "Electronics", "Home & Kitchen"],
+    ("CUSTOMER_DETAILS", "CITY"): ["Mumbai", "Pune"],
+})
+
+def test_snap_fixes_case_and_spelling():
+    sql, changes = INDEX.snap("SELECT * FROM PRODUCTS WHERE CATEGORY IN ('electronics', 'Boks')")
+    assert sql == "SELECT * FROM PRODUCTS WHERE CATEGORY IN ('Electronics', 'Books')"
+    assert changes == [("electronics", "Electronics"), ("Boks", "Books")]
+
+def test_snap_leaves_stored_and_unrelated_values():
+    sql = "SELECT * FROM PRODUCTS p WHERE p.CATEGORY = 'Books' AND NAME = 'boks'"
+    assert INDEX.snap(sql) == (sql, [])
+
+def test_snap_ignores_columns_of_tables_not_read():
+    sql = "SELECT * FROM ORDER_DETAILS WHERE CITY = 'mumbai'"
+    assert INDEX.snap(sql) == (sql, [])
+
+def test_hints_list_matching_values():
+    hints = INDEX.hints("revenue from electronic products in mumbai")
+    assert "PRODUCTS.CATEGORY: 'Electronics'" in hints
+    assert "CUSTOMER_DETAILS.CITY: 'Mumbai'" in hints
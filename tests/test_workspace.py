@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+from utils.workspace import LAST_RESULT, ResultWorkspace
+
+def frame(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({"CATEGORY": [f"c{i}" for i in range(rows)], "REVENUE": range(rows)})
+
+def test_oldest_results_are_evicted_past_max_tables():
+    workspace = ResultWorkspace(max_tables=2)
+    names = [workspace.add(frame(3)) for _ in range(3)]
+    assert names == ["RESULT_1", "RESULT_2", "RESULT_3"]
+    assert workspace.names == ["RESULT_2", "RESULT_3", LAST_RESULT]
+
+def test_eviction_by_bytes_spares_recently_read_results():
+    size = int(frame(100).memory_usage(index=True, deep=True).sum())
+    workspace = ResultWorkspace(max_bytes=size * 2)
+    workspace.add(frame(100))
+    workspace.add(frame(100))
+    workspace.get("result_1")
+    workspace.add(frame(100))
+    assert workspace.names == ["RESULT_1", "RESULT_3", LAST_RESULT]
+    assert workspace.total_bytes <= workspace.max_bytes
+
+def test_empty_and_oversized_results_are_not_stored():
+    workspace = ResultWorkspace(max_bytes=1024)
+    assert workspace.add(frame(0)) == ""
+    assert workspace.add(frame(1000)) == ""
+    assert workspace.names == []
+    with pytest.raises(KeyError):
+        workspace.get(LAST_RESULT)
+
+def test_last_result_is_the_most_recent_add():
+    workspace = ResultWorkspace()
+    workspace.add(frame(2), question="first")
+    workspace.add(frame(5), question="second")
+    workspace.get("RESULT_1")
+    assert len(workspace.get(LAST_RESULT)) == 5
+    assert workspace.can_answer("SELECT * FROM LAST_RESULT")
+    assert not workspace.can_answer("SELECT * FROM LAST_RESULT JOIN PRODUCTS USING (CATEGORY)")
+    result = workspace.query("SELECT COUNT(*) AS N FROM LAST_RESULT WHERE REVENUE > 1;")
+    assert int(result["N"][0]) == 3
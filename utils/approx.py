@@ -0,0 +1,225 @@
+# utils/approx.py
+import contextvars
+import logging
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from utils.sql_utils import referenced_tables
+
+logger = logging.getLogger(__name__)
+
+FRACTION_ENV = "SQLCHAT_SAMPLE_FRACTION"
+TARGET_ROWS_ENV = "SQLCHAT_SAMPLE_ROWS"
+MIN_ROWS_ENV = "SQLCHAT_SAMPLE_MIN_ROWS"
+
+# Block sampling: only the sampled micro-partitions (Snowflake) or pages
+# (PostgreSQL) are read, which is where the time and credits are saved.
+SAMPLE_CLAUSES = {
+    "snowflake": "SAMPLE SYSTEM ({percent})",
+    "postgresql": "TABLESAMPLE SYSTEM ({percent})",
+}
+
+_LITERALS_AND_COMMENTS = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.S)
+# Queries whose meaning changes when one table is thinned out.
+_NOT_SAMPLED = re.compile(
+    r"\b(WITH|UNION|INTERSECT|EXCEPT|MINUS|OVER|SAMPLE|TABLESAMPLE|LEFT|RIGHT|FULL|CROSS|LATERAL)\b", re.I
+)
+_AGGREGATE = re.compile(r"\b(SUM|COUNT|AVG|MIN|MAX)\s*\(", re.I)
+_KEYWORDS = {
+    "WHERE", "JOIN", "INNER", "ON", "GROUP", "ORDER", "HAVING", "LIMIT", "QUALIFY", "FETCH", "OFFSET",
+    "WINDOW", "USING", "NATURAL",
+}
+
+@dataclass(frozen=True)
+class Sampling:
+    """
+    How to sample: `fraction` of the largest table a query reads, or enough
+    to get about `target_rows` rows when set. Tables under `min_rows` rows are
+    always read in full.
+    """
+    fraction: float = 0.05
+    target_rows: int = 0
+    min_rows: int = 1_000_000
+
+    @classmethod
+    def from_env(cls) -> "Sampling":
+        return cls(
+            fraction=float(os.getenv(FRACTION_ENV, "0.05")),
+            target_rows=int(os.getenv(TARGET_ROWS_ENV, "0")),
+            min_rows=int(os.getenv(MIN_ROWS_ENV, "1000000")),
+        )
+
+    def fraction_for(self, rows: int) -> float:
+        return min(1.0, self.target_rows / rows) if self.target_rows else self.fraction
+
+@dataclass
+class Approximation:
+    """One sampled query: which table, at what rate, and which aggregates were scaled."""
+    table: str
+    rows: int
+    percent: float
+    scaled: List[str] = field(default_factory=list)
+    unscaled: List[str] = field(default_factory=list)
+    # The sampled query, set by maybe_sample().
+    query: str = ""
+
+    @property
+    def fraction(self) -> float:
+        return self.percent / 100
+
+    @property
+    def factor(self) -> float:
+        return 100 / self.percent
+
+    def margin(self, share: float = 1.0) -> float:
+        """
+        Relative 95% margin of error of a scaled COUNT or SUM over `share` of
+        the table's rows, assuming rows are sampled independently. Block
+        sampling can do worse when values cluster by storage order.
+        """
+        sampled = self.fraction * self.rows * share
+        return 1.96 * math.sqrt((1 - self.fraction) / sampled) if sampled else float("inf")
+
+    def note(self) -> str:
+        text = (
+            f"≈ Approximate answer: {self.table} was sampled at {self.percent:g}% "
+            f"(about {round(self.fraction * self.rows):,} of {self.rows:,} rows)."
+        )
+        if self.scaled:
+            text += (
+                f" {' and '.join(sorted(set(self.scaled)))} values are scaled ×{self.factor:g}; a total over all rows"
+                f" is within about ±{self.margin():.1%} (95% confidence), a group holding 1% of the rows"
+                f" within about ±{self.margin(0.01):.0%}."
+            )
+        if self.unscaled:
+            text += f" {', '.join(sorted(set(self.unscaled)))} are computed on the sample only."
+        return text + " Turn off approximate answers for exact figures."
+
+def _mask(sql: str) -> str:
+    """Blank out literals and comments, keeping every other character at its offset."""
+    return _LITERALS_AND_COMMENTS.sub(lambda m: " " * len(m.group(0)), sql)
+
+def _closing_paren(text: str, start: int) -> int:
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == "(":
+            depth += 1
+        elif text[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+def rewrite(query: str, dialect: str, table_rows: Dict[str, int], sampling: Sampling) -> Tuple[str, Optional[Approximation]]:
+    """
+    Return (query, approximation): `query` with its largest table sampled and
+    SUM/COUNT scaled up by the inverse sampling rate, or the query unchanged
+    and None when it should be answered exactly. Only single-SELECT aggregate
+    queries over inner joins are sampled, and a table read twice is not.
+    """
+    clause = SAMPLE_CLAUSES.get(dialect)
+    masked = _mask(query)
+    if clause is None or len(re.findall(r"\bSELECT\b", masked, re.I)) != 1 or _NOT_SAMPLED.search(masked):
+        return query, None
+    aggregates = list(_AGGREGATE.finditer(masked))
+    if not any(m.group(1).upper() in ("SUM", "COUNT", "AVG") for m in aggregates):
+        return query, None
+    candidates = [(table_rows.get(table, 0), table) for table in referenced_tables(query)]
+    rows, table = max(candidates, default=(0, ""))
+    if rows < sampling.min_rows:
+        return query, None
+    percent = float(f"{sampling.fraction_for(rows) * 100:.4g}")
+    if not 0 < percent < 100:
+        return query, None
+
+    refs = list(re.finditer(
+        rf'\b(?:FROM|JOIN)\s+(?P<name>(?:(?:"[^"]+"|\w+)\s*\.\s*)*"?{table}"?)(?![\w"])(?:\s+(?:AS\s+)?(?P<alias>[A-Za-z_]\w*))?',
+        masked, re.I,
+    ))
+    if len(refs) != 1:
+        return query, None
+    # The sample clause goes after the table's alias, where both dialects expect it.
+    alias = refs[0].group("alias")
+    end = refs[0].end() if alias and alias.upper() not in _KEYWORDS else refs[0].end("name")
+
+    approximation = Approximation(table, rows, percent)
+    edits = [(end, end, " " + clause.format(percent=f"{percent:g}"))]
+    for match in aggregates:
+        func = match.group(1).upper()
+        close = _closing_paren(masked, match.end() - 1)
+        if close < 0:
+            return query, None
+        distinct = re.match(r"\s*DISTINCT\b", masked[match.end():close], re.I)
+        if func in ("SUM", "COUNT") and not distinct:
+            approximation.scaled.append(func)
+            # Dividing by the written fraction keeps the factor exact (x / 0.03, not x * 33.3333).
+            edits += [(match.start(), match.start(), "("), (close + 1, close + 1, f" / {approximation.fraction:g})")]
+        else:
+            approximation.unscaled.append(f"{func}(DISTINCT ...)" if distinct else func)
+    for start, stop, text in sorted(edits, key=lambda edit: -edit[0]):
+        query = query[:start] + text + query[stop:]
+    return query, approximation
+
+def table_rows(engine) -> Dict[str, int]:
+    """
+    Estimated rows per table of `engine`'s current schema from metadata (SHOW
+    TABLES on Snowflake, pg_class.reltuples on PostgreSQL), cached with the
+    schema text. Other dialects report nothing and are never sampled.
+    """
+    from utils.cache import schema_cache
+    from utils.freshness import ANY_TABLE, dependencies, read_markers
+
+    def load():
+        if engine.dialect.name == "snowflake":
+            return {table: int(marker[0] or 0) for table, marker in read_markers(engine).items()}
+        if engine.dialect.name == "postgresql":
+            from sqlalchemy import text
+            with engine.connect() as conn:
+                rows = conn.execute(text(
+                    "SELECT c.relname, c.reltuples FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                    "WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p')"
+                )).fetchall()
+            # reltuples is -1 for tables that were never analyzed.
+            return {name.upper(): max(0, int(estimate)) for name, estimate in rows}
+        return {}
+
+    return schema_cache.get_or_compute(("table_rows", str(engine.url)), load, tables=dependencies(engine, [ANY_TABLE]))
+
+# Per-turn opt-in, set by the chat UI: (sampling, approximations applied this turn).
+_current: contextvars.ContextVar[Optional[Tuple[Sampling, List[Approximation]]]] = contextvars.ContextVar(
+    "approx_turn", default=None
+)
+
+def start_turn(sampling: Optional[Sampling]) -> None:
+    """Answer the current turn approximately with `sampling`, or exactly when it is None."""
+    _current.set((sampling, []) if sampling is not None else None)
+
+def finish_turn() -> List[Approximation]:
+    """End the current turn and return the approximations its queries used."""
+    state = _current.get()
+    _current.set(None)
+    return state[1] if state else []
+
+def maybe_sample(query: str, engine) -> str:
+    """Sample `query` when the current turn asked for approximate answers; see rewrite()."""
+    state = _current.get()
+    if state is None:
+        return query
+    try:
+        query, approximation = rewrite(query, engine.dialect.name, table_rows(engine), state[0])
+    except Exception as e:
+        logger.warning("Could not sample query, answering exactly: %s", e)
+        return query
+    if approximation is not None:
+        approximation.query = query
+        state[1].append(approximation)
+    return query
+
+def withdraw(query: str) -> None:
+    """Forget the approximation of `query`, a sampled query that failed and was replaced."""
+    state = _current.get()
+    if state is not None:
+        state[1][:] = [a for a in state[1] if a.query != query]
@@ -0,0 +1,27 @@
+# utils/backends.py
+import importlib
+
+# Chat backend module per database dialect; both expose the same pipeline
+# functions (generate_sql, execute_sql_with_repair, get_response_with_sql, ...).
+BACKENDS = {"postgresql": "local_chat", "snowflake": "snowflake_chat"}
+
+def load_backend(name: str):
+    return importlib.import_module(BACKENDS[name])
+
+def connect(name: str, uri: str = "", pool_size: int = 5):
+    """
+    Return (backend module, SQLDatabase) for headless callers such as the
+    batch runner and the HTTP service. The engine pool is sized for
+    `pool_size` concurrent workers so they reuse connections instead of
+    queueing for one. An empty `uri` uses the Snowflake secrets for the
+    snowflake backend; "local" uses the embedded database (utils.localdb).
+    """
+    from utils.localdb import resolve_uri
+
+    backend = load_backend(name)
+    if name == "snowflake" and not uri:
+        return backend, backend.init_snowflake_connection()
+    from langchain_community.utilities import SQLDatabase
+    uri = resolve_uri(uri)
+    engine_args = {} if uri.startswith("sqlite") else {"pool_size": pool_size, "max_overflow": pool_size}
+    return backend, SQLDatabase.from_uri(uri, engine_args=engine_args)
@@ -0,0 +1,139 @@
+# utils/cache.py
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+class TTLCache:
+    """
+    A small thread-safe in-process cache with per-entry expiry.
+
+    Concurrent callers asking for the same missing key wait for a single
+    computation instead of all hitting the database. Entries can name the
+    tables they were computed from, so a data change invalidates only them
+    (see utils.freshness).
+
+    Attributes:
+        ttl (float): default lifetime of an entry in seconds.
+        max_entries (int): entries beyond this are dropped oldest first.
+        max_bytes (int): when set, entries are also dropped oldest first once
+            their total `sizeof` exceeds it; a larger value is not cached.
+        sizeof (callable): returns the size in bytes of a value.
+
+    Methods:
+        get: returns a cached value or None.
+        set: stores a value.
+        get_or_compute: returns a cached value, computing and storing it on a miss.
+        invalidate: drops one key, or every key when called without arguments.
+        invalidate_tables: drops every entry that depends on one of the given tables.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 600.0,
+        max_entries: int = 256,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = lambda value: 0,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        # key -> (expires at, value, size, tables it depends on)
+        self._entries: Dict[Hashable, Tuple[float, Any, int, frozenset]] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        # Table dependency -> keys of the entries computed from it.
+        self._dependents: Dict[Hashable, Set[Hashable]] = {}
+
+    def _remove(self, key: Hashable) -> bool:
+        """Drop `key` and its dependency links; the caller holds the lock."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self.bytes -= entry[2]
+        for table in entry[3]:
+            keys = self._dependents.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[table]
+        return True
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, tables: Iterable[Hashable] = ()) -> None:
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        tables = frozenset(tables)
+        with self._lock:
+            now = time.monotonic()
+            # Expired entries nobody asked for again would otherwise stay until evicted.
+            for stale in [k for k, entry in self._entries.items() if entry[0] < now or k == key]:
+                self._remove(stale)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (now + (self.ttl if ttl is None else ttl), value, size, tables)
+            self.bytes += size
+            for table in tables:
+                self._dependents.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def get_or_compute(
+        self, key: Hashable, compute: Callable[[], Any], ttl: Optional[float] = None, tables: Iterable[Hashable] = ()
+    ) -> Any:
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            value = self.get(key)
+            if value is None:
+                value = compute()
+                self.set(key, value, ttl, tables)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._dependents.clear()
+                self.bytes = 0
+            else:
+                self._remove(key)
+
+    def invalidate_tables(self, tables: Iterable[Hashable]) -> int:
+        """Drop the entries computed from any of `tables`; returns how many were cached."""
+        with self._lock:
+            keys = set()
+            for table in tables:
+                keys |= self._dependents.get(table, set())
+            return sum(self._remove(key) for key in keys)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+# Schema text returned by get_database_info, keyed by (dialect, engine URL, sample_limit).
+schema_cache = TTLCache(ttl=600.0)
+def frame_bytes(value: Any) -> int:
+    """Memory held by a DataFrame, including the strings of object columns."""
+    return int(value.memory_usage(deep=True).sum()) if hasattr(value, "memory_usage") else 0
+
+# Query results keyed by (engine URL, query); only used while utils.freshness
+# watches the database, which is what makes the long TTL safe. Results are
+# also capped at SQLCHAT_RESULT_CACHE_MB megabytes in total.
+result_cache = TTLCache(
+    ttl=3600.0, max_entries=64, max_bytes=int(os.getenv("SQLCHAT_RESULT_CACHE_MB", "256")) * 2**20, sizeof=frame_bytes
+)
@@ -0,0 +1,152 @@
+# utils/charts.py
+import io
+import json
+
+# Checked in this order against the question, so "bubble" wins over "bar" etc.
+CHART_TYPES = ["pie", "histogram", "scatter", "area", "bubble", "line", "bar"]
+
+def detect_chart_type(text: str):
+    """Return the first chart type named in `text`, or None for a text answer."""
+    lowered = text.lower()
+    return next((chart_type for chart_type in CHART_TYPES if chart_type in lowered), None)
+
+# Same palette as the matplotlib charts, so both renderings look alike.
+BACKGROUND = "#101414"
+MARK_COLOR = "skyblue"
+TITLES = {
+    "pie": "Pie Chart", "histogram": "Histogram", "scatter": "Scatter Plot", "area": "Area Chart",
+    "bubble": "Bubble Chart", "line": "Line Chart", "bar": "Bar Chart",
+}
+
+def _field_type(series) -> str:
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "temporal"
+    if pd.api.types.is_numeric_dtype(series):
+        return "quantitative"
+    return "nominal"
+
+def chart_spec(df, chart_type):
+    """
+    Return a Vega-Lite spec drawing `df` (first column as labels/x, second as
+    values) as `chart_type`, or None when `df` lacks the columns it needs.
+
+    Only the plotted columns are inlined, without empty rows, so the payload
+    grows with the number of points rather than the image size, and the
+    browser does the drawing.
+    """
+    if df.shape[1] == 0 or (chart_type != "histogram" and df.shape[1] < 2):
+        return None
+    value = df.columns[1] if df.shape[1] >= 2 else df.columns[0]
+    columns = [value] if chart_type == "histogram" else [df.columns[0], value]
+    data = df[columns].dropna()
+    # Column names may contain dots or brackets, which Vega-Lite reads as nested fields.
+    names = {column: f"c{i}" for i, column in enumerate(columns)}
+    values = json.loads(data.rename(columns=names).to_json(orient="records", date_format="iso"))
+    label = {"field": names[columns[0]], "type": _field_type(data[columns[0]]), "title": str(columns[0])}
+    if label["type"] == "nominal":
+        # Keep the query's ORDER BY instead of sorting labels alphabetically.
+        label["sort"] = None
+    amount = {"field": names[value], "type": "quantitative", "title": str(value)}
+
+    if chart_type == "pie":
+        mark = {"type": "arc", "tooltip": True}
+        encoding = {"theta": amount, "color": {**label, "type": "nominal", "sort": None}}
+    elif chart_type == "histogram":
+        mark = {"type": "bar", "color": MARK_COLOR, "tooltip": True}
+        encoding = {"x": {**amount, "bin": {"maxbins": 10}}, "y": {"aggregate": "count", "title": "count"}}
+    elif chart_type == "bubble":
+        mark = {"type": "circle", "color": "white", "opacity": 0.5, "tooltip": True}
+        encoding = {"x": label, "y": amount, "size": {**amount, "legend": None}}
+    elif chart_type == "scatter":
+        mark = {"type": "point", "filled": True, "color": "white", "tooltip": True}
+        encoding = {"x": label, "y": amount}
+    elif chart_type == "area":
+        mark = {"type": "area", "color": "white", "opacity": 0.5, "tooltip": True}
+        encoding = {"x": label, "y": amount}
+    elif chart_type == "line":
+        mark = {"type": "line", "point": True, "color": MARK_COLOR, "tooltip": True}
+        encoding = {"x": label, "y": amount}
+    else:
+        mark = {"type": "bar", "color": MARK_COLOR, "tooltip": True}
+        encoding = {"x": label, "y": amount}
+
+    return {
+        "$schema": "https://vega.github.io/schema/vega-lite/v5.json",
+        "title": TITLES.get(chart_type, ""),
+        "data": {"values": values},
+        "mark": mark,
+        "encoding": encoding,
+        "background": BACKGROUND,
+        "config": {
+            "view": {"stroke": None},
+            "title": {"color": "white"},
+            "axis": {"labelColor": "white", "titleColor": "white", "labelLimit": 120},
+            "legend": {"labelColor": "white", "titleColor": "white"},
+        },
+    }
+
+def build_figure(df, chart_type, adjust_fn=None):
+    """
+    Draw `df` (first column as labels/x, second as values) as `chart_type`.
+
+    Uses matplotlib's object API rather than pyplot, so figures are not kept
+    in pyplot's global registry and concurrent sessions do not share state.
+    """
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(5, 5), dpi=100)
+    ax = fig.subplots()
+    # Set background color for figure and axes
+    fig.patch.set_facecolor("#101414")
+    ax.set_facecolor("#101414")
+    # Set tick label colors to white
+    ax.tick_params(axis="x", colors="white")
+    ax.tick_params(axis="y", colors="white")
+    if chart_type == "line" and df.shape[1] >= 2:
+        ax.plot(df.iloc[:,0], df.iloc[:,1], marker='o', color="skyblue")  # skyblue line
+        ax.set_xlabel(df.columns[0], color="white")
+        ax.set_ylabel(df.columns[1], color="white")
+        ax.set_title("Line Chart", color="white")
+    elif chart_type == "bar" and df.shape[1] >= 2:
+        ax.bar(df.iloc[:,0], df.iloc[:,1], color="skyblue")  # skyblue bars
+        ax.set_xlabel(df.columns[0], color="white")
+        ax.set_ylabel(df.columns[1], color="white")
+        ax.set_title("Bar Chart", color="white")
+    elif chart_type == "pie" and df.shape[1] >= 2:
+        wedges, texts, autotexts = ax.pie(df.iloc[:,1], labels=df.iloc[:,0], autopct='%1.1f%%', textprops=dict(color="white"))
+        ax.set_title("Pie Chart", color="white")
+    elif chart_type == "histogram":
+        ax.hist(df.iloc[:,1], bins=10, color="skyblue", edgecolor="black")  # skyblue histogram bars
+        ax.set_title("Histogram", color="white")
+    elif chart_type == "scatter" and df.shape[1] >= 2:
+        ax.scatter(df.iloc[:,0], df.iloc[:,1], color="white")
+        ax.set_xlabel(df.columns[0], color="white")
+        ax.set_ylabel(df.columns[1], color="white")
+        ax.set_title("Scatter Plot", color="white")
+    elif chart_type == "area" and df.shape[1] >= 2:
+        ax.fill_between(range(len(df.iloc[:,1])), df.iloc[:,1], color="white", alpha=0.5)
+        ax.set_title("Area Chart", color="white")
+    elif chart_type == "bubble" and df.shape[1] >= 2:
+        sizes = (df.iloc[:,1] - df.iloc[:,1].min() + 10) * 10
+        ax.scatter(df.iloc[:,0], df.iloc[:,1], s=sizes, alpha=0.5, color="white")
+        ax.set_xlabel(df.columns[0], color="white")
+        ax.set_ylabel(df.columns[1], color="white")
+        ax.set_title("Bubble Chart", color="white")
+    if adjust_fn is not None:
+        adjust_fn(ax)
+    return fig
+
+def figure_png(fig) -> bytes:
+    """Rasterize `fig` to PNG, as st.pyplot does before sending it to the browser."""
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", facecolor=fig.get_facecolor())
+    return buffer.getvalue()
+
+def render_chart(df, chart_type, adjust_fn):
+    """Show a chart drawn by the browser from its spec, or as a server-rendered PNG when no spec fits."""
+    import streamlit as st
+    spec = chart_spec(df, chart_type)
+    if spec is not None:
+        st.vega_lite_chart(spec, use_container_width=True)
+    else:
+        st.image(figure_png(build_figure(df, chart_type, adjust_fn)))
@@ -0,0 +1,81 @@
+# utils/fake_llm.py
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+# Returned for SQL-generation prompts; valid against the sales schema in sql/ddl_*.sql.
+DEFAULT_SQL = "SELECT CATEGORY, COUNT(*) AS PRODUCT_COUNT FROM PRODUCTS GROUP BY CATEGORY ORDER BY PRODUCT_COUNT DESC;"
+
+def default_response(prompt: str) -> str:
+    if "Write only the SQL query" in prompt:
+        return DEFAULT_SQL
+    return "Here is the summary of the query result."
+
+class FakeChatModel:
+    """
+    Local stand-in for the Gemini chat model, used by tests, the batch runner,
+    the HTTP service and load tests when SQLCHAT_FAKE_LLM is set.
+
+    Latency is drawn from a log-normal distribution around `latency_median`
+    with an optional slow tail, and a fraction of calls raise `fault` to
+    exercise retries and the circuit breaker. Instances are callables, so
+    they compose with prompts like a real model (`prompt | model | parser`).
+
+    Attributes:
+        latency_median (float): median response time in seconds.
+        latency_sigma (float): spread of the log-normal latency.
+        tail_rate (float): probability of a slow response.
+        tail_latency (float): extra seconds added to slow responses.
+        fault_rate (float): probability of raising `fault`.
+        respond (callable): maps the prompt text to the response text.
+    """
+
+    def __init__(
+        self,
+        latency_median: float = 0.0,
+        latency_sigma: float = 0.5,
+        tail_rate: float = 0.0,
+        tail_latency: float = 5.0,
+        fault_rate: float = 0.0,
+        fault: Callable[[str], Exception] = ConnectionError,
+        respond: Callable[[str], str] = default_response,
+        seed: Optional[int] = None,
+    ):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.fault_rate = fault_rate
+        self.fault = fault
+        self.respond = respond
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_latency(self) -> tuple:
+        with self._lock:
+            if self.latency_median <= 0:
+                latency = 0.0
+            else:
+                latency = self._random.lognormvariate(0, self.latency_sigma) * self.latency_median
+            if self._random.random() < self.tail_rate:
+                latency += self.tail_latency
+            failed = self._random.random() < self.fault_rate
+            self.calls += 1
+        return latency, failed
+
+    def __call__(self, prompt, timeout: Optional[float] = None) -> str:
+        text = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+        latency, failed = self.sample_latency()
+        if timeout is not None and latency > timeout:
+            # Like a client timeout: give up after `timeout` seconds.
+            time.sleep(timeout)
+            raise TimeoutError(f"FakeChatModel did not answer within {timeout:.1f}s")
+        time.sleep(latency)
+        if failed:
+            raise self.fault("injected fault from FakeChatModel")
+        return self.respond(text)
+
+    def invoke(self, prompt, config=None, timeout: Optional[float] = None) -> str:
+        return self(prompt, timeout)
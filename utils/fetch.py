@@ -0,0 +1,246 @@
+# utils/fetch.py
+import io
+import logging
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL type OIDs that COPY ... CSV renders as text, grouped by how the
+# CSV text must be decoded to match what read_sql (psycopg2) returns: dates
+# and times as Python objects, json as parsed values, timestamps as datetime64
+# (UTC for timestamptz) and NUMERIC as float64, since read_sql's coerce_float
+# turns psycopg2's Decimals into floats. Other types (intervals, arrays,
+# ranges, ...) come back as their text form.
+PG_DATE_OIDS = {1082}
+PG_TIME_OIDS = {1083}
+PG_TIMESTAMP_OIDS = {1114}
+PG_TIMESTAMPTZ_OIDS = {1184}
+PG_BOOL_OIDS = {16}
+PG_INT_OIDS = {20, 21, 23}
+PG_FLOAT_OIDS = {700, 701, 1700}
+PG_JSON_OIDS = {114, 3802}
+PG_TEXT_OIDS = {18, 19, 25, 1042, 1043, 1266, 2950}
+# Written by COPY for NULL, so empty strings are not read back as NULL.
+_COPY_NULL = r"\N"
+# DB-API errors meaning "this driver or server cannot do the native fetch", as
+# opposed to errors in the query itself. SQLSTATE 42501 (insufficient
+# privilege) and 0A000 (feature not supported) are only treated so for COPY.
+_UNSUPPORTED_ERRORS = {"MissingDependencyError", "NotSupportedError"}
+_COPY_UNAVAILABLE_SQLSTATES = {"42501", "0A000"}
+
+class NativeFetchUnavailable(Exception):
+    """The dialect's bulk fetch path cannot be used here; read_sql should be used instead."""
+
+def _strip_statement(query: str) -> str:
+    return query.strip().rstrip(";").strip()
+
+def _is_select(query: str) -> bool:
+    head = _strip_statement(query).split(None, 1)
+    return bool(head) and head[0].upper() in ("SELECT", "WITH", "VALUES", "TABLE")
+
+def _database_error(query: str, engine, error: Exception) -> Exception:
+    """
+    Wrap a DB-API error raised by a native fetch path (psycopg2, the Snowflake
+    connector) in the SQLAlchemy exception read_sql would have raised, so
+    callers handle one family of errors whichever path ran the query.
+    """
+    from sqlalchemy.exc import DBAPIError
+    dbapi = getattr(engine.dialect, "dbapi", None)
+    if dbapi is None or not isinstance(error, dbapi.Error):
+        return error
+    return DBAPIError.instance(query, None, error, dbapi.Error, dialect=engine.dialect)
+
+def fetch_generic(query: str, engine) -> pd.DataFrame:
+    """Row-by-row fallback through SQLAlchemy, used for dialects without a native path."""
+    return pd.read_sql(query, engine)
+
+def fetch_snowflake(query: str, engine, arrow: bool = False):
+    """
+    Fetch through the Snowflake connector's Arrow result batches.
+    Requires snowflake-connector-python[pandas] (pyarrow) to be installed.
+    """
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        try:
+            cursor.execute(query)
+            if not hasattr(cursor, "fetch_arrow_all"):
+                raise NativeFetchUnavailable("the Snowflake connector has no Arrow fetch")
+            if arrow:
+                table = cursor.fetch_arrow_all()
+                if table is None:
+                    import pyarrow as pa
+                    table = pa.table({d[0]: [] for d in cursor.description})
+                return table
+            return cursor.fetch_pandas_all()
+        except ImportError as e:
+            raise NativeFetchUnavailable(str(e)) from e
+        except Exception as e:
+            if type(e).__name__ in _UNSUPPORTED_ERRORS:
+                raise NativeFetchUnavailable(str(e)) from e
+            raise
+        finally:
+            cursor.close()
+    finally:
+        raw.close()
+
+def fetch_postgresql(query: str, engine, arrow: bool = False):
+    """
+    Stream the result with COPY (query) TO STDOUT as CSV and decode it in one
+    pass with a columnar CSV reader. Column types are taken from a LIMIT 0
+    probe, so values come back as they would from read_sql (see the PG_*_OIDS
+    groups) rather than as whatever the CSV text looks like. The Arrow result
+    keeps json and time of day as text.
+    """
+    statement = _strip_statement(query)
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        try:
+            if not hasattr(cursor, "copy_expert"):
+                raise NativeFetchUnavailable("the PostgreSQL driver has no copy_expert (psycopg2 is required)")
+            cursor.execute(f"SELECT * FROM ({statement}) AS _q LIMIT 0")
+            # (name, type OID) in result order; names may repeat.
+            columns = [(d[0], d[1]) for d in cursor.description]
+            buffer = io.BytesIO()
+            try:
+                cursor.copy_expert(
+                    f"COPY ({statement}) TO STDOUT WITH (FORMAT csv, HEADER true, NULL '{_COPY_NULL}')", buffer
+                )
+            except Exception as e:
+                # The probe ran the same query, so a failure here is about COPY itself.
+                if getattr(e, "pgcode", None) in _COPY_UNAVAILABLE_SQLSTATES:
+                    raise NativeFetchUnavailable(str(e)) from e
+                raise
+        finally:
+            cursor.close()
+        raw.rollback()
+    finally:
+        raw.close()
+    buffer.seek(0)
+    if arrow:
+        return _read_csv_arrow(buffer, columns)
+    return _read_csv_pandas(buffer, columns)
+
+def _read_csv_pandas(buffer, columns: list) -> pd.DataFrame:
+    import datetime
+    import json
+
+    # Columns are addressed by position, since a result may repeat a name.
+    dtypes = {}
+    for i, (_, oid) in enumerate(columns):
+        if oid in PG_INT_OIDS:
+            dtypes[i] = "Int64"
+        elif oid in PG_FLOAT_OIDS:
+            dtypes[i] = "float64"
+        elif oid not in PG_TIMESTAMP_OIDS | PG_TIMESTAMPTZ_OIDS:
+            dtypes[i] = object
+    df = pd.read_csv(
+        buffer, header=0, names=list(range(len(columns))), dtype=dtypes,
+        keep_default_na=False, na_values=[_COPY_NULL],
+    )
+    decoders = [
+        (PG_BOOL_OIDS, {"t": True, "f": False}.get),
+        (PG_DATE_OIDS, datetime.date.fromisoformat),
+        (PG_TIME_OIDS, datetime.time.fromisoformat),
+        (PG_JSON_OIDS, json.loads),
+    ]
+    for i, (_, oid) in enumerate(columns):
+        column = df[i]
+        if oid in PG_INT_OIDS:
+            # read_sql gives int64, or float64 once a NULL is present.
+            df[i] = column.astype("float64") if column.isna().any() else column.astype("int64")
+        elif oid in PG_TIMESTAMP_OIDS:
+            df[i] = pd.to_datetime(column)
+        elif oid in PG_TIMESTAMPTZ_OIDS:
+            df[i] = pd.to_datetime(column, utc=True)
+        elif oid not in PG_FLOAT_OIDS:
+            decode = next((decode for oids, decode in decoders if oid in oids), str)
+            # Inferred from the decoded values, as read_sql infers from the driver's.
+            df[i] = pd.Series([None if pd.isna(value) else decode(value) for value in column], index=df.index)
+    df.columns = [name for name, _ in columns]
+    return df
+
+def _read_csv_arrow(buffer, columns: list):
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    # Unique placeholder names while reading; the real, possibly repeated,
+    # names are put back afterwards.
+    names = [f"_{i}" for i in range(len(columns))]
+    column_types = {}
+    for placeholder, (_, oid) in zip(names, columns):
+        if oid in PG_BOOL_OIDS:
+            column_types[placeholder] = pa.bool_()
+        elif oid in PG_INT_OIDS:
+            column_types[placeholder] = pa.int64()
+        elif oid in PG_FLOAT_OIDS:
+            column_types[placeholder] = pa.float64()
+        elif oid in PG_DATE_OIDS:
+            column_types[placeholder] = pa.date32()
+        elif oid in PG_TIMESTAMP_OIDS:
+            column_types[placeholder] = pa.timestamp("us")
+        elif oid in PG_TIMESTAMPTZ_OIDS:
+            column_types[placeholder] = pa.timestamp("us", tz="UTC")
+        else:
+            column_types[placeholder] = pa.string()
+    table = pa_csv.read_csv(
+        buffer,
+        read_options=pa_csv.ReadOptions(column_names=names, skip_rows=1),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types, true_values=["t"], false_values=["f"],
+            null_values=[_COPY_NULL], strings_can_be_null=True,
+        ),
+    )
+    return table.rename_columns([name for name, _ in columns])
+
+NATIVE_FETCHERS = {
+    "snowflake": fetch_snowflake,
+    "postgresql": fetch_postgresql,
+}
+
+def native_fetcher(engine):
+    """Return the native fetch function for the engine's dialect, or None."""
+    return NATIVE_FETCHERS.get(engine.dialect.name)
+
+def fetch_dataframe(query: str, engine) -> pd.DataFrame:
+    """
+    Execute `query` and return a DataFrame, using the dialect's bulk path when
+    one exists and falling back to pd.read_sql when it is unavailable
+    (missing driver extras, non-SELECT statements, COPY not permitted, ...).
+    """
+    fetcher = native_fetcher(engine)
+    if fetcher is not None and _is_select(query):
+        # Only capability problems fall back; errors in the query itself are
+        # raised, so a failing query is not sent to the database twice.
+        try:
+            return fetcher(query, engine)
+        except NativeFetchUnavailable as e:
+            logger.info("Native fetch unavailable for %s, using read_sql: %s", engine.dialect.name, e)
+        except Exception as e:
+            error = _database_error(query, engine, e)
+            if error is e:
+                raise
+            raise error from e
+    return fetch_generic(query, engine)
+
+def fetch_arrow(query: str, engine):
+    """Execute `query` and return a pyarrow Table."""
+    import pyarrow as pa
+    fetcher = native_fetcher(engine)
+    if fetcher is not None and _is_select(query):
+        try:
+            return fetcher(query, engine, arrow=True)
+        except NativeFetchUnavailable as e:
+            logger.info("Native fetch unavailable for %s, using read_sql: %s", engine.dialect.name, e)
+        except Exception as e:
+            error = _database_error(query, engine, e)
+            if error is e:
+                raise
+            raise error from e
+    return pa.Table.from_pandas(fetch_generic(query, engine), preserve_index=False)
+
+def format_result(df: pd.DataFrame) -> str:
+    """Render a result compactly (CSV with header) for inclusion in an LLM prompt."""
+    return df.to_csv(index=False)
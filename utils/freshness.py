@@ -0,0 +1,163 @@
+# utils/freshness.py
+import logging
+import re
+import threading
+from typing import Callable, Dict, Hashable, Iterable, Optional, Set
+
+from utils.cache import result_cache, schema_cache
+from utils.sql_utils import referenced_tables
+
+logger = logging.getLogger(__name__)
+
+# Dependency meaning "every table": schema text describes the whole database.
+ANY_TABLE = "*"
+_READ_ONLY = re.compile(r"^\s*(SELECT|WITH)\b", re.I)
+
+# Per-table change markers. Both are metadata reads: SHOW TABLES runs in
+# Snowflake's cloud services layer without resuming the warehouse, and
+# pg_stat_user_tables is an in-memory statistics view.
+MARKER_QUERIES = {
+    "snowflake": "SHOW TABLES",
+    # TRUNCATE leaves the tuple counters alone but gives the table a new relfilenode.
+    "postgresql": (
+        "SELECT s.relname, s.n_tup_ins, s.n_tup_upd, s.n_tup_del, c.relfilenode "
+        "FROM pg_stat_user_tables s JOIN pg_class c ON c.oid = s.relid "
+        "WHERE s.schemaname = current_schema()"
+    ),
+}
+
+def read_markers(engine) -> Dict[str, tuple]:
+    """
+    Return {TABLE: marker} for the tables of `engine`'s current schema; a
+    marker changes whenever the table's data does. Snowflake markers are
+    (rows, bytes) from SHOW TABLES, PostgreSQL markers the insert, update and
+    delete counters and the relfilenode.
+    """
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        rows = conn.execute(text(MARKER_QUERIES[engine.dialect.name])).fetchall()
+    if engine.dialect.name == "snowflake":
+        return {row._mapping["name"].upper(): (row._mapping["rows"], row._mapping["bytes"]) for row in rows}
+    return {row[0].upper(): tuple(row[1:]) for row in rows}
+
+def dependencies(engine, tables: Iterable[str]) -> Set[tuple]:
+    """Cache dependencies of an entry computed from `tables` of `engine`."""
+    url = str(engine.url)
+    return {(url, table.upper()) for table in tables}
+
+class FreshnessWatcher:
+    """
+    Polls the change markers of one database in a background thread and, for
+    every table whose marker moved, invalidates the cache entries computed
+    from it and runs the callbacks registered for it.
+
+    Attributes:
+        engine: SQLAlchemy engine of the watched database.
+        interval (float): seconds between polls.
+
+    Methods:
+        start / stop: control the polling thread.
+        poll: reads the markers once and returns the changed tables.
+    """
+
+    def __init__(self, engine, interval: float = 30.0):
+        self.engine = engine
+        self.interval = interval
+        self.markers: Optional[Dict[str, tuple]] = None
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "FreshnessWatcher":
+        self.poll()
+        self._thread = threading.Thread(target=self._run, name=f"freshness {self.engine.url.host}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning("Freshness poll failed for %s: %s", self.engine.url.host, e)
+
+    def poll(self) -> Set[str]:
+        markers = read_markers(self.engine)
+        previous, self.markers = self.markers, markers
+        if previous is None:
+            return set()
+        changed = {table for table in markers.keys() | previous.keys() if markers.get(table) != previous.get(table)}
+        if changed:
+            tables_changed(self.engine, changed)
+        return changed
+
+_watchers: Dict[str, FreshnessWatcher] = {}
+_callbacks: Dict[str, Dict[Hashable, Callable[[], None]]] = {}
+_lock = threading.Lock()
+
+def watch(engine, interval: float = 30.0) -> Optional[FreshnessWatcher]:
+    """
+    Start (once per database) watching `engine` for data changes. Returns None
+    for dialects without change markers, whose caches keep relying on TTLs.
+    """
+    if engine.dialect.name not in MARKER_QUERIES:
+        return None
+    url = str(engine.url)
+    with _lock:
+        if url in _watchers:
+            return _watchers[url]
+    # The first poll records the baseline markers before any result is cached.
+    watcher = FreshnessWatcher(engine, interval).start()
+    with _lock:
+        current = _watchers.setdefault(url, watcher)
+    if current is not watcher:
+        watcher.stop()
+    return current
+
+def is_watched(engine) -> bool:
+    with _lock:
+        return str(engine.url) in _watchers
+
+def on_change(tables: Iterable[str], key: Hashable, callback: Callable[[], None]) -> None:
+    """
+    Run `callback` once, the next time any of `tables` changes in any watched
+    database. Registering the same `key` again replaces its callback. Used for
+    caches outside this process, such as the Cloudflare KV query cache.
+    """
+    with _lock:
+        for table in tables:
+            _callbacks.setdefault(table.upper(), {})[key] = callback
+
+def tables_changed(engine, tables: Iterable[str]) -> None:
+    """Invalidate everything computed from `tables` of `engine`."""
+    tables = {table.upper() for table in tables}
+    deps = dependencies(engine, tables) | dependencies(engine, [ANY_TABLE])
+    dropped = result_cache.invalidate_tables(deps) + schema_cache.invalidate_tables(deps)
+    with _lock:
+        callbacks: Dict[Hashable, Callable[[], None]] = {}
+        for table in tables:
+            callbacks.update(_callbacks.pop(table, {}))
+    for callback in callbacks.values():
+        try:
+            callback()
+        except Exception as e:
+            logger.warning("Cache invalidation callback failed: %s", e)
+    logger.info("Data changed in %s: dropped %d cached entries, ran %d callbacks", ", ".join(sorted(tables)), dropped, len(callbacks))
+
+def cached_query(engine, query: str, compute: Callable[[], object]):
+    """
+    Return the result of `query` from the result cache, running `compute` on a
+    miss. Only read-only queries are cached, only while the database is
+    watched, and each result is dropped as soon as a table it reads changes.
+    """
+    tables = referenced_tables(query) if _READ_ONLY.match(query) else set()
+    if not tables or not is_watched(engine):
+        return compute()
+    # The exact text: collapsing whitespace would also merge 'a  b' and 'a b' literals.
+    key = (str(engine.url), query.strip())
+    return result_cache.get_or_compute(key, compute, tables=dependencies(engine, tables))
@@ -0,0 +1,85 @@
+# utils/llm_registry.py
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Process-wide caches shared by every Streamlit session and rerun. Entries are
+# built once per model configuration and reused, so a turn no longer pays for
+# new HTTP clients or re-parsed prompt templates before the first token.
+_lock = threading.RLock()
+_clients: Dict[Tuple, Any] = {}
+_prompts: Dict[str, Any] = {}
+_runnables: Dict[Tuple, Any] = {}
+
+def model_key(config: Dict[str, Any]) -> Tuple:
+    """Return a hashable key for a model configuration dict."""
+    return tuple(sorted(config.items()))
+
+def _get_or_build(cache: Dict, key: Hashable, build: Callable[[], Any]) -> Any:
+    value = cache.get(key)
+    if value is None:
+        with _lock:
+            value = cache.get(key)
+            if value is None:
+                value = build()
+                cache[key] = value
+    return value
+
+FAKE_MODEL = "fake"
+
+def fake_model_config() -> Optional[Dict[str, Any]]:
+    """
+    Model configuration for utils.fake_llm.FakeChatModel when SQLCHAT_FAKE_LLM
+    is set, else None. SQLCHAT_FAKE_LLM_LATENCY (median seconds),
+    SQLCHAT_FAKE_LLM_TAIL_RATE, SQLCHAT_FAKE_LLM_TAIL_LATENCY (seconds) and
+    SQLCHAT_FAKE_LLM_FAULT_RATE tune the fake.
+    """
+    if not os.getenv("SQLCHAT_FAKE_LLM"):
+        return None
+    return {
+        "model": FAKE_MODEL,
+        "latency_median": float(os.getenv("SQLCHAT_FAKE_LLM_LATENCY", "0")),
+        "tail_rate": float(os.getenv("SQLCHAT_FAKE_LLM_TAIL_RATE", "0")),
+        "tail_latency": float(os.getenv("SQLCHAT_FAKE_LLM_TAIL_LATENCY", "5")),
+        "fault_rate": float(os.getenv("SQLCHAT_FAKE_LLM_FAULT_RATE", "0")),
+    }
+
+def get_llm(config: Dict[str, Any]):
+    """
+    Return the shared chat model client for `config`.
+
+    `config` holds the keyword arguments for ChatGoogleGenerativeAI, e.g.
+    {"model": "models/gemini-2.0-flash", "google_api_key": ..., "temperature": 0},
+    or {"model": "fake", ...} with FakeChatModel arguments.
+    """
+    def build():
+        if config.get("model") == FAKE_MODEL:
+            from utils.fake_llm import FakeChatModel
+            return FakeChatModel(**{k: v for k, v in config.items() if k != "model"})
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(**config)
+    return _get_or_build(_clients, model_key(config), build)
+
+def get_prompt(template: str):
+    """Return the parsed ChatPromptTemplate for `template`."""
+    def build():
+        from langchain_core.prompts import ChatPromptTemplate
+        return ChatPromptTemplate.from_template(template)
+    return _get_or_build(_prompts, template, build)
+
+def get_runnable(name: str, config: Dict[str, Any], build: Callable[[Any], Any]):
+    """
+    Return the composed runnable registered under `name` for `config`.
+
+    `build` receives the shared LLM client for `config` and must return a
+    runnable that takes all per-call state (such as the database) from its
+    input, so the same instance can serve every session.
+    """
+    return _get_or_build(_runnables, (name,) + model_key(config), lambda: build(get_llm(config)))
+
+def clear():
+    """Drop every cached client, prompt and runnable."""
+    with _lock:
+        _clients.clear()
+        _prompts.clear()
+        _runnables.clear()
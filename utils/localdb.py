@@ -0,0 +1,45 @@
+# utils/localdb.py
+import glob
+import os
+import tempfile
+import threading
+
+# Pass this instead of a SQLAlchemy URI to use the embedded database.
+LOCAL_URI = "local"
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+_lock = threading.Lock()
+
+def create_local_database(path: str = None, data_dir: str = DATA_DIR) -> str:
+    """
+    Build an SQLite file with one table per CSV in `data_dir` (customer_details,
+    order_details, payments, products, transactions) and return its URI.
+
+    The embedded database lets the batch runner, the HTTP service and load
+    tests run end to end without PostgreSQL or Snowflake. The file is built
+    once and reused while its CSVs are unchanged.
+    """
+    import pandas as pd
+    from sqlalchemy import create_engine
+
+    path = path or os.path.join(tempfile.gettempdir(), "sqlchat_local.db")
+    csv_files = sorted(glob.glob(os.path.join(data_dir, "*.csv")))
+    with _lock:
+        newest_csv = max((os.path.getmtime(f) for f in csv_files), default=0)
+        if not os.path.exists(path) or os.path.getmtime(path) < newest_csv:
+            tmp_path = path + ".tmp"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            engine = create_engine(f"sqlite:///{tmp_path}")
+            with engine.begin() as conn:
+                for csv_file in csv_files:
+                    table = os.path.splitext(os.path.basename(csv_file))[0]
+                    pd.read_csv(csv_file).to_sql(table, conn, index=False)
+            engine.dispose()
+            os.replace(tmp_path, path)
+    return f"sqlite:///{path}"
+
+def resolve_uri(uri: str) -> str:
+    """Return `uri`, building the embedded database when it is LOCAL_URI."""
+    return create_local_database() if uri == LOCAL_URI else uri
@@ -0,0 +1,281 @@
+# utils/metering.py
+import contextvars
+import datetime
+import logging
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from utils.resilience import LLMUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Token budgets, 0 disables a limit. Alerts are raised at ALERT_RATIO of a budget.
+TURN_BUDGET_ENV = "LLM_TOKEN_BUDGET_TURN"
+SESSION_BUDGET_ENV = "LLM_TOKEN_BUDGET_SESSION"
+DAY_BUDGET_ENV = "LLM_TOKEN_BUDGET_DAY"
+ALERT_RATIO = 0.8
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+class BudgetExceeded(LLMUnavailable):
+    """A token budget would be exceeded by the next prompt; the call is not made."""
+
+    @property
+    def user_message(self) -> str:
+        return f"This question was not sent to the AI model because the {self}. Ask an administrator to raise the limit."
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate token count of `text`: tiktoken's cl100k_base when installed,
+    else one token per four characters. Gemini tokenizes differently, so the
+    numbers are for comparing prompt sections and turns, not for billing.
+    """
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def today() -> str:
+    return datetime.date.today().isoformat()
+
+def budgets() -> Dict[str, int]:
+    return {
+        "turn": int(os.getenv(TURN_BUDGET_ENV, "0")),
+        "session": int(os.getenv(SESSION_BUDGET_ENV, "0")),
+        "day": int(os.getenv(DAY_BUDGET_ENV, "0")),
+    }
+
+class Usage:
+    """Token and byte counters for one stage, turn, session or day."""
+
+    FIELDS = ("calls", "prompt_tokens", "completion_tokens", "prompt_bytes", "completion_bytes")
+
+    def __init__(self):
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+        # Prompt tokens per template section (db_info, chat_history, response, template, ...).
+        self.sections: Dict[str, int] = {}
+
+    @property
+    def total_tokens(self) -> int:
+        return self.counts["prompt_tokens"] + self.counts["completion_tokens"]
+
+    def add(self, other: "Usage") -> None:
+        for field in self.FIELDS:
+            self.counts[field] += other.counts[field]
+        for name, tokens in other.sections.items():
+            self.sections[name] = self.sections.get(name, 0) + tokens
+
+    def to_dict(self) -> dict:
+        return {**self.counts, "total_tokens": self.total_tokens, "sections": dict(self.sections)}
+
+class Turn:
+    """Usage of one chat turn, broken down by pipeline stage."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.day = today()
+        self.stages: Dict[str, Usage] = {}
+        self.alerts: List[str] = []
+        self._lock = threading.Lock()
+
+    def total(self) -> Usage:
+        with self._lock:
+            usage = Usage()
+            for stage in self.stages.values():
+                usage.add(stage)
+            return usage
+
+    def _stage(self, stage: str) -> Usage:
+        return self.stages.setdefault(stage, Usage())
+
+class Meter:
+    """
+    Process-wide aggregation of finished turns per session, per day and per
+    stage, kept for the last `max_sessions` sessions and `max_days` days.
+    """
+
+    def __init__(self, max_sessions: int = 1000, max_days: int = 31):
+        self.max_sessions = max_sessions
+        self.max_days = max_days
+        self.sessions: "OrderedDict[str, Usage]" = OrderedDict()
+        self.days: "OrderedDict[str, Usage]" = OrderedDict()
+        self.stages: Dict[str, Usage] = {}
+        self.last_turns: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def session_total(self, session_id: str) -> int:
+        with self._lock:
+            usage = self.sessions.get(session_id)
+            return usage.total_tokens if usage else 0
+
+    def day_total(self, day: str) -> int:
+        with self._lock:
+            usage = self.days.get(day)
+            return usage.total_tokens if usage else 0
+
+    def add_turn(self, turn: Turn) -> None:
+        with self._lock:
+            for key, table, limit in ((turn.session_id, self.sessions, self.max_sessions), (turn.day, self.days, self.max_days)):
+                table.setdefault(key, Usage()).add(turn.total())
+                table.move_to_end(key)
+                while len(table) > limit:
+                    table.popitem(last=False)
+            for name, usage in turn.stages.items():
+                self.stages.setdefault(name, Usage()).add(usage)
+            self.last_turns[turn.session_id] = turn_summary(turn)
+
+    def export(self) -> dict:
+        """All aggregates as plain dicts, for the sidebar download and the service /metrics endpoint."""
+        with self._lock:
+            return {
+                "budgets": budgets(),
+                "days": {day: usage.to_dict() for day, usage in self.days.items()},
+                "stages": {stage: usage.to_dict() for stage, usage in self.stages.items()},
+                "sessions": {sid: usage.to_dict() for sid, usage in self.sessions.items()},
+            }
+
+meter = Meter()
+_current_turn: contextvars.ContextVar[Optional[Turn]] = contextvars.ContextVar("metering_turn", default=None)
+
+def start_turn(session_id: str) -> Turn:
+    """
+    Start metering a chat turn in the current context. LLM calls made from
+    this context, including those the resilience executor runs on its
+    threads, are recorded on the returned Turn.
+    """
+    turn = Turn(session_id)
+    _current_turn.set(turn)
+    return turn
+
+def finish_turn(turn: Turn) -> List[str]:
+    """Add `turn` to the session and day totals and return its budget alerts."""
+    _current_turn.set(None)
+    meter.add_turn(turn)
+    limits = budgets()
+    for scope, used in (("session", meter.session_total(turn.session_id)), ("day", meter.day_total(turn.day))):
+        if limits[scope] and used >= ALERT_RATIO * limits[scope]:
+            _alert(turn, f"{scope} token usage at {used:,} of {limits[scope]:,}")
+    return turn.alerts
+
+def _alert(turn: Turn, message: str) -> None:
+    if message not in turn.alerts:
+        turn.alerts.append(message)
+        logger.warning("Token budget alert (%s): %s", turn.session_id, message)
+
+def record_prompt(stage: str, template: str, variables: dict) -> dict:
+    """
+    Meter the prompt `template` is about to be filled with and return
+    `variables` unchanged, so it can sit in a chain right before the prompt.
+    Tokens are attributed to each placeholder and to the template text itself.
+    Raises BudgetExceeded instead of sending a prompt that would go over a budget.
+    """
+    turn = _current_turn.get()
+    if turn is None:
+        return variables
+    sections = {"template": count_tokens(_PLACEHOLDER.sub("", template))}
+    prompt_bytes = len(template.encode())
+    for name in _PLACEHOLDER.findall(template):
+        text = str(variables.get(name, ""))
+        sections[name] = sections.get(name, 0) + count_tokens(text)
+        prompt_bytes += len(text.encode())
+    prompt_tokens = sum(sections.values())
+
+    limits = budgets()
+    turn_used = turn.total().total_tokens
+    checks = (
+        ("turn", turn_used),
+        ("session", meter.session_total(turn.session_id) + turn_used),
+        ("day", meter.day_total(turn.day) + turn_used),
+    )
+    for scope, used in checks:
+        if limits[scope] and used + prompt_tokens > limits[scope]:
+            _alert(turn, f"{scope} token budget of {limits[scope]:,} reached; {stage} call skipped")
+            raise BudgetExceeded(f"{scope} token budget of {limits[scope]:,} is used up")
+
+    with turn._lock:
+        usage = turn._stage(stage)
+        usage.counts["calls"] += 1
+        usage.counts["prompt_tokens"] += prompt_tokens
+        usage.counts["prompt_bytes"] += prompt_bytes
+        for name, tokens in sections.items():
+            usage.sections[name] = usage.sections.get(name, 0) + tokens
+    if limits["turn"] and turn_used + prompt_tokens >= ALERT_RATIO * limits["turn"]:
+        _alert(turn, f"turn token usage at {turn_used + prompt_tokens:,} of {limits['turn']:,}")
+    return variables
+
+def record_completion(stage: str, text: str) -> str:
+    """Meter a model completion and return it unchanged."""
+    turn = _current_turn.get()
+    if turn is not None:
+        with turn._lock:
+            usage = turn._stage(stage)
+            usage.counts["completion_tokens"] += count_tokens(text)
+            usage.counts["completion_bytes"] += len(text.encode())
+    return text
+
+def turn_summary(turn: Turn) -> dict:
+    return {
+        "turn_id": turn.turn_id,
+        "total": turn.total().to_dict(),
+        "stages": {stage: usage.to_dict() for stage, usage in turn.stages.items()},
+        "alerts": list(turn.alerts),
+    }
+
+def _completion_meter(stage: str):
+    """
+    A pass-through chain step that meters the completion as it streams: chunks
+    are forwarded unchanged (so astream still yields tokens one by one) and
+    their text is recorded once the stream ends or is abandoned.
+    """
+    from langchain_core.runnables import RunnableGenerator
+
+    def transform(chunks):
+        text = []
+        try:
+            for chunk in chunks:
+                text.append(chunk)
+                yield chunk
+        finally:
+            record_completion(stage, "".join(text))
+
+    async def atransform(chunks):
+        text = []
+        try:
+            async for chunk in chunks:
+                text.append(chunk)
+                yield chunk
+        finally:
+            record_completion(stage, "".join(text))
+
+    return RunnableGenerator(transform, atransform)
+
+def metered(stage: str, template: str, llm):
+    """
+    Return the `prompt | llm | StrOutputParser()` part of a chain with the
+    prompt sections and the completion metered under `stage`. The prompt is
+    metered once per request sent, so retries and hedged duplicates made by
+    utils.resilience.invoke() count against the budgets too.
+    """
+    from langchain_core.output_parsers import StrOutputParser
+    from utils import llm_registry, resilience
+    return (
+        resilience.llm_step(
+            llm, llm_registry.get_prompt(template), on_send=lambda variables: record_prompt(stage, template, variables)
+        )
+        | StrOutputParser()
+        | _completion_meter(stage)
+    )
@@ -0,0 +1,100 @@
+# utils/presentation.py
+import math
+
+import pandas as pd
+
+DEFAULT_PAGE_SIZE = 50
+
+def optimize_dtypes(df: pd.DataFrame, category_ratio: float = 0.5) -> pd.DataFrame:
+    """
+    Return `df` with smaller dtypes: numeric text is parsed, integers and
+    floats are downcast to the narrowest type that holds them, and text
+    columns with few distinct values (at most `category_ratio` of the rows)
+    become categoricals.
+    """
+    columns = {}
+    for name in df.columns:
+        col = df[name]
+        text = col.dtype == object or pd.api.types.is_string_dtype(col)
+        # Codes with leading zeros (zip codes, account numbers) stay text.
+        if text and not col.astype(str).str.match(r"0\d").any():
+            try:
+                col = pd.to_numeric(col)
+            except (ValueError, TypeError):
+                pass
+        if pd.api.types.is_integer_dtype(col):
+            col = pd.to_numeric(col, downcast="integer")
+        elif pd.api.types.is_float_dtype(col):
+            col = pd.to_numeric(col, downcast="float")
+        elif text and len(col) and col.nunique(dropna=True) <= category_ratio * len(col):
+            col = col.astype("category")
+        columns[name] = col
+    return pd.DataFrame(columns, index=df.index) if columns else df
+
+class PagedResult:
+    """
+    A result table held once in columnar form for display.
+
+    The DataFrame is converted to a pyarrow Table a single time (pandas is kept
+    when pyarrow is not installed); pages are zero-copy slices, so only the
+    visible rows are turned back into a DataFrame and sent to the browser.
+
+    Attributes:
+        num_rows (int): rows in the whole result.
+        page_size (int): rows per page.
+
+    Methods:
+        page: returns one page as a DataFrame.
+    """
+
+    def __init__(self, df: pd.DataFrame, page_size: int = DEFAULT_PAGE_SIZE):
+        self.num_rows = len(df)
+        self.page_size = page_size
+        try:
+            import pyarrow as pa
+            self._table = pa.Table.from_pandas(df, preserve_index=False)
+        except ImportError:
+            self._table = df.reset_index(drop=True)
+
+    @property
+    def num_pages(self) -> int:
+        return max(1, math.ceil(self.num_rows / self.page_size))
+
+    @property
+    def nbytes(self) -> int:
+        if isinstance(self._table, pd.DataFrame):
+            return int(self._table.memory_usage(deep=True).sum())
+        return self._table.nbytes
+
+    def __repr__(self) -> str:
+        # Chat history messages reach the prompts via repr(); the answer text is in "content".
+        return f"PagedResult({self.num_rows} rows)"
+
+    def __str__(self) -> str:
+        # Plain-text form (first page as CSV) for logs and exports.
+        text = self.page(1).to_csv(index=False)
+        return text if self.num_pages == 1 else text + f"... ({self.num_rows} rows in total)\n"
+
+    def page(self, number: int) -> pd.DataFrame:
+        """Rows of page `number` (1-based)."""
+        start = (min(max(number, 1), self.num_pages) - 1) * self.page_size
+        if isinstance(self._table, pd.DataFrame):
+            # Numbered from 0 like the pyarrow slice.
+            return self._table.iloc[start:start + self.page_size].reset_index(drop=True)
+        return self._table.slice(start, self.page_size).to_pandas()
+
+def present(rows, page_size: int = DEFAULT_PAGE_SIZE) -> PagedResult:
+    """Build the display form of a result from a DataFrame or a list of row dicts."""
+    df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+    return PagedResult(optimize_dtypes(df), page_size)
+
+def render_table(result: PagedResult, key: str) -> None:
+    """Show one page of `result` with a page picker; `key` must be unique per table on the page."""
+    import streamlit as st
+    number = 1
+    if result.num_pages > 1:
+        number = st.number_input(f"Page (of {result.num_pages})", min_value=1, max_value=result.num_pages, value=1, key=key)
+    st.dataframe(result.page(number), hide_index=True)
+    if result.num_pages > 1:
+        start = (number - 1) * result.page_size
+        st.caption(f"Rows {start + 1}-{min(start + result.page_size, result.num_rows)} of {result.num_rows}")
@@ -0,0 +1,210 @@
+# utils/profiler.py
+import contextvars
+import functools
+import marshal
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import List, Optional, Tuple
+
+# Share of turns profiled without a session opting in (0 = only opted-in sessions).
+RATE_ENV = "SQLCHAT_PROFILE_RATE"
+# "sampling" (low overhead, stacks for flamegraphs) or "cprofile" (deterministic, .prof files).
+MODE_ENV = "SQLCHAT_PROFILE_MODE"
+INTERVAL_ENV = "SQLCHAT_PROFILE_INTERVAL"
+KEEP = 50
+# A sampler whose turn never finished (the script was stopped mid-turn) gives up after this.
+MAX_SECONDS = 600.0
+
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class TurnProfile:
+    """
+    The profile of one chat turn, stored under the turn's trace ID (its
+    metering turn_id).
+
+    Attributes:
+        trace_id (str): the turn's trace ID.
+        session_id (str): the session that ran the turn.
+        mode (str): "sampling" or "cprofile".
+        seconds (float): wall time of the turn.
+        ticks (int): sampling rounds taken; each covers every thread working for the turn.
+
+    Methods:
+        top: returns the hottest functions by self time.
+        export: returns (file name, bytes) of the raw profile for flamegraph tools.
+    """
+
+    def __init__(self, trace_id: str, session_id: str, mode: str):
+        self.trace_id = trace_id
+        self.session_id = session_id
+        self.mode = mode
+        self.seconds = 0.0
+        self.ticks = 0
+        # sampling: Counter of root-first stacks; cprofile: pstats-style stats dict.
+        self.stacks: Counter = Counter()
+        self.stats: Optional[dict] = None
+
+    def top(self, limit: int = 10) -> List[dict]:
+        """Functions with the most self time: [{function, self_s, cumulative_s, calls}]."""
+        rows = []
+        if self.stats is not None:
+            for (filename, line, name), (_, calls, self_s, cumulative_s, _) in self.stats.items():
+                label = name if filename == "~" else f"{name} ({os.path.basename(filename)}:{line})"
+                rows.append({"function": label, "self_s": self_s, "cumulative_s": cumulative_s, "calls": calls})
+        else:
+            # Several threads may be sampled per tick, so self times add up to
+            # thread time, which can exceed the turn's wall time.
+            ticks = self.ticks or sum(self.stacks.values())
+            per_sample = self.seconds / ticks if ticks else 0.0
+            own, inclusive = Counter(), Counter()
+            for stack, count in self.stacks.items():
+                own[stack[-1]] += count
+                for label in set(stack):
+                    inclusive[label] += count
+            rows = [
+                {"function": label, "self_s": own[label] * per_sample, "cumulative_s": inclusive[label] * per_sample, "calls": None}
+                for label in inclusive
+            ]
+        rows.sort(key=lambda row: -row["self_s"])
+        return rows[:limit]
+
+    def export(self) -> Tuple[str, bytes]:
+        """
+        The raw profile: a .prof file (pstats format, for snakeviz or flameprof)
+        for cProfile captures, collapsed stacks (for flamegraph.pl or
+        speedscope) for sampled ones.
+        """
+        if self.stats is not None:
+            return f"turn-{self.trace_id}.prof", marshal.dumps(self.stats)
+        lines = [";".join(stack) + f" {count}" for stack, count in self.stacks.most_common()]
+        return f"turn-{self.trace_id}.collapsed.txt", ("\n".join(lines) + "\n").encode()
+
+class Capture:
+    """
+    A running capture of the current thread, ended by finish_turn(). Sampling
+    captures also cover worker threads running calls wrapped by traced();
+    cProfile only sees the thread that started it.
+    """
+
+    def __init__(self, profile: TurnProfile, interval: float):
+        self.profile = profile
+        self.interval = interval
+        self._start = time.perf_counter()
+        self._stop = threading.Event()
+        self._threads = {threading.get_ident()}
+        self._threads_lock = threading.Lock()
+        self._profiler = None
+        self._sampler: Optional[threading.Thread] = None
+        if profile.mode == "cprofile":
+            import cProfile
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Python 3.12+ allows one active cProfile per process; sample instead.
+                self._profiler = None
+                profile.mode = "sampling"
+        if self._profiler is None:
+            self._sampler = threading.Thread(target=self._sample, name=f"profiler {profile.trace_id}", daemon=True)
+            self._sampler.start()
+
+    def _sample(self) -> None:
+        deadline = time.monotonic() + MAX_SECONDS
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frames = sys._current_frames()
+            with self._threads_lock:
+                threads = list(self._threads)
+            for thread_id in threads:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(_label(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    self.profile.stacks[tuple(reversed(stack))] += 1
+            self.profile.ticks += 1
+
+    def add_thread(self, thread_id: int) -> None:
+        with self._threads_lock:
+            self._threads.add(thread_id)
+
+    def remove_thread(self, thread_id: int) -> None:
+        with self._threads_lock:
+            self._threads.discard(thread_id)
+
+    def stop(self) -> TurnProfile:
+        self.profile.seconds = time.perf_counter() - self._start
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.create_stats()
+            self.profile.stats = self._profiler.stats
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        return self.profile
+
+_profiles: "OrderedDict[str, TurnProfile]" = OrderedDict()
+_lock = threading.Lock()
+# The capture of the turn running in this context, if it is profiled.
+_active: contextvars.ContextVar[Optional[Capture]] = contextvars.ContextVar("profile_capture", default=None)
+
+def start_turn(trace_id: str, session_id: str, enabled: bool = False) -> Optional[Capture]:
+    """
+    Start profiling the calling thread's turn when the session opted in
+    (`enabled`) or the turn is picked by SQLCHAT_PROFILE_RATE. Returns None for
+    turns that are not profiled.
+    """
+    if not enabled and random.random() >= float(os.getenv(RATE_ENV, "0")):
+        return None
+    mode = os.getenv(MODE_ENV, "sampling")
+    capture = Capture(TurnProfile(trace_id, session_id, mode), float(os.getenv(INTERVAL_ENV, "0.005")))
+    _active.set(capture)
+    return capture
+
+def finish_turn(capture: Optional[Capture]) -> Optional[TurnProfile]:
+    """Stop `capture` and keep its profile (the last KEEP profiles are kept)."""
+    if capture is None:
+        return None
+    if _active.get() is capture:
+        _active.set(None)
+    profile = capture.stop()
+    with _lock:
+        _profiles[profile.trace_id] = profile
+        while len(_profiles) > KEEP:
+            _profiles.popitem(last=False)
+    return profile
+
+def traced(fn):
+    """
+    Wrap `fn`, to be run on a worker thread, so that thread is sampled along
+    with the calling turn while it runs. Returns `fn` itself when the turn is
+    not profiled.
+    """
+    capture = _active.get()
+    if capture is None:
+        return fn
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        thread_id = threading.get_ident()
+        capture.add_thread(thread_id)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            capture.remove_thread(thread_id)
+
+    return run
+
+def get_profile(trace_id: str) -> Optional[TurnProfile]:
+    with _lock:
+        return _profiles.get(trace_id)
+
+def session_profiles(session_id: str) -> List[TurnProfile]:
+    """Kept profiles of `session_id`, newest first."""
+    with _lock:
+        return [p for p in reversed(_profiles.values()) if p.session_id == session_id]
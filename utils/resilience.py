@@ -0,0 +1,340 @@
+# utils/resilience.py
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from utils import profiler
+
+# Seconds one chat turn may spend on LLM calls, overridable with LLM_TURN_BUDGET.
+DEFAULT_TURN_BUDGET = 60.0
+
+class LLMUnavailable(RuntimeError):
+    """The model could not produce an answer in time; callers show a fallback message."""
+
+class DeadlineExceeded(LLMUnavailable):
+    pass
+
+class CircuitOpenError(LLMUnavailable):
+    pass
+
+# Provider errors worth retrying (rate limits, overload, transient network or server faults).
+TRANSIENT_ERROR_NAMES = {
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError",
+    "TooManyRequests", "GatewayTimeout", "Aborted", "RemoteDisconnected", "ReadTimeout",
+    "ConnectTimeout", "ConnectError", "ReadError",
+}
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+def turn_budget() -> float:
+    return float(os.getenv("LLM_TURN_BUDGET", DEFAULT_TURN_BUDGET))
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, LLMUnavailable):
+        return False
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    if any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(exc).__mro__):
+        return True
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    return isinstance(code, int) and code in TRANSIENT_STATUS_CODES
+
+def fallback_message(exc: BaseException) -> str:
+    if getattr(exc, "user_message", None):
+        return exc.user_message
+    if isinstance(exc, CircuitOpenError):
+        return "The AI model is currently unavailable after repeated failures. Please try again in a minute."
+    if isinstance(exc, DeadlineExceeded):
+        return "The AI model did not respond in time for this question. Please try again."
+    return f"The AI model could not answer right now ({exc}). Please try again."
+
+class Deadline:
+    """Time budget shared by every LLM call of one chat turn."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+class CircuitBreaker:
+    """
+    Stops calling a failing provider: after `failure_threshold` consecutive
+    transient failures the circuit opens and calls fail fast for
+    `reset_timeout` seconds, then a single trial call is let through.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+    def release(self) -> None:
+        """End a call that says nothing about the provider's health (e.g. a bad request)."""
+        with self._lock:
+            self._trial_running = False
+
+class LatencyTracker:
+    """Sliding window of recent call latencies."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+MAX_WORKERS = 32
+# A losing hedge keeps its thread until the provider answers, so hedges are
+# only sent while fewer than this many model calls are running.
+MAX_HEDGING_IN_FLIGHT = MAX_WORKERS // 2
+_in_flight = 0
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="llm-call")
+        return _executor
+
+def _submit(fn, *args, **kwargs):
+    global _in_flight
+
+    def done(_):
+        global _in_flight
+        with _executor_lock:
+            _in_flight -= 1
+
+    executor = _get_executor()
+    with _executor_lock:
+        _in_flight += 1
+    # Run in the caller's context so context variables (turn metering, tracing) follow the call,
+    # and sample the worker with the caller's turn when that turn is profiled.
+    future = executor.submit(contextvars.copy_context().run, profiler.traced(fn), *args, **kwargs)
+    future.add_done_callback(done)
+    return future
+
+def _can_hedge() -> bool:
+    with _executor_lock:
+        return _in_flight < MAX_HEDGING_IN_FLIGHT
+
+class ResilientCaller:
+    """
+    Wraps one pipeline stage's LLM call with a deadline, a hedged second
+    request, jittered retries on transient errors and a circuit breaker.
+
+    Attributes:
+        name (str): stage name, e.g. "snowflake_sql".
+        breaker (CircuitBreaker): shared by every stage calling the same provider.
+        hedge_percentile (float): once enough latencies are known, a second
+            identical request is sent if the first is slower than this
+            percentile; None disables hedging.
+        min_hedge_delay (float): never hedge earlier than this many seconds.
+        max_retries (int): retries after the first attempt on transient errors.
+        backoff (float): base of the exponential, fully jittered retry delay.
+
+    Methods:
+        call: runs `fn(*args, **kwargs)` under these policies.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        breaker: CircuitBreaker,
+        hedge_percentile: Optional[float] = 0.95,
+        min_hedge_delay: float = 2.0,
+        max_retries: int = 2,
+        backoff: float = 0.5,
+    ):
+        self.name = name
+        self.breaker = breaker
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.latency = LatencyTracker()
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+        p = self.latency.percentile(self.hedge_percentile)
+        return None if p is None else max(self.min_hedge_delay, p)
+
+    def call(self, fn: Callable[..., Any], *args, deadline: Optional[Deadline] = None, **kwargs) -> Any:
+        deadline = deadline or Deadline(turn_budget())
+        last_error: Optional[BaseException] = None
+        for attempt in range(self.max_retries + 1):
+            if deadline.expired:
+                raise DeadlineExceeded(f"{self.name}: turn deadline of {deadline.seconds:.0f}s exceeded") from last_error
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"{self.name}: circuit open") from last_error
+            start = time.monotonic()
+            try:
+                result = self._attempt(fn, args, kwargs, deadline)
+            except DeadlineExceeded:
+                self.breaker.record_failure()
+                raise
+            except Exception as e:
+                if not is_transient(e):
+                    # Not the provider's fault (bad prompt, auth, bug); neither retry nor
+                    # count it either way, but free a half-open circuit's trial slot.
+                    self.breaker.release()
+                    raise
+                self.breaker.record_failure()
+                last_error = e
+                if attempt < self.max_retries:
+                    delay = random.uniform(0, self.backoff * (2 ** attempt))
+                    time.sleep(min(delay, deadline.remaining()))
+                continue
+            self.latency.record(time.monotonic() - start)
+            self.breaker.record_success()
+            return result
+        raise LLMUnavailable(f"{self.name}: failed after {self.max_retries + 1} attempts: {last_error}") from last_error
+
+    def _attempt(self, fn, args, kwargs, deadline: Deadline) -> Any:
+        pending = {_submit(fn, *args, **kwargs)}
+        hedge_delay = self.hedge_delay()
+        hedged = False
+        error: Optional[BaseException] = None
+        while pending:
+            timeout = deadline.remaining()
+            if not hedged and hedge_delay is not None:
+                timeout = min(timeout, hedge_delay)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+            if deadline.expired:
+                raise DeadlineExceeded(f"{self.name}: no response within the turn deadline")
+            if not done and not hedged and hedge_delay is not None:
+                hedged = True
+                if _can_hedge():
+                    pending.add(_submit(fn, *args, **kwargs))
+        raise error
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_callers: Dict[str, ResilientCaller] = {}
+_registry_lock = threading.Lock()
+
+def get_breaker(provider: str = "gemini") -> CircuitBreaker:
+    with _registry_lock:
+        return _breakers.setdefault(provider, CircuitBreaker())
+
+def get_caller(stage: str, provider: str = "gemini") -> ResilientCaller:
+    """Return the process-wide ResilientCaller for a pipeline stage."""
+    breaker = get_breaker(provider)
+    with _registry_lock:
+        if stage not in _callers:
+            _callers[stage] = ResilientCaller(stage, breaker)
+        return _callers[stage]
+
+# The caller and deadline of the invoke() running in this context, for llm_step().
+_active: contextvars.ContextVar[Optional[Tuple[ResilientCaller, Deadline]]] = contextvars.ContextVar(
+    "resilient_call", default=None
+)
+
+def invoke(stage: str, runnable, input: dict, deadline: Optional[Deadline] = None) -> Any:
+    """
+    Invoke a LangChain runnable whose single LLM call belongs to `stage`. The
+    runnable's other steps (schema lookups, prompt formatting) run once on the
+    calling thread; only its model step (see llm_step) is retried and hedged.
+    """
+    token = _active.set((get_caller(stage), deadline or Deadline(turn_budget())))
+    try:
+        return runnable.invoke(input)
+    finally:
+        _active.reset(token)
+
+def llm_step(llm, prompt, on_send: Optional[Callable[[dict], Any]] = None):
+    """
+    The model step of a chain: fills `prompt` with the chain's variables and
+    calls `llm`. Inside invoke() each call goes through the stage's
+    ResilientCaller, elsewhere (e.g. streaming) the model runs as is, token by
+    token. `on_send(variables)` runs before every request actually sent,
+    retries and hedges included.
+
+    Every call, hedges included, gets a client timeout of what is left of the
+    turn's deadline when it starts, so a hung provider frees its worker thread
+    instead of holding it past the deadline.
+    """
+    from langchain_core.runnables import RunnableLambda
+
+    def call(variables, config):
+        active = _active.get()
+        if active is None:
+            if on_send is not None:
+                on_send(variables)
+            # A returned runnable is invoked or streamed by RunnableLambda.
+            return prompt | llm
+        caller, deadline = active
+        messages = prompt.invoke(variables)
+
+        def send():
+            if on_send is not None:
+                on_send(variables)
+            return llm.invoke(messages, config, timeout=max(deadline.remaining(), 0.001))
+
+        return caller.call(send, deadline=deadline)
+
+    return RunnableLambda(call, name="llm")
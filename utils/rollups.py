@@ -0,0 +1,615 @@
+# utils/rollups.py
+"""
+Pre-aggregated rollup tables over the sales schema.
+
+Rollups are declared below against the tables in sql/ddl_*.sql, built with
+`python -m utils.rollups build --uri <sqlalchemy-uri>` and refreshed with
+`... refresh`. At query time `rewrite_query` redirects generated aggregate
+queries that a built rollup can answer (same tables and joins, grouping and
+filtering only on rollup dimensions, SUM/COUNT/MIN/MAX/AVG of rollup measures)
+to the much smaller rollup table. Anything it does not fully understand is
+left unchanged.
+"""
+import json
+import logging
+import re
+import time
+from functools import lru_cache
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from utils.snowddl import Snowddl
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class Measure:
+    name: str
+    func: str
+    expr: str
+
+@dataclass(frozen=True)
+class Rollup:
+    name: str
+    base: str
+    description: str
+    dimensions: Tuple[str, ...]
+    measures: Tuple[Measure, ...]
+    joins: Tuple[Tuple[str, str], ...] = ()
+    refresh_column: Optional[str] = None
+
+    @property
+    def tables(self) -> set:
+        tables = {self.base}
+        for left, right in self.joins:
+            tables.add(left.split(".")[0])
+            tables.add(right.split(".")[0])
+        return tables
+
+# Every rollup carries ROW_COUNT = COUNT(*); COUNT(col) measures let AVG(col)
+# be answered as SUM / COUNT. Columns are written TABLE.COLUMN.
+ROLLUPS = [
+    Rollup(
+        name="AGG_ORDERS_BY_DAY",
+        base="ORDER_DETAILS",
+        description="orders and order revenue per ORDER_DATE",
+        dimensions=("ORDER_DETAILS.ORDER_DATE",),
+        measures=(
+            Measure("REVENUE", "SUM", "ORDER_DETAILS.TOTAL_AMOUNT"),
+            Measure("REVENUE_COUNT", "COUNT", "ORDER_DETAILS.TOTAL_AMOUNT"),
+            Measure("MIN_ORDER_AMOUNT", "MIN", "ORDER_DETAILS.TOTAL_AMOUNT"),
+            Measure("MAX_ORDER_AMOUNT", "MAX", "ORDER_DETAILS.TOTAL_AMOUNT"),
+        ),
+        refresh_column="ORDER_DETAILS.ORDER_DATE",
+    ),
+    Rollup(
+        name="AGG_ORDERS_BY_CUSTOMER",
+        base="ORDER_DETAILS",
+        description="orders and total spent per CUSTOMER_ID",
+        dimensions=("ORDER_DETAILS.CUSTOMER_ID",),
+        measures=(
+            Measure("TOTAL_SPENT", "SUM", "ORDER_DETAILS.TOTAL_AMOUNT"),
+            Measure("TOTAL_SPENT_COUNT", "COUNT", "ORDER_DETAILS.TOTAL_AMOUNT"),
+        ),
+    ),
+    Rollup(
+        name="AGG_PAYMENTS_BY_DAY",
+        base="PAYMENTS",
+        description="payments and amount paid per PAYMENT_DATE",
+        dimensions=("PAYMENTS.PAYMENT_DATE",),
+        measures=(
+            Measure("AMOUNT_PAID", "SUM", "PAYMENTS.AMOUNT"),
+            Measure("AMOUNT_PAID_COUNT", "COUNT", "PAYMENTS.AMOUNT"),
+        ),
+        refresh_column="PAYMENTS.PAYMENT_DATE",
+    ),
+    Rollup(
+        name="AGG_SALES_BY_PRODUCT",
+        base="TRANSACTIONS",
+        description="units sold and sales revenue (QUANTITY * PRICE) per product and CATEGORY",
+        dimensions=("PRODUCTS.PRODUCT_ID", "PRODUCTS.PRODUCT_NAME", "PRODUCTS.CATEGORY"),
+        measures=(
+            Measure("UNITS", "SUM", "TRANSACTIONS.QUANTITY"),
+            Measure("UNITS_COUNT", "COUNT", "TRANSACTIONS.QUANTITY"),
+            Measure("SALES", "SUM", "TRANSACTIONS.QUANTITY * TRANSACTIONS.PRICE"),
+        ),
+        joins=(("TRANSACTIONS.PRODUCT_ID", "PRODUCTS.PRODUCT_ID"),),
+    ),
+    Rollup(
+        name="AGG_SALES_BY_CATEGORY_DAY",
+        base="TRANSACTIONS",
+        description="units sold and sales revenue (QUANTITY * PRICE) per ORDER_DATE and product CATEGORY",
+        dimensions=("ORDER_DETAILS.ORDER_DATE", "PRODUCTS.CATEGORY"),
+        measures=(
+            Measure("UNITS", "SUM", "TRANSACTIONS.QUANTITY"),
+            Measure("UNITS_COUNT", "COUNT", "TRANSACTIONS.QUANTITY"),
+            Measure("SALES", "SUM", "TRANSACTIONS.QUANTITY * TRANSACTIONS.PRICE"),
+        ),
+        joins=(
+            ("TRANSACTIONS.ORDER_ID", "ORDER_DETAILS.ORDER_ID"),
+            ("TRANSACTIONS.PRODUCT_ID", "PRODUCTS.PRODUCT_ID"),
+        ),
+        refresh_column="ORDER_DETAILS.ORDER_DATE",
+    ),
+]
+
+@lru_cache(maxsize=1)
+def ddl_columns() -> Dict[str, dict]:
+    """{table: {column: type}} parsed once from the sql/ddl_*.sql files."""
+    snow_ddl = Snowddl()
+    return {table: snow_ddl.get_columns(table) for table in snow_ddl.table_names}
+
+def validate_rollups(rollups: List[Rollup]) -> None:
+    """Raise ValueError if a rollup references a table or column missing from the DDL files."""
+    columns = ddl_columns()
+    for rollup in rollups:
+        refs = list(rollup.dimensions) + [c for pair in rollup.joins for c in pair]
+        refs += [ref for m in rollup.measures for ref in re.findall(r"[A-Z_]+\.[A-Z_]+", m.expr)]
+        if rollup.refresh_column:
+            refs.append(rollup.refresh_column)
+        for ref in refs:
+            table, column = ref.split(".")
+            if column not in columns.get(table, {}):
+                raise ValueError(f"Rollup {rollup.name} references unknown column {ref}")
+
+def dimension_name(ref: str) -> str:
+    return ref.split(".")[1]
+
+# --- Building and refreshing -------------------------------------------------
+
+def _from_clause(rollup: Rollup) -> str:
+    sql = f"FROM {rollup.base}"
+    for left, right in rollup.joins:
+        table = right.split(".")[0] if right.split(".")[0] != rollup.base else left.split(".")[0]
+        sql += f" JOIN {table} ON {left} = {right}"
+    return sql
+
+def rollup_select(rollup: Rollup, where: str = "") -> str:
+    items = [f"{dim} AS {dimension_name(dim)}" for dim in rollup.dimensions]
+    items.append("COUNT(*) AS ROW_COUNT")
+    items += [f"{m.func}({m.expr}) AS {m.name}" for m in rollup.measures]
+    sql = f"SELECT {', '.join(items)} {_from_clause(rollup)}"
+    if where:
+        sql += f" WHERE {where}"
+    return sql + f" GROUP BY {', '.join(rollup.dimensions)}"
+
+# Freshness markers (see utils.freshness) of each rollup's base tables as they
+# were when it was last built or refreshed; a rollup whose base tables have
+# changed since is not used for rewrites.
+ROLLUP_STATE = "ROLLUP_STATE"
+
+def base_markers(engine, rollup: Rollup, markers: Optional[dict] = None) -> Optional[str]:
+    """
+    The current markers of `rollup`'s base tables as JSON, or None for dialects
+    without change markers (their rollups are trusted as built).
+    """
+    from utils.freshness import MARKER_QUERIES, read_markers
+    if engine.dialect.name not in MARKER_QUERIES:
+        return None
+    markers = read_markers(engine) if markers is None else markers
+    return json.dumps({table: list(markers.get(table, ())) for table in sorted(rollup.tables)}, default=str)
+
+def _record_state(engine, rollup: Rollup, markers: Optional[str]) -> None:
+    if markers is None:
+        return
+    from sqlalchemy import text
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {ROLLUP_STATE} (ROLLUP_NAME VARCHAR(128), BASE_MARKERS VARCHAR(4000))"))
+        conn.execute(text(f"DELETE FROM {ROLLUP_STATE} WHERE ROLLUP_NAME = :name"), {"name": rollup.name})
+        conn.execute(text(f"INSERT INTO {ROLLUP_STATE} VALUES (:name, :markers)"), {"name": rollup.name, "markers": markers})
+
+def _recorded_states(engine) -> Dict[str, str]:
+    """{rollup name: base markers JSON} as recorded at each rollup's last build or refresh."""
+    from sqlalchemy import inspect, text
+    if not inspect(engine).has_table(ROLLUP_STATE.lower()):
+        return {}
+    with engine.connect() as conn:
+        return dict(conn.execute(text(f"SELECT ROLLUP_NAME, BASE_MARKERS FROM {ROLLUP_STATE}")).fetchall())
+
+def _appended_only(engine, rollup: Rollup, markers: Optional[str]) -> bool:
+    """
+    True when rows have only been inserted into `rollup`'s base tables since
+    its recorded state. Only PostgreSQL's markers tell inserts apart (n_tup_ins
+    moves alone); for other dialects this is never assumed.
+    """
+    if engine.dialect.name != "postgresql" or markers is None:
+        return False
+    recorded = _recorded_states(engine).get(rollup.name)
+    if recorded is None:
+        return False
+    before, now = json.loads(recorded), json.loads(markers)
+    return all(before.get(table) and now.get(table) and before[table][1:] == now[table][1:] for table in rollup.tables)
+
+def build_rollup(engine, rollup: Rollup) -> None:
+    from sqlalchemy import text
+    # Read before building: a load that lands during the build then marks the rollup stale.
+    markers = base_markers(engine, rollup)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {rollup.name}"))
+        conn.execute(text(f"CREATE TABLE {rollup.name} AS {rollup_select(rollup)}"))
+    _record_state(engine, rollup, markers)
+
+def refresh_rollup(engine, rollup: Rollup, full: bool = False) -> None:
+    """
+    Bring a rollup up to date. A rollup with a refresh_column is refreshed
+    incrementally, recomputing only the groups from the latest loaded date
+    onwards, when its base tables have only had rows appended at or past that
+    date. Anything else (updates, deletes, backdated or undated rows, dialects
+    that cannot tell), and full=True, rebuilds the table.
+    """
+    from sqlalchemy import inspect, text
+    markers = base_markers(engine, rollup)
+    if (
+        full or not rollup.refresh_column or not inspect(engine).has_table(rollup.name.lower())
+        or not _appended_only(engine, rollup, markers)
+    ):
+        build_rollup(engine, rollup)
+        return
+    column = dimension_name(rollup.refresh_column)
+    older = "{} < :watermark OR {} IS NULL"
+    with engine.begin() as conn:
+        watermark = conn.execute(text(f"SELECT MAX({column}) FROM {rollup.name}")).scalar()
+        # With only inserts, equal row counts below the watermark mean none were backdated or undated.
+        stale = watermark is None or conn.execute(
+            text(f"SELECT COUNT(*) {_from_clause(rollup)} WHERE {older.format(rollup.refresh_column, rollup.refresh_column)}"),
+            {"watermark": watermark},
+        ).scalar() != conn.execute(
+            text(f"SELECT COALESCE(SUM(ROW_COUNT), 0) FROM {rollup.name} WHERE {older.format(column, column)}"),
+            {"watermark": watermark},
+        ).scalar()
+        if not stale:
+            conn.execute(text(f"DELETE FROM {rollup.name} WHERE {column} >= :watermark"), {"watermark": watermark})
+            conn.execute(
+                text(f"INSERT INTO {rollup.name} {rollup_select(rollup, f'{rollup.refresh_column} >= :watermark')}"),
+                {"watermark": watermark},
+            )
+    if stale:
+        build_rollup(engine, rollup)
+    else:
+        _record_state(engine, rollup, markers)
+
+def _load_available(engine) -> List[Rollup]:
+    from sqlalchemy import inspect, text
+    from utils.freshness import MARKER_QUERIES, read_markers
+    try:
+        names = {name.upper() for name in inspect(engine).get_table_names()}
+    except Exception as e:
+        logger.warning("Could not list rollup tables: %s", e)
+        return []
+    built = [rollup for rollup in ROLLUPS if rollup.name in names]
+    if not built or engine.dialect.name not in MARKER_QUERIES:
+        return built
+    try:
+        recorded = _recorded_states(engine)
+        markers = read_markers(engine)
+    except Exception as e:
+        logger.warning("Could not check rollup freshness, not using rollups: %s", e)
+        return []
+    fresh = [rollup for rollup in built if recorded.get(rollup.name) == base_markers(engine, rollup, markers)]
+    for rollup in built:
+        if rollup not in fresh:
+            logger.warning("Rollup %s is older than its base tables; run `python -m utils.rollups refresh`", rollup.name)
+    return fresh
+
+def available_rollups(engine, ttl: float = 300.0) -> List[Rollup]:
+    """
+    Return the rollups that have been built in the engine's database and are
+    up to date with their base tables (cached for `ttl` seconds, and dropped
+    as soon as utils.freshness sees a base or rollup table change).
+    """
+    from utils.cache import schema_cache
+    from utils.freshness import dependencies
+    tables = {ROLLUP_STATE} | {rollup.name for rollup in ROLLUPS} | {t for rollup in ROLLUPS for t in rollup.tables}
+    return schema_cache.get_or_compute(
+        ("rollups", str(engine.url)), lambda: _load_available(engine), ttl=ttl, tables=dependencies(engine, tables)
+    )
+
+def describe_rollups(rollups: List[Rollup]) -> str:
+    """Prompt section telling the SQL generator which pre-aggregated tables exist."""
+    if not rollups:
+        return ""
+    lines = ["\nPre-aggregated tables (prefer these for totals, counts and averages at or above their grain):"]
+    for rollup in rollups:
+        cols = [dimension_name(d) for d in rollup.dimensions] + ["ROW_COUNT"] + [m.name for m in rollup.measures]
+        lines.append(f"Table: {rollup.name} - {rollup.description}. Columns: {', '.join(cols)}")
+    return "\n".join(lines) + "\n"
+
+# --- Query rewrite -----------------------------------------------------------
+
+_TOKEN = re.compile(
+    r"(?P<ws>\s+)|(?P<str>'(?:[^']|'')*')|(?P<qid>\"[^\"]+\")|(?P<num>\d+(?:\.\d+)?)"
+    r"|(?P<id>[A-Za-z_][\w$]*)|(?P<op><=|>=|<>|!=|\|\||::|[-+*/%=<>(),.;])"
+)
+_CLAUSES = ("SELECT", "FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "OFFSET", "FETCH")
+_UNSUPPORTED = {"UNION", "INTERSECT", "EXCEPT", "MINUS", "WITH", "OVER", "QUALIFY", "LEFT", "RIGHT",
+                "FULL", "CROSS", "NATURAL", "LATERAL", "USING", "SAMPLE", "TABLESAMPLE"}
+_AGGREGATES = {"SUM", "COUNT", "MIN", "MAX", "AVG"}
+
+class _Unsupported(Exception):
+    pass
+
+@dataclass
+class _Token:
+    kind: str
+    text: str
+
+    @property
+    def upper(self) -> str:
+        return self.text.upper()
+
+def _tokenize(sql: str) -> List[_Token]:
+    tokens, pos = [], 0
+    while pos < len(sql):
+        match = _TOKEN.match(sql, pos)
+        if not match:
+            raise _Unsupported(f"unexpected character {sql[pos]!r}")
+        pos = match.end()
+        if match.lastgroup != "ws":
+            tokens.append(_Token(match.lastgroup, match.group()))
+    # Merge qualified names (a.b, a.b.c) into single "ref" tokens.
+    merged = []
+    for token in tokens:
+        if (
+            token.kind in ("id", "qid") and len(merged) >= 2 and merged[-1].text == "."
+            and merged[-2].kind in ("id", "qid", "ref")
+        ):
+            merged.pop()
+            prev = merged.pop()
+            merged.append(_Token("ref", f"{prev.text}.{token.text}"))
+        else:
+            merged.append(token)
+    return merged
+
+def _split_clauses(tokens: List[_Token]) -> Dict[str, List[_Token]]:
+    clauses, current, depth = {}, None, 0
+    for i, token in enumerate(tokens):
+        if token.text == "(":
+            depth += 1
+        elif token.text == ")":
+            depth -= 1
+        if token.kind == "id" and token.upper in _UNSUPPORTED:
+            raise _Unsupported(token.upper)
+        if token.kind == "id" and token.upper == "SELECT" and (depth > 0 or "SELECT" in clauses):
+            raise _Unsupported("subquery")
+        if depth == 0 and token.kind == "id" and token.upper in _CLAUSES:
+            if token.upper in ("GROUP", "ORDER") and (i + 1 >= len(tokens) or tokens[i + 1].upper != "BY"):
+                raise _Unsupported(token.upper)
+            current = token.upper if token.upper not in ("OFFSET", "FETCH") else "LIMIT"
+            if current in clauses and current != "LIMIT":
+                raise _Unsupported(f"repeated {current}")
+            clauses.setdefault(current, [])
+            if token.upper in ("GROUP", "ORDER"):
+                continue
+            if current == "LIMIT":
+                clauses[current].append(token)
+            continue
+        if current is None:
+            raise _Unsupported("statement does not start with SELECT")
+        if current in ("GROUP", "ORDER") and not clauses[current] and token.upper == "BY":
+            continue
+        if token.text == ";":
+            continue
+        clauses[current].append(token)
+    if "SELECT" not in clauses or "FROM" not in clauses:
+        raise _Unsupported("not a SELECT ... FROM query")
+    return clauses
+
+def _unquote(name: str) -> str:
+    return name.strip('"').upper()
+
+class _Scope:
+    """Tables, aliases and join-equivalent columns of one query (or one rollup definition)."""
+
+    def __init__(self, tables: Dict[str, str], joins: List[Tuple[str, str]], columns: Dict[str, dict]):
+        self.aliases = tables
+        self.tables = set(tables.values())
+        self.columns = columns
+        self.parent = {}
+        for left, right in joins:
+            self.parent[self._find(left)] = self._find(right)
+        self.join_pairs = {frozenset((left, right)) for left, right in joins}
+
+    def _find(self, ref: str) -> str:
+        while self.parent.get(ref, ref) != ref:
+            ref = self.parent[ref]
+        return ref
+
+    def canonical(self, ref: str) -> str:
+        """Return a deterministic representative of the column's join-equivalence class."""
+        root = self._find(ref)
+        members = [r for r in list(self.parent) + [ref] if self._find(r) == root]
+        return min(members)
+
+    def resolve(self, text: str) -> Optional[str]:
+        """Resolve a column reference to TABLE.COLUMN, or None if it is not a column of the query tables."""
+        parts = [_unquote(p) for p in text.split(".")]
+        column = parts[-1]
+        if len(parts) > 1:
+            table = self.aliases.get(parts[-2])
+            if table is None or column not in self.columns.get(table, {}):
+                raise _Unsupported(f"unknown column {text}")
+            return f"{table}.{column}"
+        candidates = [f"{t}.{column}" for t in sorted(self.tables) if column in self.columns.get(t, {})]
+        if not candidates:
+            return None
+        if len({self.canonical(c) for c in candidates}) > 1:
+            raise _Unsupported(f"ambiguous column {text}")
+        return candidates[0]
+
+def _parse_from(tokens: List[_Token], columns: Dict[str, dict]) -> _Scope:
+    tables, joins, i = {}, [], 0
+
+    def table_ref():
+        nonlocal i
+        if i >= len(tokens) or tokens[i].kind not in ("id", "qid", "ref"):
+            raise _Unsupported("expected table")
+        table = _unquote(tokens[i].text.split(".")[-1])
+        if table not in columns:
+            raise _Unsupported(f"unknown table {table}")
+        i += 1
+        alias = table
+        if i < len(tokens) and tokens[i].upper == "AS":
+            i += 1
+        if i < len(tokens) and tokens[i].kind in ("id", "qid") and tokens[i].upper not in ("JOIN", "INNER", "ON"):
+            alias = _unquote(tokens[i].text)
+            i += 1
+        tables[alias] = table
+        tables.setdefault(table, table)
+
+    table_ref()
+    raw_joins = []
+    while i < len(tokens):
+        if tokens[i].upper == "INNER":
+            i += 1
+        if i >= len(tokens) or tokens[i].upper != "JOIN":
+            raise _Unsupported("only inner JOIN ... ON is supported")
+        i += 1
+        table_ref()
+        if i >= len(tokens) or tokens[i].upper != "ON":
+            raise _Unsupported("JOIN without ON")
+        i += 1
+        while True:
+            if i + 2 >= len(tokens) or tokens[i + 1].text != "=" or tokens[i].kind != "ref" or tokens[i + 2].kind != "ref":
+                raise _Unsupported("join condition must be column equalities")
+            raw_joins.append((tokens[i].text, tokens[i + 2].text))
+            i += 3
+            if i < len(tokens) and tokens[i].upper == "AND":
+                i += 1
+                continue
+            break
+    scope = _Scope(tables, [], columns)
+    resolved = [(scope.resolve(left), scope.resolve(right)) for left, right in raw_joins]
+    return _Scope(tables, resolved, columns)
+
+def _matching_paren(tokens: List[_Token], start: int) -> int:
+    depth = 0
+    for j in range(start, len(tokens)):
+        if tokens[j].text == "(":
+            depth += 1
+        elif tokens[j].text == ")":
+            depth -= 1
+            if depth == 0:
+                return j
+    raise _Unsupported("unbalanced parentheses")
+
+def _canonical_expr(tokens: List[_Token], scope: _Scope) -> str:
+    parts = []
+    for token in tokens:
+        if token.kind in ("id", "qid", "ref"):
+            ref = scope.resolve(token.text)
+            parts.append(scope.canonical(ref) if ref else token.upper)
+        else:
+            parts.append(token.upper)
+    if len(parts) == 3 and parts[1] == "*":
+        parts = sorted([parts[0], parts[2]])
+        parts.insert(1, "*")
+    return "".join(parts)
+
+class _Rewriter:
+    def __init__(self, rollup: Rollup, scope: _Scope):
+        self.rollup = rollup
+        self.scope = scope
+        self.dims = {scope.canonical(d): dimension_name(d) for d in rollup.dimensions}
+        rollup_scope = _Scope({t: t for t in rollup.tables}, list(rollup.joins), scope.columns)
+        self.measures = {}
+        for m in rollup.measures:
+            self.measures[(m.func, _canonical_expr(_tokenize(m.expr), rollup_scope))] = m.name
+
+    def column(self, token: _Token) -> str:
+        ref = self.scope.resolve(token.text)
+        if ref is None:
+            return token.text
+        name = self.dims.get(self.scope.canonical(ref))
+        if name is None:
+            raise _Unsupported(f"{ref} is not a dimension of {self.rollup.name}")
+        return name
+
+    def aggregate(self, func: str, inner: List[_Token]) -> str:
+        # COUNT is 0, not NULL, when no rollup row matches the filter.
+        if func == "COUNT" and len(inner) == 1 and inner[0].text in ("*", "1"):
+            return "COALESCE(SUM(ROW_COUNT), 0)"
+        if inner and inner[0].upper == "DISTINCT" or func in ("MIN", "MAX"):
+            try:
+                return f"{func}({self.render(inner)})"
+            except _Unsupported:
+                if func not in ("MIN", "MAX"):
+                    raise
+        expr = _canonical_expr(inner, self.scope)
+        if func == "AVG":
+            total, count = self.measures.get(("SUM", expr)), self.measures.get(("COUNT", expr))
+            if total and count:
+                # "* 1.0" avoids integer division of integer measures (PostgreSQL, SQLite).
+                return f"(SUM({total}) * 1.0 / NULLIF(SUM({count}), 0))"
+            raise _Unsupported(f"AVG({expr}) not derivable from {self.rollup.name}")
+        measure = self.measures.get((func, expr))
+        if measure is None:
+            raise _Unsupported(f"{func}({expr}) not in {self.rollup.name}")
+        if func == "COUNT":
+            return f"COALESCE(SUM({measure}), 0)"
+        return f"{'SUM' if func == 'SUM' else func}({measure})"
+
+    def render(self, tokens: List[_Token]) -> str:
+        out, i = [], 0
+        while i < len(tokens):
+            token = tokens[i]
+            is_call = i + 1 < len(tokens) and tokens[i + 1].text == "("
+            if token.kind == "id" and is_call and token.upper in _AGGREGATES:
+                end = _matching_paren(tokens, i + 1)
+                out.append(self.aggregate(token.upper, tokens[i + 2:end]))
+                i = end + 1
+                continue
+            if token.kind in ("id", "qid", "ref") and not is_call and not (out and out[-1].upper() == "AS"):
+                out.append(self.column(token))
+            else:
+                out.append(token.text)
+            i += 1
+        sql = " ".join(out).replace("( ", "(").replace(" )", ")").replace(" ,", ",")
+        return re.sub(r"(\w) \(", r"\1(", sql)
+
+def _try_rewrite(clauses: Dict[str, List[_Token]], scope: _Scope, rollup: Rollup) -> str:
+    if rollup.tables != scope.tables or {frozenset(p) for p in rollup.joins} != scope.join_pairs:
+        raise _Unsupported("different tables or joins")
+    rewriter = _Rewriter(rollup, scope)
+    select_aliases = set()
+    select = clauses["SELECT"]
+    for j, token in enumerate(select):
+        if token.upper == "AS" and j + 1 < len(select):
+            select_aliases.add(_unquote(select[j + 1].text))
+    sql = f"SELECT {rewriter.render(select)} FROM {rollup.name}"
+    for clause, keyword in (("WHERE", "WHERE"), ("GROUP", "GROUP BY"), ("HAVING", "HAVING"), ("ORDER", "ORDER BY")):
+        if clause in clauses:
+            tokens = [
+                _Token("alias", t.text) if t.kind in ("id", "qid") and _unquote(t.text) in select_aliases else t
+                for t in clauses[clause]
+            ]
+            sql += f" {keyword} {rewriter.render(tokens)}"
+    if "LIMIT" in clauses:
+        sql += " " + " ".join(t.text for t in clauses["LIMIT"])
+    return sql + ";"
+
+def rewrite_query(sql: str, rollups: List[Rollup], columns: Optional[Dict[str, dict]] = None) -> Tuple[str, Optional[str]]:
+    """
+    Return (query, rollup_name): the query rewritten onto the first rollup
+    that can answer it, or the original query and None.
+    """
+    if not rollups:
+        return sql, None
+    columns = columns or ddl_columns()
+    try:
+        clauses = _split_clauses(_tokenize(sql))
+        if not any(t.upper in _AGGREGATES for t in clauses["SELECT"]):
+            return sql, None
+        scope = _parse_from(clauses["FROM"], columns)
+    except _Unsupported:
+        return sql, None
+    for rollup in rollups:
+        try:
+            return _try_rewrite(clauses, scope, rollup), rollup.name
+        except _Unsupported:
+            continue
+    return sql, None
+
+def main(argv=None):
+    import argparse
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description="Build or refresh the pre-aggregated rollup tables.")
+    parser.add_argument("command", choices=["build", "refresh"])
+    parser.add_argument("--uri", required=True, help="SQLAlchemy URI of the database holding the sales tables.")
+    parser.add_argument("--only", nargs="*", help="Rollup names to process (default: all).")
+    args = parser.parse_args(argv)
+
+    validate_rollups(ROLLUPS)
+    engine = create_engine(args.uri)
+    for rollup in ROLLUPS:
+        if args.only and rollup.name not in args.only:
+            continue
+        start = time.perf_counter()
+        if args.command == "build":
+            build_rollup(engine, rollup)
+        else:
+            refresh_rollup(engine, rollup)
+        print(f"{args.command} {rollup.name}: {time.perf_counter() - start:.2f}s")
+
+if __name__ == "__main__":
+    main()
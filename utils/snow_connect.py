@@ -1,8 +1,248 @@
-from typing import Any, Dict
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
 import json
+import logging
+import threading
+import time
 import requests
 import streamlit as st
-from snowflake.snowpark.session import Session
+
+from utils import freshness
+from utils.sql_utils import referenced_tables
+
+logger = logging.getLogger(__name__)
+
+# Seconds a caller waits for a free session before acquire() gives up.
+ACQUIRE_TIMEOUT = 60.0
+
+# Errors after which a session cannot be reused: lost connections and expired
+# or rejected logins. SQL errors (bad query, missing table) leave it healthy.
+SESSION_ERROR_NAMES = {"OperationalError", "InterfaceError", "SnowparkSessionException", "ConnectionError", "TimeoutError"}
+# Snowflake error codes for expired sessions, tokens and failed authentication.
+SESSION_ERROR_CODES = {390100, 390101, 390102, 390111, 390112, 390114, 390144, 390195, 390318}
+
+def is_session_error(exc: BaseException) -> bool:
+    if any(cls.__name__ in SESSION_ERROR_NAMES for cls in type(exc).__mro__):
+        return True
+    for attr in ("errno", "sql_error_code", "error_code"):
+        try:
+            if int(getattr(exc, attr, None) or 0) in SESSION_ERROR_CODES:
+                return True
+        except (TypeError, ValueError):
+            continue
+    return False
+
+def create_snowpark_session(connection_parameters: Dict[str, Any]):
+    from snowflake.snowpark.session import Session
+    session = Session.builder.configs(connection_parameters).create()
+    session.sql_simplifier_enabled = True
+    return session
+
+
+class SessionPool:
+    """
+    A bounded pool of Snowflake sessions shared by every SnowflakeConnection,
+    so repeated tool calls reuse a logged-in session instead of paying a full
+    login each time.
+
+    Sessions are pooled per role (more precisely per account, user, role,
+    warehouse, database and schema). Idle sessions are pinged by a background
+    heartbeat so they are not expired by Snowflake, and are closed once they
+    have been idle longer than `max_idle`.
+
+    Attributes
+    ----------
+    session_factory : Callable[[Dict[str, Any]], Any]
+        Creates a session from connection parameters. Any object with
+        `sql(query).collect()` and `close()` works, which allows the pool to
+        be exercised against a local fake session.
+    max_size : int
+        Maximum number of open sessions per role.
+    heartbeat_interval : float
+        Seconds between keep-alive pings of idle sessions.
+    max_idle : float
+        Seconds after which an idle session is closed.
+
+    Methods
+    -------
+    acquire(connection_parameters, timeout=ACQUIRE_TIMEOUT)
+        Returns a session, creating one if the role is below `max_size`;
+        raises TimeoutError if none frees up within `timeout` seconds.
+    release(session)
+        Returns a session to the pool.
+    session(connection_parameters, timeout=ACQUIRE_TIMEOUT)
+        Context manager around acquire/release.
+    warm_up(connection_parameters, blocking=True)
+        Resumes the configured warehouse so the first query does not wait for it.
+    close_all()
+        Stops the heartbeat and closes every pooled session.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[Dict[str, Any]], Any] = create_snowpark_session,
+        max_size: int = 4,
+        heartbeat_interval: float = 600.0,
+        max_idle: float = 3600.0,
+    ):
+        self.session_factory = session_factory
+        self.max_size = max_size
+        self.heartbeat_interval = heartbeat_interval
+        self.max_idle = max_idle
+        self._cond = threading.Condition()
+        self._idle: Dict[tuple, deque] = {}
+        self._open: Dict[tuple, int] = {}
+        self._keys: Dict[int, tuple] = {}
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    @staticmethod
+    def pool_key(connection_parameters: Dict[str, Any]) -> tuple:
+        return tuple(
+            connection_parameters.get(name)
+            for name in ("account", "user", "role", "warehouse", "database", "schema")
+        )
+
+    def acquire(self, connection_parameters: Dict[str, Any], timeout: Optional[float] = ACQUIRE_TIMEOUT):
+        key = self.pool_key(connection_parameters)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._start_heartbeat()
+            while True:
+                idle = self._idle.setdefault(key, deque())
+                if idle:
+                    session, _ = idle.pop()
+                    return session
+                if self._open.get(key, 0) < self.max_size:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"No Snowflake session available for role {connection_parameters.get('role')}")
+                self._cond.wait(remaining)
+        # Log in outside the lock so other roles are not blocked by a slow login.
+        try:
+            session = self.session_factory(connection_parameters)
+        except Exception:
+            with self._cond:
+                self._open[key] -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._keys[id(session)] = key
+        return session
+
+    def release(self, session, discard: bool = False) -> None:
+        with self._cond:
+            key = self._keys.get(id(session))
+            if key is None:
+                return
+            if discard or self._stop.is_set():
+                self._close(session, key)
+            else:
+                self._idle.setdefault(key, deque()).append((session, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def session(self, connection_parameters: Dict[str, Any], timeout: Optional[float] = ACQUIRE_TIMEOUT):
+        session = self.acquire(connection_parameters, timeout)
+        discard = False
+        try:
+            yield session
+        except Exception as e:
+            # A dead or logged-out session is never handed out again; one whose
+            # statement merely failed goes back to the pool.
+            discard = is_session_error(e)
+            raise
+        finally:
+            self.release(session, discard=discard)
+
+    def warm_up(self, connection_parameters: Dict[str, Any], blocking: bool = True) -> None:
+        def resume():
+            warehouse = connection_parameters.get("warehouse")
+            try:
+                with self.session(connection_parameters) as session:
+                    if warehouse:
+                        session.sql(f"ALTER WAREHOUSE {warehouse} RESUME IF SUSPENDED").collect()
+                    session.sql("SELECT 1").collect()
+            except Exception as e:
+                logger.warning("Warehouse warm-up failed: %s", e)
+
+        if blocking:
+            resume()
+        else:
+            threading.Thread(target=resume, name="snowflake-warm-up", daemon=True).start()
+
+    def close_all(self) -> None:
+        self._stop.set()
+        with self._cond:
+            for key, idle in self._idle.items():
+                while idle:
+                    session, _ = idle.pop()
+                    self._close(session, key)
+            self._cond.notify_all()
+
+    def _close(self, session, key: tuple) -> None:
+        self._keys.pop(id(session), None)
+        self._open[key] = max(0, self._open.get(key, 0) - 1)
+        try:
+            session.close()
+        except Exception as e:
+            logger.warning("Failed to close Snowflake session: %s", e)
+
+    def _start_heartbeat(self) -> None:
+        if self._heartbeat is None and self.heartbeat_interval > 0:
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="snowflake-heartbeat", daemon=True)
+            self._heartbeat.start()
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop.wait(self.heartbeat_interval):
+            self.ping_idle()
+
+    def ping_idle(self) -> None:
+        """
+        Ping the idle sessions one at a time, closing those that fail or have
+        idled past `max_idle`. Only the session being pinged is out of the pool,
+        so callers keep getting the others meanwhile.
+        """
+        now = time.monotonic()
+        with self._cond:
+            targets = [(key, item) for key, idle in self._idle.items() for item in idle]
+        for key, item in targets:
+            with self._cond:
+                idle = self._idle.get(key)
+                if idle is None or item not in idle:
+                    continue  # acquired since the snapshot
+                idle.remove(item)
+            session, idle_since = item
+            healthy = now - idle_since < self.max_idle
+            if healthy:
+                try:
+                    session.sql("SELECT 1").collect()
+                except Exception as e:
+                    logger.warning("Snowflake heartbeat failed, dropping session: %s", e)
+                    healthy = False
+            with self._cond:
+                if healthy and not self._stop.is_set():
+                    # Back at the cold end: acquire() hands out the most recently used first.
+                    self._idle.setdefault(key, deque()).appendleft(item)
+                else:
+                    self._close(session, key)
+                self._cond.notify()
+
+
+_default_pool: Optional[SessionPool] = None
+_default_pool_lock = threading.Lock()
+
+
+def get_session_pool() -> SessionPool:
+    """Return the process-wide session pool, created on first use."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = SessionPool(max_size=int(st.secrets.get("SNOWFLAKE_POOL_SIZE", 4)))
+        return _default_pool
 
 
 class SnowflakeConnection:
@@ -13,20 +253,22 @@ class SnowflakeConnection:
     ----------
     connection_parameters : Dict[str, Any]
         A dictionary containing the connection parameters for Snowflake.
-    session : snowflake.snowpark.Session
-        A Snowflake session object.
+    pool : SessionPool
+        The pool sessions are borrowed from.
 
     Methods
     -------
     get_session()
-        Establishes and returns the Snowflake connection session.
+        Context manager lending a Snowflake session from the pool.
     execute_query(query: str, use_cache: bool = True)
         Executes a Snowflake SQL query with optional caching.
     """
 
-    def __init__(self):
+    def __init__(self, role: Optional[str] = None, pool: Optional[SessionPool] = None):
         self.connection_parameters = self._get_connection_parameters_from_env()
-        self.session = None
+        if role:
+            self.connection_parameters["role"] = role
+        self.pool = pool or get_session_pool()
         self.cloudflare_account_id = st.secrets["CLOUDFLARE_ACCOUNT_ID"]
         self.cloudflare_namespace_id = st.secrets["CLOUDFLARE_NAMESPACE_ID"]
         self.cloudflare_api_token = st.secrets["CLOUDFLARE_API_TOKEN"]
@@ -49,14 +291,12 @@ class SnowflakeConnection:
 
     def get_session(self):
         """
-        Establishes and returns the Snowflake connection session.
+        Lend a Snowflake session from the pool for the duration of a `with`
+        block; it goes back to the pool when the block ends.
         Returns:
-            session: Snowflake connection session.
+            A context manager yielding the Snowflake connection session.
         """
-        if self.session is None:
-            self.session = Session.builder.configs(self.connection_parameters).create()
-            self.session.sql_simplifier_enabled = True
-        return self.session
+        return self.pool.session(self.connection_parameters)
 
     def _construct_kv_url(self, key: str) -> str:
         return f"https://api.cloudflare.com/client/v4/accounts/{self.cloudflare_account_id}/storage/kv/namespaces/{self.cloudflare_namespace_id}/values/{key}"
@@ -82,6 +322,14 @@ class SnowflakeConnection:
         except requests.exceptions.RequestException as e:
             print(f"Failed to set cache: {e}")
 
+    def delete_from_cache(self, key: str) -> None:
+        url = self._construct_kv_url(key)
+        try:
+            response = requests.delete(url, headers=self.headers)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logger.warning("Failed to delete cache entry: %s", e)
+
     def execute_query(self, query: str, use_cache: bool = True) -> str:
         """
         Execute a Snowflake SQL query with optional caching.
@@ -91,11 +339,13 @@ class SnowflakeConnection:
             if cached_response:
                 return json.loads(cached_response)
 
-        session = self.get_session()
-        result = session.sql(query).collect()
+        with self.get_session() as session:
+            result = session.sql(query).collect()
         result_list = [row.as_dict() for row in result]
 
         if use_cache:
             self.set_to_cache(query, result_list)
+            # Drop the KV entry once a table it reads changes (see utils.freshness).
+            freshness.on_change(referenced_tables(query), ("kv", query), lambda: self.delete_from_cache(query))
 
         return result_list
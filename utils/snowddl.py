@@ -1,29 +1,275 @@
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+_CREATE_TABLE = re.compile(r"create\s+(?:or\s+replace\s+)?table\s+([\w$.\"]+)\s*\(", re.I)
+_COLUMN = re.compile(r"^\s*([A-Za-z_][\w$]*)\s+([A-Za-z_]\w*(?:\s*\([\d,\s]+\))?)", re.I)
+_CONSTRAINT_KEYWORDS = {"PRIMARY", "FOREIGN", "UNIQUE", "CONSTRAINT", "CHECK"}
+_PRIMARY_KEY = re.compile(r"primary\s+key\s*\(([^)]*)\)", re.I)
+_FOREIGN_KEY = re.compile(r"foreign\s+key\s*\(([^)]*)\)\s*references\s+([\w$.\"]+)\s*\(([^)]*)\)", re.I)
+# Words in table names that say nothing about what a question is about.
+_GENERIC_NAME_PARTS = {"DETAILS", "ID", "DATA", "INFO"}
+# Business terms that imply a table without naming it.
+TERM_TABLES = {
+    "revenue": "TRANSACTIONS", "sales": "TRANSACTIONS", "sold": "TRANSACTIONS", "selling": "TRANSACTIONS",
+    "spent": "ORDER_DETAILS", "spend": "ORDER_DETAILS", "purchase": "ORDER_DETAILS", "bought": "ORDER_DETAILS",
+    "paid": "PAYMENTS",
+}
+# "last" only as in "last 30 days" or "last month", not "last name".
+_TIME_WORDS = re.compile(
+    r"\b(date|day|daily|week|weekly|month|monthly|quarter|year|yearly|annual|trend|over time|when|recent"
+    r"|last\s+(?:\d+\s+)?(?:days?|weeks?|months?|quarters?|years?))\b",
+    re.I,
+)
+
+def parse_columns(ddl: str) -> dict:
+    """
+    Return {column_name: type} for the first CREATE TABLE statement in `ddl`,
+    e.g. {"ORDER_ID": "NUMBER(38,0)", "ORDER_DATE": "DATE"}.
+    """
+    match = _CREATE_TABLE.search(ddl)
+    if not match:
+        return {}
+    body = ddl[match.end():ddl.rindex(")")]
+    columns = {}
+    depth, start = 0, 0
+    for i, ch in enumerate(body + ","):
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            column = _COLUMN.match(body[start:i])
+            if column and column.group(1).upper() not in _CONSTRAINT_KEYWORDS:
+                columns[column.group(1).upper()] = re.sub(r"\s+", "", column.group(2).upper())
+            start = i + 1
+    return columns
+
+def _names(text: str) -> List[str]:
+    return [name.strip().strip('"').upper() for name in text.split(",") if name.strip()]
+
+@dataclass
+class ForeignKey:
+    columns: List[str]
+    ref_table: str
+    ref_columns: List[str]
+    # True when the key is not declared but inferred from a column named like another table's primary key.
+    inferred: bool = False
+
+@dataclass
+class TableInfo:
+    name: str
+    columns: Dict[str, str]
+    primary_key: List[str] = field(default_factory=list)
+    foreign_keys: List[ForeignKey] = field(default_factory=list)
+
+def parse_table(ddl: str) -> Optional[TableInfo]:
+    """Parse the first CREATE TABLE statement in `ddl` into a TableInfo, or None."""
+    match = _CREATE_TABLE.search(ddl)
+    if not match:
+        return None
+    name = match.group(1).split(".")[-1].strip('"').upper()
+    primary_key = _PRIMARY_KEY.search(ddl)
+    foreign_keys = [
+        ForeignKey(_names(fk.group(1)), fk.group(2).split(".")[-1].strip('"').upper(), _names(fk.group(3)))
+        for fk in _FOREIGN_KEY.finditer(ddl)
+    ]
+    return TableInfo(name, parse_columns(ddl), _names(primary_key.group(1)) if primary_key else [], foreign_keys)
+
+class Catalog:
+    """
+    Structured, offline view of the schema in the DDL files: typed columns,
+    keys and a join graph between tables, built without touching the database.
+
+    Besides the declared foreign keys, a single-column key such as
+    TRANSACTIONS.PRODUCT_ID that matches another table's primary key is treated
+    as an (inferred) join, since the DDL does not always declare it.
+
+    Attributes:
+        tables (dict): TableInfo per upper-case table name.
+        joins (dict): {table: {neighbour: (column, neighbour_column)}}.
+
+    Methods:
+        match_tables: tables a question mentions by name or by a distinctive column.
+        join_path: shortest join path between two tables.
+        tables_for: the mentioned tables plus those on the paths joining them.
+        describe: prompt text for a set of tables and the joins between them.
+    """
+
+    def __init__(self, tables: List[TableInfo]):
+        self.tables = {table.name: table for table in tables}
+        self._infer_foreign_keys()
+        self.joins: Dict[str, Dict[str, Tuple[str, str]]] = {name: {} for name in self.tables}
+        for table in self.tables.values():
+            for fk in table.foreign_keys:
+                if fk.ref_table in self.tables and len(fk.columns) == 1:
+                    self.joins[table.name][fk.ref_table] = (fk.columns[0], fk.ref_columns[0])
+                    self.joins[fk.ref_table][table.name] = (fk.ref_columns[0], fk.columns[0])
+        # The graph is small, so every shortest path is computed once up front.
+        self._paths = {name: self._bfs(name) for name in self.tables}
+        self._keywords = self._build_keywords()
+
+    def _infer_foreign_keys(self) -> None:
+        owners = {t.primary_key[0]: t.name for t in self.tables.values() if len(t.primary_key) == 1}
+        for table in self.tables.values():
+            declared = {col for fk in table.foreign_keys for col in fk.columns}
+            for column in table.columns:
+                owner = owners.get(column)
+                if owner and owner != table.name and column not in declared and column not in table.primary_key:
+                    table.foreign_keys.append(ForeignKey([column], owner, [column], inferred=True))
+
+    def _bfs(self, start: str) -> Dict[str, List[str]]:
+        paths = {start: [start]}
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            for neighbour in sorted(self.joins[current]):
+                if neighbour not in paths:
+                    paths[neighbour] = paths[current] + [neighbour]
+                    queue.append(neighbour)
+        return paths
+
+    def _build_keywords(self) -> Dict[str, Set[str]]:
+        keywords: Dict[str, Set[str]] = {}
+        column_owners: Dict[str, Set[str]] = {}
+        for table in self.tables.values():
+            words = {table.name.lower().replace("_", " ")}
+            words.update(part.lower() for part in table.name.split("_") if part not in _GENERIC_NAME_PARTS)
+            for word in words:
+                keywords.setdefault(word, set()).add(table.name)
+            for column in table.columns:
+                column_owners.setdefault(column.lower().replace("_", " "), set()).add(table.name)
+        # Non-key columns that live in exactly one table point at it ("category" -> PRODUCTS).
+        for column, owners in column_owners.items():
+            if len(owners) == 1 and not column.endswith(" id"):
+                keywords.setdefault(column, set()).update(owners)
+        for term, table in TERM_TABLES.items():
+            if table in self.tables:
+                keywords.setdefault(term, set()).add(table)
+        return keywords
+
+    def join_path(self, start: str, end: str) -> Optional[List[str]]:
+        return self._paths.get(start, {}).get(end)
+
+    def match_tables(self, question: str) -> Set[str]:
+        """
+        Tables `question` mentions by name (singular or plural), by a column
+        only that table has, or by a business term from TERM_TABLES.
+        """
+        words = re.findall(r"[a-z0-9]+", question.lower())
+        singular = [w[:-3] + "y" if w.endswith("ies") else w[:-1] if w.endswith("s") and len(w) > 3 else w for w in words]
+        text = " " + " ".join(words) + " " + " ".join(singular) + " "
+        return {table for keyword, tables in self._keywords.items() if f" {keyword} " in text for table in tables}
+
+    def _connect(self, selected: List[str], candidates: List[str]) -> List[str]:
+        """Shortest join path from any selected table to any of `candidates`."""
+        paths = [self.join_path(c, target) for c in candidates for target in selected]
+        paths = [path for path in paths if path]
+        return min(paths, key=len) if paths else candidates[:1]
+
+    def tables_for(self, entities: Set[str], needs_date: bool = False) -> List[str]:
+        """
+        The tables in `entities` plus every table on the shortest join paths
+        connecting them; all tables when `entities` is empty. With `needs_date`,
+        the nearest table with a date column is joined in if none is selected.
+        """
+        entities = [name for name in sorted(entities) if name in self.tables]
+        if not entities:
+            return list(self.tables)
+        selected = [entities[0]]
+        for entity in entities[1:]:
+            # Connect each entity to the nearest already selected table.
+            selected += [name for name in self._connect(selected, [entity]) if name not in selected]
+        if needs_date and not any(self._has_date(name) for name in selected):
+            dated = [name for name in self.tables if self._has_date(name)]
+            if dated:
+                selected += [name for name in self._connect(selected, dated) if name not in selected]
+        return selected
+
+    def _has_date(self, table: str) -> bool:
+        return any(typ.startswith(("DATE", "TIMESTAMP")) for typ in self.tables[table].columns.values())
+
+    def describe(self, tables: List[str]) -> str:
+        lines = ["Database schema (tables relevant to the question):"]
+        for name in tables:
+            table = self.tables[name]
+            lines.append(f"\nTable: {name}")
+            lines.append("Columns: " + ", ".join(f"{col} ({typ})" for col, typ in table.columns.items()))
+            if table.primary_key:
+                lines.append(f"Primary key: {', '.join(table.primary_key)}")
+        joins = sorted({
+            tuple(sorted((f"{a}.{cols[0]}", f"{b}.{cols[1]}")))
+            for a in tables for b, cols in self.joins[a].items() if b in tables
+        })
+        if joins:
+            lines.append("\nJoins:")
+            lines += [f"  {left} = {right}" for left, right in joins]
+        return "\n".join(lines) + "\n"
+
+    def schema_prompt(self, question: str = "", extra_tables: Set[str] = frozenset()) -> str:
+        """Prompt text for the tables a question needs, plus `extra_tables` (e.g. those a query reads)."""
+        entities = self.match_tables(question) | set(extra_tables)
+        return self.describe(self.tables_for(entities, needs_date=bool(_TIME_WORDS.search(question))))
+
 class Snowddl:
     """
     Snowddl class loads DDL files for various tables in a database.
 
+    Files are read on first access rather than at construction, so creating
+    the object is free and the sidebar only reads the table it displays.
+
     Attributes:
+        ddl_files (dict): mapping of table names to their DDL file paths.
         ddl_dict (dict): dictionary of DDL files for various tables in a database.
 
     Methods:
+        get_ddl: loads the DDL for a single table.
+        get_columns: returns the parsed {column: type} mapping of a table.
+        catalog: parses every DDL file into a Catalog with the join graph.
         load_ddls: loads DDL files for various tables in a database.
     """
 
+    ddl_files = {
+        "TRANSACTIONS": "sql/ddl_transactions.sql",
+        "ORDER_DETAILS": "sql/ddl_orders.sql",
+        "PAYMENTS": "sql/ddl_payments.sql",
+        "PRODUCTS": "sql/ddl_products.sql",
+        "CUSTOMER_DETAILS": "sql/ddl_customer.sql",
+    }
+
     def __init__(self):
-        self.ddl_dict = self.load_ddls()
-
-    @staticmethod
-    def load_ddls():
-        ddl_files = {
-            "TRANSACTIONS": "sql/ddl_transactions.sql",
-            "ORDER_DETAILS": "sql/ddl_orders.sql",
-            "PAYMENTS": "sql/ddl_payments.sql",
-            "PRODUCTS": "sql/ddl_products.sql",
-            "CUSTOMER_DETAILS": "sql/ddl_customer.sql",
-        }
+        self._ddl_cache = {}
+        self._catalog: Optional[Catalog] = None
+
+    @property
+    def table_names(self):
+        return list(self.ddl_files.keys())
+
+    @property
+    def ddl_dict(self):
+        return {table_name: self.get_ddl(table_name) for table_name in self.ddl_files}
+
+    def get_ddl(self, table_name):
+        if table_name not in self._ddl_cache:
+            with open(self.ddl_files[table_name], "r") as f:
+                self._ddl_cache[table_name] = f.read()
+        return self._ddl_cache[table_name]
+
+    def get_columns(self, table_name):
+        return parse_columns(self.get_ddl(table_name))
+
+    @property
+    def catalog(self) -> Catalog:
+        if self._catalog is None:
+            tables = [parse_table(self.get_ddl(name)) for name in self.ddl_files]
+            self._catalog = Catalog([table for table in tables if table is not None])
+        return self._catalog
 
+    @classmethod
+    def load_ddls(cls):
         ddl_dict = {}
-        for table_name, file_name in ddl_files.items():
+        for table_name, file_name in cls.ddl_files.items():
             with open(file_name, "r") as f:
                 ddl_dict[table_name] = f.read()
         return ddl_dict
@@ -0,0 +1,252 @@
+# utils/sql_repair.py
+import re
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# Code fence anywhere in the model output, with or without a language tag.
+_FENCE = re.compile(r"```[ \t]*(?:sql|SQL)?[ \t]*\n?(.*?)```", re.S)
+_STATEMENT_START = re.compile(r"^[ \t]*(SELECT|WITH)\b", re.I | re.M)
+# Literals, quoted identifiers, backticked identifiers, words and everything else.
+_PIECES = re.compile(r"('(?:[^']|'')*')|(\"[^\"]+\")|(`[^`]+`)|([A-Za-z_][\w$]*)|(\s+|.)", re.S)
+_SELECT_TOP = re.compile(r"\bSELECT(\s+DISTINCT)?\s+TOP\s*(?:\(\s*(\d+)\s*\)|(\d+))", re.I)
+# A paragraph after a blank line that starts like a sentence ("This query joins ...")
+# rather than like SQL ("LEFT JOIN u ...", "SELECT * FROM x", "b, c").
+_PROSE = re.compile(r"\s*[A-Z][a-z']+[:,]?(?:[ \t]+[A-Za-z][a-z']*[:,]?){3,}")
+
+# Function names some models borrow from other dialects, with their portable spelling.
+FUNCTION_ALIASES = {
+    "postgresql": {"IFNULL": "COALESCE", "NVL": "COALESCE", "ISNULL": "COALESCE", "LEN": "LENGTH",
+                   "GETDATE": "CURRENT_TIMESTAMP", "SYSDATE": "CURRENT_TIMESTAMP"},
+    "snowflake": {"ISNULL": "COALESCE", "LEN": "LENGTH", "GETDATE": "CURRENT_TIMESTAMP"},
+}
+# Dialects that fold unquoted identifiers to one case.
+CASE_FOLD = {"postgresql": str.lower, "snowflake": str.upper}
+
+# Words never treated as identifiers when fixing case.
+_KEYWORDS = {
+    "SELECT", "FROM", "WHERE", "GROUP", "BY", "ORDER", "HAVING", "LIMIT", "OFFSET", "JOIN", "INNER",
+    "LEFT", "RIGHT", "FULL", "OUTER", "CROSS", "ON", "USING", "AS", "AND", "OR", "NOT", "IN", "IS",
+    "NULL", "LIKE", "ILIKE", "BETWEEN", "CASE", "WHEN", "THEN", "ELSE", "END", "DISTINCT", "WITH",
+    "UNION", "ALL", "EXCEPT", "INTERSECT", "ASC", "DESC", "OVER", "PARTITION", "DATE", "TIMESTAMP",
+    "INTERVAL", "CAST", "EXISTS", "TRUE", "FALSE", "FETCH", "FIRST", "ROWS", "ONLY", "QUALIFY",
+}
+
+class SQLRepairError(RuntimeError):
+    """The query still failed after local fixes and the model repair attempt."""
+
+    def __init__(self, query: str, error: BaseException):
+        super().__init__(str(error))
+        self.query = query
+        self.error = error
+
+# DB-API error classes raised for the query itself (syntax, unknown names, bad
+# casts), as opposed to OperationalError and InterfaceError for lost
+# connections, failed logins and timeouts, which no rewrite of the query fixes.
+QUERY_ERROR_NAMES = {"ProgrammingError", "DataError", "NotSupportedError", "SnowparkSQLException"}
+# Snowflake codes for statements cancelled or stopped by a timeout.
+CANCELLED_ERROR_CODES = {604, 630}
+# SQLite reports mistakes in the query as OperationalError too.
+_SQLITE_QUERY_ERROR = re.compile(r"no such (table|column|function)|syntax error|ambiguous column name", re.I)
+
+def is_query_error(exc: BaseException) -> bool:
+    """Whether `exc` was caused by the query text, so a corrected query may succeed."""
+    if getattr(exc, "connection_invalidated", False):
+        return False
+    errors = [e for e in (exc, getattr(exc, "orig", None)) if e is not None]
+    for error in errors:
+        for attr in ("errno", "sql_error_code", "error_code"):
+            try:
+                if int(getattr(error, attr, None) or 0) in CANCELLED_ERROR_CODES:
+                    return False
+            except (TypeError, ValueError):
+                continue
+    names = {cls.__name__ for error in errors for cls in type(error).__mro__}
+    if names & QUERY_ERROR_NAMES:
+        return True
+    return "OperationalError" in names and bool(_SQLITE_QUERY_ERROR.search(str(exc)))
+
+def extract_sql(text: str) -> str:
+    """
+    Return the single SQL statement in a model response, dropping code fences,
+    any prose before the statement and anything after its terminating semicolon.
+    """
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    start = _STATEMENT_START.search(text)
+    if start:
+        text = text[start.start():]
+    statement = []
+    for match in _PIECES.finditer(text):
+        piece = match.group()
+        if piece == ";":
+            break
+        statement.append(piece)
+    sql = "".join(statement).strip()
+    # Without a semicolon, prose often follows after a blank line; SQL split by
+    # blank lines (a CTE, then its SELECT) is kept.
+    paragraphs = re.split(r"\n\s*\n", sql)
+    for i, paragraph in enumerate(paragraphs[1:], 1):
+        first_word = re.match(r"\s*([A-Za-z_]\w*)", paragraph)
+        if _PROSE.match(paragraph) and first_word.group(1).upper() not in _KEYWORDS:
+            sql = "\n\n".join(paragraphs[:i]).strip()
+            break
+    return sql + ";"
+
+def _depth_zero_words(sql: str, start: int, end: int):
+    """Yield (position, upper-case word) of the words between `start` and `end` outside any parentheses."""
+    depth = 0
+    for match in _PIECES.finditer(sql, start, end):
+        piece = match.group()
+        if piece == "(":
+            depth += 1
+        elif piece == ")":
+            depth -= 1
+        elif match.group(4) and depth == 0:
+            yield match.start(), piece.upper()
+
+def _query_end(sql: str, start: int) -> int:
+    """End of the (sub)query containing `start`: its closing parenthesis, or the end of the statement."""
+    depth = 0
+    for match in _PIECES.finditer(sql, start):
+        piece = match.group()
+        if piece == "(":
+            depth += 1
+        elif piece == ")":
+            if depth == 0:
+                return match.start()
+            depth -= 1
+        elif piece == ";" and depth == 0:
+            return match.start()
+    return len(sql)
+
+def fix_dialect(sql: str, dialect: str) -> str:
+    """Rewrite constructs from other dialects: TOP n, backtick quoting and foreign function names."""
+    aliases = FUNCTION_ALIASES.get(dialect, {})
+    pieces = []
+    for match in _PIECES.finditer(sql):
+        piece = match.group()
+        if match.group(3):
+            piece = '"' + piece[1:-1] + '"'
+        elif match.group(4) and piece.upper() in aliases:
+            piece = aliases[piece.upper()]
+        pieces.append(piece)
+    sql = "".join(pieces)
+
+    top = _SELECT_TOP.search(sql)
+    if top:
+        sql = sql[:top.start()] + "SELECT" + (top.group(1) or "") + sql[top.end():]
+        # The row cap belongs to the (sub)query the TOP was in, unless that one already has a LIMIT.
+        end = _query_end(sql, top.start() + len("SELECT"))
+        if not any(word in ("LIMIT", "FETCH") for _, word in _depth_zero_words(sql, top.start(), end)):
+            body = sql[:end].rstrip()
+            sql = body + f" LIMIT {top.group(2) or top.group(3)}" + (sql[end:] if end < len(sql) else ";")
+    # CURRENT_TIMESTAMP takes no parentheses in PostgreSQL.
+    return re.sub(r"\bCURRENT_TIMESTAMP\s*\(\s*\)", "CURRENT_TIMESTAMP", sql)
+
+def fix_identifier_case(sql: str, identifiers: Iterable[str], dialect: str) -> str:
+    """
+    Match identifiers to the case the database stores them in. Quoted names
+    that only differ in case from a known table or column are re-quoted with
+    the stored name (Snowflake's "orders" becomes "ORDERS"), and unquoted names
+    whose folded form does not exist but whose stored form does are quoted.
+    """
+    fold = CASE_FOLD.get(dialect)
+    if fold is None:
+        return sql
+    known = set(identifiers)
+    by_lower: Dict[str, str] = {}
+    for name in known:
+        by_lower.setdefault(name.lower(), name)
+    pieces = []
+    for match in _PIECES.finditer(sql):
+        piece = match.group()
+        if match.group(2):
+            name = piece[1:-1]
+            stored = by_lower.get(name.lower())
+            if name not in known and stored is not None:
+                piece = stored if fold(stored) == stored and re.fullmatch(r"[A-Za-z_]\w*", stored) else f'"{stored}"'
+        elif match.group(4) and piece.upper() not in _KEYWORDS and fold(piece) not in known:
+            stored = by_lower.get(piece.lower())
+            if stored is not None and fold(stored) != stored:
+                piece = f'"{stored}"'
+        pieces.append(piece)
+    return "".join(pieces)
+
+def repair_locally(sql: str, dialect: str, identifiers: Iterable[str] = ()) -> str:
+    """Apply every local fix; returns `sql` unchanged when nothing applies."""
+    return fix_identifier_case(fix_dialect(extract_sql(sql), dialect), identifiers, dialect)
+
+def known_identifiers(engine) -> set:
+    """
+    Table and column names of `engine`'s default schema as the database stores
+    them, cached with the schema text. SQLAlchemy reports case-insensitive
+    Snowflake names in lower case, so those are upper-cased here.
+    """
+    from sqlalchemy import inspect
+    from utils.cache import schema_cache
+
+    def load():
+        inspector = inspect(engine)
+        names = set()
+        for table in inspector.get_table_names():
+            names.add(table)
+            names.update(col["name"] for col in inspector.get_columns(table))
+        if engine.dialect.name == "snowflake":
+            names = {name.upper() if name == name.lower() else name for name in names}
+        return names
+
+    return schema_cache.get_or_compute(("identifiers", str(engine.url)), load)
+
+def execute_with_repair(
+    query: str,
+    run: Callable[[str], object],
+    dialect: str,
+    identifiers: Callable[[], Iterable[str]] = tuple,
+    repair_with_llm: Optional[Callable[[str, str], str]] = None,
+    prepare: Callable[[str], str] = lambda query: query,
+) -> Tuple[object, str]:
+    """
+    Run `query`; if the database rejects it, retry it after the local fixes,
+    and if that still fails, ask `repair_with_llm(query, error)` once for a
+    corrected query, which `prepare` then rewrites the way generated queries
+    are (value snapping, rollups, sampling). `identifiers` is only called once
+    a query has failed, so successful queries never pay for schema
+    introspection.
+
+    Only errors in the query itself are repaired (see is_query_error); lost
+    connections, rejected logins and timeouts are raised as they are.
+
+    Returns (result, query that produced it). Raises SQLRepairError with the
+    last query and database error when every attempt fails.
+    """
+    try:
+        return run(query), query
+    except Exception as e:
+        if not is_query_error(e):
+            raise
+        error = e
+    try:
+        identifiers = set(identifiers())
+    except Exception:
+        identifiers = set()
+    repaired = repair_locally(query, dialect, identifiers)
+    if repaired != query:
+        try:
+            return run(repaired), repaired
+        except Exception as e:
+            if not is_query_error(e):
+                raise
+            query, error = repaired, e
+    if repair_with_llm is None:
+        raise SQLRepairError(query, error) from error
+    try:
+        repaired = prepare(repair_locally(repair_with_llm(query, str(error)), dialect, identifiers))
+    except Exception:
+        # The model is unavailable; report the database error instead.
+        raise SQLRepairError(query, error) from error
+    try:
+        return run(repaired), repaired
+    except Exception as e:
+        if not is_query_error(e):
+            raise
+        raise SQLRepairError(repaired, e) from e
@@ -0,0 +1,58 @@
+# utils/sql_utils.py
+import re
+
+_STRINGS_AND_COMMENTS = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.S)
+_FROM_OR_JOIN = re.compile(r"\b(FROM|JOIN)\b", re.I)
+_FROM_CLAUSE_END = re.compile(
+    r"\b(WHERE|GROUP|ORDER|HAVING|LIMIT|QUALIFY|UNION|INTERSECT|EXCEPT|MINUS|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|NATURAL|ON|USING|WINDOW|FETCH|OFFSET|SAMPLE|TABLESAMPLE)\b|[();]",
+    re.I,
+)
+_IDENTIFIER = re.compile(r'\s*((?:"[^"]+"|[A-Za-z_][\w$]*)(?:\s*\.\s*(?:"[^"]+"|[A-Za-z_][\w$]*))*)')
+# FROM used inside EXTRACT(x FROM y), TRIM(... FROM y) or IS DISTINCT FROM is not a table reference.
+_NON_TABLE_FROM = re.compile(r"(\b(?:EXTRACT|SUBSTRING|TRIM|OVERLAY|POSITION)\s*\([^()]*|\bDISTINCT\s*)$", re.I)
+_CTE_NAME = re.compile(r'(?:\bWITH(?:\s+RECURSIVE)?|,)\s*("[^"]+"|[A-Za-z_][\w$]*)\s*(?:\([^)]*\)\s*)?AS\s*\(', re.I)
+# What a single SELECT/WITH statement can still write or lock: data-modifying
+# CTEs (PostgreSQL), SELECT ... INTO (creates a table) and row locks.
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|INTO)\b|\bFOR\s+(?:KEY\s+)?SHARE\b", re.I)
+
+def strip_literals(sql: str) -> str:
+    """Blank out string literals and comments so keyword searches do not match inside them."""
+    return _STRINGS_AND_COMMENTS.sub(lambda m: "''" if m.group(0).startswith("'") else " ", sql)
+
+def is_read_only(sql: str) -> bool:
+    """
+    True when `sql` is a single SELECT (or WITH ... SELECT) statement that
+    neither writes nor locks rows. This is a keyword scan, so it errs on the
+    side of rejecting (a column named "update" fails it).
+    """
+    text = strip_literals(sql).strip().rstrip(";").strip()
+    return bool(re.match(r"(SELECT|WITH)\b", text, re.I)) and ";" not in text and not _WRITES.search(text)
+
+def normalize_identifier(name: str) -> str:
+    """Return the upper-case, unquoted last part of a (possibly qualified) identifier."""
+    return name.split(".")[-1].strip().strip('"').upper()
+
+def referenced_tables(sql: str) -> set:
+    """
+    Return the upper-case names of the tables a query reads from (FROM and
+    JOIN targets, including comma joins), excluding CTE names. This is a
+    lightweight scan, not a full parser; table functions and subqueries are
+    skipped.
+    """
+    text = strip_literals(sql)
+    ctes = {normalize_identifier(m.group(1)) for m in _CTE_NAME.finditer(text)}
+    tables = set()
+    for match in _FROM_OR_JOIN.finditer(text):
+        if _NON_TABLE_FROM.search(text[:match.start()]):
+            continue
+        rest = text[match.end():]
+        if match.group(1).upper() == "FROM":
+            end = _FROM_CLAUSE_END.search(rest)
+            items = rest[:end.start() if end else len(rest)].split(",")
+        else:
+            items = [rest]
+        for item in items:
+            ident = _IDENTIFIER.match(item)
+            if ident and not item[ident.end():].lstrip().startswith("("):
+                tables.add(normalize_identifier(ident.group(1)))
+    return tables - ctes - {""}
@@ -0,0 +1,258 @@
+# utils/value_index.py
+import logging
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from utils.cache import schema_cache
+from utils.sql_utils import normalize_identifier, referenced_tables
+
+logger = logging.getLogger(__name__)
+
+# Text columns with more distinct values than this (names, emails, addresses)
+# are not indexed: listing them would not fit a prompt and guessing them is rare.
+MAX_DISTINCT = 200
+MAX_VALUE_LENGTH = 100
+# Jaccard similarity of trigram sets (as in PostgreSQL's pg_trgm).
+HINT_THRESHOLD = 0.45
+SNAP_THRESHOLD = 0.5
+
+_WORD = re.compile(r"[A-Za-z0-9][\w&'-]*")
+_STOPWORDS = {
+    "the", "and", "for", "with", "from", "that", "this", "what", "which", "who", "how", "many",
+    "much", "show", "list", "give", "all", "each", "per", "are", "was", "were", "have", "has",
+    "total", "number", "count", "top", "most", "least", "chart", "plot", "graph", "by", "of",
+    "in", "on", "to", "is", "me", "a", "an",
+}
+# `column = 'literal'`, `column <> 'literal'` and `column IN ('a', 'b')`. Columns
+# wrapped in a function (LOWER(col) = 'x') do not match and are left alone.
+_COMPARISON = re.compile(
+    r'''(?P<col>(?:"[^"]+"|[A-Za-z_][\w$]*)(?:\s*\.\s*(?:"[^"]+"|[A-Za-z_][\w$]*))*)\s*'''
+    r"(?:(?:=|<>|!=)\s*(?P<one>'(?:[^']|'')*')|(?:NOT\s+)?IN\s*\((?P<many>\s*'(?:[^']|'')*'(?:\s*,\s*'(?:[^']|'')*')*\s*)\))",
+    re.I,
+)
+_LITERAL = re.compile(r"'((?:[^']|'')*)'")
+
+def trigrams(text: str) -> Set[str]:
+    """Trigrams of each lower-cased word of `text`, padded like pg_trgm."""
+    grams = set()
+    for word in re.findall(r"\w+", text.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class ValueIndex:
+    """
+    Distinct values of the low-cardinality text columns of one database, with
+    a trigram index for fuzzy lookup.
+
+    Attributes:
+        columns (dict): {(TABLE, COLUMN): [values]} as stored in the database.
+
+    Methods:
+        lookup: returns the values closest to a piece of text.
+        hints: returns prompt text listing the values a question refers to.
+        snap: replaces literals in a query with the closest stored values.
+    """
+
+    def __init__(self, columns: Dict[Tuple[str, str], List[str]]):
+        self.columns = columns
+        self._entries: List[Tuple[str, str, str, Set[str]]] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        for (table, column), values in columns.items():
+            for value in values:
+                grams = trigrams(value)
+                for gram in grams:
+                    self._postings[gram].append(len(self._entries))
+                self._entries.append((table, column, value, grams))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, text: str, threshold: float = HINT_THRESHOLD, columns=None, limit: int = 5) -> List[Tuple[float, str, str, str]]:
+        """
+        Return up to `limit` (score, TABLE, COLUMN, value) entries whose trigram
+        similarity to `text` is at least `threshold`, best first, optionally
+        restricted to `columns` ({(TABLE, COLUMN)}).
+        """
+        grams = trigrams(text)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for i in self._postings.get(gram, ()):
+                shared[i] += 1
+        matches = []
+        for i, common in shared.items():
+            table, column, value, value_grams = self._entries[i]
+            if columns is not None and (table, column) not in columns:
+                continue
+            score = common / (len(grams) + len(value_grams) - common)  # |A & B| / |A | B|
+            if score >= threshold:
+                matches.append((score, table, column, value))
+        matches.sort(key=lambda match: -match[0])
+        return matches[:limit]
+
+    def hints(self, question: str, tables=None, limit: int = 12) -> str:
+        """
+        Prompt text listing the stored values that phrases of `question` (one to
+        three words) resemble, so the model writes them exactly. Empty when
+        nothing matches.
+        """
+        words = _WORD.findall(question)
+        phrases = {
+            " ".join(words[i:i + n])
+            for n in (1, 2, 3)
+            for i in range(len(words) - n + 1)
+            if not all(w.lower() in _STOPWORDS or len(w) < 3 for w in words[i:i + n])
+        }
+        columns = None
+        if tables:
+            wanted = {normalize_identifier(t) for t in tables}
+            columns = {key for key in self.columns if key[0] in wanted}
+        best: Dict[Tuple[str, str, str], float] = {}
+        for phrase in phrases:
+            for score, table, column, value in self.lookup(phrase, columns=columns):
+                key = (table, column, value)
+                best[key] = max(score, best.get(key, 0.0))
+        if not best:
+            return ""
+        chosen = sorted(best.items(), key=lambda item: -item[1])[:limit]
+        by_column: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+        for (table, column, value), _ in chosen:
+            by_column[(table, column)].append("'" + value.replace("'", "''") + "'")
+        lines = [f"{table}.{column}: {', '.join(values)}" for (table, column), values in by_column.items()]
+        return "\nStored values that match the question (use these exact literals in filters):\n" + "\n".join(lines) + "\n"
+
+    def snap(self, query: str) -> Tuple[str, List[Tuple[str, str]]]:
+        """
+        Replace string literals compared with an indexed column (=, <>, IN) by
+        the stored value they most resemble, when they are not stored values
+        already. Returns (query, [(old, new)]). Columns are resolved against
+        the tables the query reads; ambiguous or unknown columns are left alone.
+        """
+        tables = referenced_tables(query)
+        by_column: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        for table, column in self.columns:
+            if table in tables:
+                by_column[column].append((table, column))
+        changes = []
+
+        def snap_literal(literal: str, keys) -> str:
+            value = literal[1:-1].replace("''", "'")
+            stored = [v for key in keys for v in self.columns[key]]
+            if value in stored:
+                return literal
+            # Case differences first: 'electronics' -> 'Electronics'.
+            new = next((v for v in stored if v.lower() == value.lower()), None)
+            if new is None:
+                matches = self.lookup(value, SNAP_THRESHOLD, columns=set(keys), limit=2)
+                # Only snap when one value is clearly the closest.
+                if matches and (len(matches) == 1 or matches[0][0] > matches[1][0]):
+                    new = matches[0][3]
+            if new is None:
+                return literal
+            changes.append((value, new))
+            return "'" + new.replace("'", "''") + "'"
+
+        def replace(match: re.Match) -> str:
+            keys = by_column.get(normalize_identifier(match.group("col")))
+            if not keys or (len(keys) > 1 and "." not in match.group("col")):
+                return match.group(0)
+            if "." in match.group("col"):
+                table = normalize_identifier(match.group("col").rsplit(".", 1)[0])
+                keys = [key for key in keys if key[0] == table] or keys
+            start = match.start("one") if match.group("one") else match.start("many")
+            head = match.group(0)[:start - match.start()]
+            tail = match.group(0)[(match.end("one") if match.group("one") else match.end("many")) - match.start():]
+            body = match.group("one") or match.group("many")
+            return head + _LITERAL.sub(lambda lit: snap_literal(lit.group(0), keys), body) + tail
+
+        return _COMPARISON.sub(replace, query), changes
+
+def build_value_index(engine, max_distinct: int = MAX_DISTINCT) -> ValueIndex:
+    """
+    Read the distinct values of every text column of `engine`'s default schema
+    that has at most `max_distinct` of them. One DISTINCT query per column,
+    capped at `max_distinct` + 1 rows.
+    """
+    from sqlalchemy import inspect, text
+    from sqlalchemy.types import String
+
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    columns: Dict[Tuple[str, str], List[str]] = {}
+    with engine.connect() as conn:
+        for table in inspector.get_table_names():
+            for col in inspector.get_columns(table):
+                if not isinstance(col["type"], String):
+                    continue
+                name = preparer.quote(col["name"])
+                rows = conn.execute(text(
+                    f"SELECT DISTINCT {name} FROM {preparer.quote(table)} WHERE {name} IS NOT NULL LIMIT {max_distinct + 1}"
+                )).fetchall()
+                values = [str(row[0]) for row in rows]
+                if 0 < len(values) <= max_distinct and max(map(len, values)) <= MAX_VALUE_LENGTH:
+                    columns[(table.upper(), col["name"].upper())] = sorted(values)
+    return ValueIndex(columns)
+
+_building: Set[str] = set()
+_building_lock = threading.Lock()
+_load_lock = threading.Lock()
+
+def _key(engine) -> tuple:
+    return ("values", str(engine.url))
+
+def load_value_index(engine) -> ValueIndex:
+    """
+    Build (or return the cached) value index of `engine`; used by the
+    connection warm-up. The index is dropped when one of the tables it holds
+    values of changes, not on every data change.
+    """
+    from utils.freshness import dependencies
+    with _load_lock:
+        index = schema_cache.get(_key(engine))
+        if index is None:
+            index = build_value_index(engine)
+            # Its tables are only known once built, hence set() rather than get_or_compute().
+            tables = dependencies(engine, {table for table, _ in index.columns})
+            schema_cache.set(_key(engine), index, ttl=3600.0, tables=tables)
+    return index
+
+def get_value_index(engine) -> Optional[ValueIndex]:
+    """
+    Return the value index of `engine` if it is built. Otherwise start building
+    it in a background thread and return None, so a turn never waits for it.
+    """
+    index = schema_cache.get(_key(engine))
+    if index is not None:
+        return index
+    url = str(engine.url)
+    with _building_lock:
+        if url in _building:
+            return None
+        _building.add(url)
+
+    def build():
+        try:
+            load_value_index(engine)
+        except Exception as e:
+            logger.warning("Value index build failed: %s", e)
+        finally:
+            with _building_lock:
+                _building.discard(url)
+
+    threading.Thread(target=build, name="value index", daemon=True).start()
+    return None
+
+def value_hints(engine, question: str, tables=None) -> str:
+    index = get_value_index(engine)
+    return index.hints(question, tables) if index is not None else ""
+
+def snap_literals(engine, query: str) -> str:
+    index = get_value_index(engine)
+    if index is None:
+        return query
+    query, changes = index.snap(query)
+    for old, new in changes:
+        logger.info("Snapped literal '%s' to stored value '%s'", old, new)
+    return query
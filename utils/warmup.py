@@ -0,0 +1,134 @@
+# utils/warmup.py
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+class WarmupTask:
+    """
+    Runs a list of preparation steps in a background thread right after a
+    database connects, so the first question does not pay for them in series.
+
+    Attributes:
+        name (str): what is being warmed up (shown in the sidebar).
+        steps (list): (label, callable) pairs, run in order.
+
+    Methods:
+        start: starts the background thread.
+        summary: returns (label, status, seconds) for every step.
+    """
+
+    def __init__(self, name: str, steps: List[Tuple[str, Callable[[], object]]]):
+        self.name = name
+        self.steps = steps
+        self.status: Dict[str, str] = {label: "pending" for label, _ in steps}
+        self.seconds: Dict[str, float] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> "WarmupTask":
+        self._thread = threading.Thread(target=self.run, name=f"warm-up {self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self) -> None:
+        for label, step in self.steps:
+            with self._lock:
+                self.status[label] = "running"
+            start = time.perf_counter()
+            try:
+                step()
+                status = "done"
+            except Exception as e:
+                # A failed step is reported but does not stop the others; the
+                # first question simply does that work itself.
+                status = f"failed: {e}"
+            with self._lock:
+                self.seconds[label] = time.perf_counter() - start
+                self.status[label] = status
+
+    @property
+    def finished(self) -> int:
+        with self._lock:
+            return sum(1 for s in self.status.values() if s not in ("pending", "running"))
+
+    @property
+    def progress(self) -> float:
+        return self.finished / len(self.steps) if self.steps else 1.0
+
+    @property
+    def done(self) -> bool:
+        return self.finished == len(self.steps)
+
+    @property
+    def failed(self) -> bool:
+        with self._lock:
+            return any(s.startswith("failed") for s in self.status.values())
+
+    @property
+    def headline(self) -> str:
+        if not self.done:
+            with self._lock:
+                running = next((label for label, s in self.status.items() if s == "running"), "starting")
+            return f"warming up {self.name}: {running}..."
+        total = sum(self.seconds.values())
+        return f"{self.name} ready in {total:.1f}s" + (" (some steps failed)" if self.failed else "")
+
+    def summary(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return [(label, self.status[label], self.seconds.get(label, 0.0)) for label, _ in self.steps]
+
+_tasks: Dict[str, WarmupTask] = {}
+_tasks_lock = threading.Lock()
+
+def get_task(key: str) -> Optional[WarmupTask]:
+    with _tasks_lock:
+        return _tasks.get(key)
+
+def start_task(key: str, name: str, steps: List[Tuple[str, Callable[[], object]]], retry_failed: bool = False) -> WarmupTask:
+    """
+    Start warming up `key` unless a task for it already exists. A finished task
+    with failed steps is only started again when `retry_failed` is set.
+    """
+    with _tasks_lock:
+        task = _tasks.get(key)
+        if task is not None and not (retry_failed and task.done and task.failed):
+            return task
+        task = _tasks[key] = WarmupTask(name, steps)
+    return task.start()
+
+def open_pool(engine, connections: int = 2) -> None:
+    """Check out `connections` pooled connections at once so the pool keeps them open."""
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    finally:
+        for conn in opened:
+            conn.close()
+
+def start_connection_warmup(backend, db, name: str, resume_warehouse: bool = False, retry_failed: bool = False) -> WarmupTask:
+    """
+    Warm up everything the first question on `db` needs, using the chat
+    backend module (local_chat or snowflake_chat) that will answer it.
+    """
+    from utils import freshness
+    from utils.rollups import available_rollups
+    from utils.value_index import load_value_index
+
+    engine = db._engine
+    steps = [
+        ("Build LLM chains", lambda: (backend.get_sql_chain(), backend.get_response_chain())),
+        ("Open pooled connections", lambda: open_pool(engine)),
+    ]
+    if resume_warehouse:
+        steps.append(("Resume warehouse", lambda: backend.resume_warehouse(db)))
+    steps += [
+        # Started before anything is cached, so a change made while the caches
+        # below are filled still invalidates them.
+        ("Watch for data changes", lambda: freshness.watch(engine)),
+        # Backends with an offline DDL catalog build their schema prompt from it instead of the database.
+        ("Load schema catalog", lambda: getattr(backend, "get_schema_info", backend.get_database_info)(db)),
+        ("Check rollup tables", lambda: available_rollups(engine)),
+        ("Index column values", lambda: load_value_index(engine)),
+    ]
+    return start_task(str(engine.url), name, steps, retry_failed)
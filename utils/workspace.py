@@ -0,0 +1,126 @@
+# utils/workspace.py
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from utils.sql_utils import referenced_tables
+
+LAST_RESULT = "LAST_RESULT"
+
+class ResultWorkspace:
+    """
+    Per-session store of earlier query results, kept as named in-process
+    tables so follow-ups ("only the top 5 of those", "now as a pie chart")
+    run locally instead of going back to the warehouse.
+
+    Each result is registered as RESULT_<n>, and the most recent one is also
+    reachable as LAST_RESULT. Queries run on DuckDB when it is installed and
+    on an in-memory SQLite database otherwise. Tables are evicted least
+    recently used first once their total size exceeds `max_bytes`.
+
+    Attributes:
+        max_bytes (int): memory cap for all stored results.
+        max_tables (int): maximum number of stored results.
+
+    Methods:
+        add: stores a result and returns its table name.
+        can_answer: whether a query only reads workspace tables.
+        query: runs a query against the workspace tables.
+        describe: returns the prompt section listing the workspace tables.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_tables: int = 10):
+        self.max_bytes = max_bytes
+        self.max_tables = max_tables
+        self._tables = OrderedDict()
+        self._counter = 0
+        self._last = None
+        self._lock = threading.Lock()
+
+    @property
+    def names(self) -> list:
+        with self._lock:
+            names = list(self._tables.keys())
+        return names + [LAST_RESULT] if names else []
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(entry["bytes"] for entry in self._tables.values())
+
+    def add(self, df: pd.DataFrame, sql: str = "", question: str = "") -> str:
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if df.empty or nbytes > self.max_bytes:
+            return ""
+        with self._lock:
+            self._counter += 1
+            name = f"RESULT_{self._counter}"
+            self._tables[name] = {"df": df, "bytes": nbytes, "sql": sql, "question": question}
+            self._last = name
+            self._evict()
+        return name
+
+    def get(self, name: str) -> pd.DataFrame:
+        with self._lock:
+            key = self._resolve(name.upper())
+            self._tables.move_to_end(key)
+            return self._tables[key]["df"]
+
+    def can_answer(self, sql: str) -> bool:
+        tables = referenced_tables(sql)
+        available = set(self.names)
+        return bool(tables) and tables <= available
+
+    def query(self, sql: str) -> pd.DataFrame:
+        frames = {name: self.get(name) for name in referenced_tables(sql)}
+        statement = sql.strip().rstrip(";")
+        try:
+            import duckdb
+        except ImportError:
+            duckdb = None
+        if duckdb is not None:
+            con = duckdb.connect()
+            try:
+                for name, df in frames.items():
+                    con.register(name, df)
+                return con.execute(statement).df()
+            finally:
+                con.close()
+        con = sqlite3.connect(":memory:")
+        try:
+            for name, df in frames.items():
+                df.to_sql(name, con, index=False)
+            return pd.read_sql_query(statement, con)
+        finally:
+            con.close()
+
+    def describe(self) -> str:
+        with self._lock:
+            if not self._tables:
+                return ""
+            lines = [
+                "\nSession result tables (earlier answers held locally; when the question refines an earlier "
+                f"result, query these by name with standard SQL, {LAST_RESULT} is the most recent one, "
+                "and never join them with database tables):"
+            ]
+            for name, entry in reversed(self._tables.items()):
+                df = entry["df"]
+                cols = ", ".join(f"{col} ({dtype})" for col, dtype in df.dtypes.astype(str).items())
+                lines.append(f"Table: {name} ({len(df)} rows) from question: {entry['question']!r}\nColumns: {cols}")
+            return "\n".join(lines) + "\n"
+
+    def _resolve(self, name: str) -> str:
+        if name == LAST_RESULT:
+            if not self._tables:
+                raise KeyError(name)
+            return self._last if self._last in self._tables else next(reversed(self._tables))
+        return name
+
+    def _evict(self) -> None:
+        while len(self._tables) > 1 and (
+            len(self._tables) > self.max_tables
+            or sum(entry["bytes"] for entry in self._tables.values()) > self.max_bytes
+        ):
+            self._tables.popitem(last=False)